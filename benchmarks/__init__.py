@@ -0,0 +1 @@
+# benchmarks — замеры производительности бота (запуск: python -m benchmarks.<модуль>)
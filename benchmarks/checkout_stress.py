@@ -0,0 +1,196 @@
+# benchmarks/checkout_stress.py
+"""
+Нагрузочная проверка резерва: сотни покупателей одновременно берут один
+популярный вариант, часть отменяет корзину, часть не успевает оформить,
+параллельно работает снятие просроченных резервов.
+
+Инвариант: остаток никогда не уходит в минус, и
+остаток + (в корзинах и оформлено) == начальный остаток.
+
+    python -m benchmarks.checkout_stress [покупателей] [остаток]
+
+Режимы:
+  threads — у каждого покупателя своё соединение и своя транзакция BEGIN IMMEDIATE
+            (конкуренция нескольких писателей за условный UPDATE);
+  writer  — как в боте: корутины через database.transaction и очередь записи.
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import checkout
+import database
+
+TTL = 30
+
+
+def _setup(path, stock):
+    database.DB_NAME = path
+    database.init_db()
+    conn = database.get_connection()
+    cat_id = conn.execute("SELECT id FROM categories ORDER BY id LIMIT 1").fetchone()[0]
+    prod_id = conn.execute("INSERT INTO products (brand, category_id) VALUES (?, ?)", ("Stress", cat_id)).lastrowid
+    var_id = conn.execute(
+        "INSERT INTO variants (product_id, option, price, stock) VALUES (?, ?, ?, ?)", (prod_id, "hot", 100, stock)
+    ).lastrowid
+    conn.commit()
+    conn.close()
+    return var_id
+
+def _plan(buyers, seed=1):
+    """Для каждого покупателя: (user_id, qty, что делать после резерва)."""
+    rnd = random.Random(seed)
+    return [(10_000 + i, rnd.randint(1, 3), rnd.choice(("confirm", "confirm", "cancel", "expire")))
+            for i in range(buyers)]
+
+def _check(var_id, initial):
+    conn = database.get_connection()
+    try:
+        stock = conn.execute("SELECT stock FROM variants WHERE id = ?", (var_id,)).fetchone()[0]
+        held = conn.execute("""
+            SELECT COALESCE(SUM(oi.qty), 0) FROM order_items oi JOIN orders o ON o.id = oi.order_id
+            WHERE oi.variant_id = ? AND o.status IN (?, ?)
+        """, (var_id, checkout.CART, checkout.CONFIRMED)).fetchone()[0]
+        sold = conn.execute("""
+            SELECT COALESCE(SUM(oi.qty), 0) FROM order_items oi JOIN orders o ON o.id = oi.order_id
+            WHERE oi.variant_id = ? AND o.status = ?
+        """, (var_id, checkout.CONFIRMED)).fetchone()[0]
+    finally:
+        conn.close()
+    assert stock >= 0, f"oversell: stock={stock}"
+    assert stock + held == initial, f"stock {stock} + held {held} != {initial}"
+    return stock, sold
+
+
+class Stats:
+    def __init__(self):
+        self.reserved = 0
+        self.out_of_stock = 0
+        self.confirmed = 0
+        self.released = 0
+        self.min_stock = None
+        self._lock = threading.Lock()
+
+    def add(self, **kw):
+        with self._lock:
+            for name, value in kw.items():
+                if name == "stock":
+                    self.min_stock = value if self.min_stock is None else min(self.min_stock, value)
+                else:
+                    setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        return {k: v for k, v in vars(self).items() if not k.startswith("_")}
+
+
+# ---------- threads ----------
+def _thread_buyer(var_id, user_id, qty, action, stats):
+    conn = database.get_connection()
+    try:
+        ttl = 0 if action == "expire" else TTL
+        try:
+            res = database.run_immediate(conn, checkout.reserve, user_id, user_id, var_id, qty, ttl)
+        except checkout.OutOfStock:
+            stats.add(out_of_stock=1)
+            return
+        stats.add(reserved=1, stock=res.stock)
+        if action == "cancel":
+            database.run_immediate(conn, checkout.release, res.order_id, checkout.CANCELLED, user_id)
+            stats.add(released=1)
+        elif database.run_immediate(conn, checkout.confirm, res.order_id, user_id):
+            stats.add(confirmed=1)
+    finally:
+        conn.close()
+
+def run_threads(buyers, stock, workers=64):
+    path = os.path.join(tempfile.mkdtemp(), "stress.db")
+    var_id = _setup(path, stock)
+    stats = Stats()
+    stop = threading.Event()
+
+    def sweeper():
+        conn = database.get_connection()
+        while not stop.is_set():
+            database.run_immediate(conn, checkout.expire_due)
+            time.sleep(0.001)
+        conn.close()
+
+    sweep = threading.Thread(target=sweeper)
+    sweep.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_thread_buyer, var_id, *p, stats) for p in _plan(buyers)]
+        for f in futures:
+            f.result()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    sweep.join()
+    return _report("threads", var_id, stock, stats, elapsed)
+
+
+# ---------- writer ----------
+async def _async_buyer(var_id, user_id, qty, action, stats):
+    ttl = 0 if action == "expire" else TTL
+    try:
+        res = await database.transaction(checkout.reserve, user_id, user_id, var_id, qty, ttl)
+    except checkout.OutOfStock:
+        stats.add(out_of_stock=1)
+        return
+    stats.add(reserved=1, stock=res.stock)
+    if action == "cancel":
+        await database.transaction(checkout.release, res.order_id, checkout.CANCELLED, user_id)
+        stats.add(released=1)
+    elif await database.transaction(checkout.confirm, res.order_id, user_id):
+        stats.add(confirmed=1)
+
+async def _run_writer(var_id, buyers, stats):
+    await database.start_writer()
+    done = asyncio.Event()
+
+    async def sweeper():
+        while not done.is_set():
+            await database.transaction(checkout.expire_due)
+            await asyncio.sleep(0.001)
+
+    sweep = asyncio.create_task(sweeper())
+    start = time.perf_counter()
+    await asyncio.gather(*[_async_buyer(var_id, *p, stats) for p in _plan(buyers)])
+    elapsed = time.perf_counter() - start
+    done.set()
+    await sweep
+    await database.stop_writer()
+    database.close_pool()
+    return elapsed
+
+def run_writer(buyers, stock):
+    path = os.path.join(tempfile.mkdtemp(), "stress.db")
+    var_id = _setup(path, stock)
+    stats = Stats()
+    elapsed = asyncio.run(_run_writer(var_id, buyers, stats))
+    return _report("writer", var_id, stock, stats, elapsed)
+
+
+def _report(mode, var_id, stock, stats, elapsed):
+    # сначала инвариант с живыми корзинами, затем — после снятия всех резервов
+    _check(var_id, stock)
+    conn = database.get_connection()
+    database.run_immediate(conn, checkout.expire_due, float("inf"))
+    conn.close()
+    final_stock, sold = _check(var_id, stock)
+    assert stats.min_stock is None or stats.min_stock >= 0
+    return {"mode": mode, "initial_stock": stock, "final_stock": final_stock, "sold": sold,
+            "elapsed_s": round(elapsed, 3), **stats.as_dict()}
+
+
+if __name__ == "__main__":
+    buyers = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    stock = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    for result in (run_threads(buyers, stock), run_writer(buyers, stock)):
+        print(json.dumps(result, ensure_ascii=False))
+    print("OK: no oversell")
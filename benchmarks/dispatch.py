@@ -0,0 +1,121 @@
+# benchmarks/dispatch.py
+"""
+Микро-бенчмарк диспетчеризации callback_data на настоящих классах и
+настоящих Update: старая схема (ConversationHandler по очереди вызывает
+check_update каждого CallbackQueryHandler состояния, обработчик делает
+split("_")) против одного callbacks.RouteHandler на состояние (decode +
+поиск кода в словаре, id в context.args).
+
+Замеряется то, что делает ConversationHandler для найденного состояния:
+check_update кандидатов по порядку, затем handle_update выбранного
+(collect_additional_context + callback). Создание CallbackContext одинаково
+для обеих схем и в замер не входит.
+
+    python -m benchmarks.dispatch [число итераций]
+"""
+import sys
+import time
+
+from telegram import Update
+from telegram.ext import Application, CallbackContext, CallbackQueryHandler
+
+import callbacks as cb
+
+# Шаблоны состояний в том виде, в каком они были в main() до роутера
+LEGACY_STATES = {
+    "SHOP_CATEGORY": [r"^cat_|^back_cat_"],
+    "SHOP_BRAND": [r"^brand_|^back_brand_", r"^back_categories$"],
+    "SHOP_VARIANT": [r"^var_", r"^back_cat_", r"^back_brand_"],
+    "DEL_BRAND_SELECT": [r"^admin_delbrand_confirm_", r"^admin_delvar_brand_"],
+    "DEL_VAR_SELECT": [r"^admin_delvar_confirm_"],
+}
+
+# коды состояний так, как их регистрирует build_application()
+NEW_STATES = {
+    "SHOP_CATEGORY": (cb.CATEGORY, cb.CATEGORIES, cb.CART),
+    "SHOP_BRAND": (cb.BRAND, cb.CATEGORY, cb.CATEGORIES),
+    "SHOP_VARIANT": (cb.VARIANT, cb.CATEGORY, cb.CATEGORIES, cb.BRAND, cb.ADD_TO_CART, cb.CART),
+    "DEL_BRAND_SELECT": (cb.ADMIN_MENU, cb.DEL_BRAND_CHOICE, cb.DEL_VAR_BRAND, cb.DEL_BRAND_CAT, cb.DEL_VAR_CAT),
+    "DEL_VAR_SELECT": (cb.ADMIN_MENU, cb.DEL_VAR_CONFIRM, cb.DEL_VAR_BRAND),
+}
+
+# (состояние, старый callback_data, новый callback_data)
+SAMPLES = [
+    ("SHOP_CATEGORY", "cat_3", cb.encode(cb.CATEGORY, 3)),
+    ("SHOP_BRAND", "brand_1042", cb.encode(cb.BRAND, 1042)),
+    ("SHOP_BRAND", "back_categories", cb.encode(cb.CATEGORIES)),
+    ("SHOP_VARIANT", "var_55731", cb.encode(cb.VARIANT, 55731)),
+    ("SHOP_VARIANT", "back_brand_1042", cb.encode(cb.BRAND, 1042)),
+    ("DEL_BRAND_SELECT", "admin_delvar_brand_1042", cb.encode(cb.DEL_VAR_BRAND, 1042)),
+    ("DEL_VAR_SELECT", "admin_delvar_confirm_55731", cb.encode(cb.DEL_VAR_CONFIRM, 55731)),
+]
+
+
+async def legacy_callback(update, context):
+    # так старые обработчики доставали id из callback_data
+    data = update.callback_query.data
+    return int(data.split("_")[-1]) if data[-1].isdigit() else None
+
+async def route_callback(update, context):
+    return context.args[0] if context.args else None
+
+
+def _update(bot, data):
+    return Update.de_json({
+        "update_id": 1,
+        "callback_query": {"id": "1", "chat_instance": "1", "data": data,
+                           "from": {"id": 1, "is_bot": False, "first_name": "Bench"}},
+    }, bot)
+
+def _finish(coroutine):
+    """Корутина без await внутри завершается за один шаг — без event loop."""
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("callback неожиданно ждёт")
+
+def _legacy_tables():
+    return {state: [CallbackQueryHandler(legacy_callback, pattern=p) for p in patterns]
+            for state, patterns in LEGACY_STATES.items()}
+
+def _new_tables():
+    return {state: [cb.RouteHandler(dict.fromkeys(codes, route_callback))] for state, codes in NEW_STATES.items()}
+
+def dispatch(app, handlers, update, context):
+    # ConversationHandler: первый кандидат состояния, чей check_update не None/False
+    for handler in handlers:
+        check = handler.check_update(update)
+        if check is not None and check is not False:
+            return _finish(handler.handle_update(update, app, check, context))
+    raise LookupError(update.callback_query.data)
+
+def _bench(app, tables, samples, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for state, update, context in samples:
+            dispatch(app, tables[state], update, context)
+    elapsed = time.perf_counter() - start
+    return elapsed / (iterations * len(samples)) * 1e9
+
+def run(iterations=200_000):
+    app = Application.builder().token("1:bench").build()
+    legacy_tables, new_tables = _legacy_tables(), _new_tables()
+    legacy, new = [], []
+    for state, old, data in SAMPLES:
+        legacy.append((state, _update(app.bot, old), CallbackContext(app)))
+        new.append((state, _update(app.bot, data), CallbackContext(app)))
+    # контроль: обе схемы находят обработчик и достают один и тот же id
+    for (state, old, ctx_old), (_, upd, ctx_new) in zip(legacy, new):
+        assert dispatch(app, legacy_tables[state], old, ctx_old) == dispatch(app, new_tables[state], upd, ctx_new)
+    legacy_ns = _bench(app, legacy_tables, legacy, iterations)
+    new_ns = _bench(app, new_tables, new, iterations)
+    return {"legacy_ns_per_dispatch": legacy_ns, "router_ns_per_dispatch": new_ns,
+            "speedup": legacy_ns / new_ns}
+
+
+if __name__ == "__main__":
+    result = run(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
+    print(f"CallbackQueryHandler + split:  {result['legacy_ns_per_dispatch']:8.1f} ns/dispatch")
+    print(f"RouteHandler:                  {result['router_ns_per_dispatch']:8.1f} ns/dispatch")
+    print(f"speedup:                       {result['speedup']:8.2f}x")
@@ -0,0 +1,215 @@
+# benchmarks/fake_server.py
+"""
+Локальный заменитель api.telegram.org для нагрузочных тестов без сети:
+HTTP-сервер webhook.HTTPServer отвечает на /bot<токен>/<метод> из
+FakeBotAPI (benchmarks/fakebot.py) — getMe, getUpdates (long polling),
+sendMessage, editMessageText, editMessageMedia, answerCallbackQuery и т.д.;
+на неизвестные методы — успех.
+
+Искажения, как у настоящего Telegram:
+    --latency-ms / --jitter-ms   задержка ответа на каждый метод, кроме getUpdates
+    --error-rate                 доля случайных 429 Too Many Requests
+    --chat-limit / --global-limit  сообщений в секунду на чат / всего (0 — без
+                                 лимита); сверх лимита — 429 с retry_after
+
+Бот подключается через BOT_API_BASE_URL:
+    python -m benchmarks.fake_server --port 8081
+    BOT_API_BASE_URL=http://127.0.0.1:8081/bot BOT_TOKEN=1:bench python bot.py
+Пользователей к такому серверу подключает benchmarks/loadgen.py.
+"""
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import json
+import logging
+import random
+import time
+from collections import Counter, deque
+from urllib.parse import parse_qsl
+
+from benchmarks.fakebot import EDIT_METHODS, SEND_METHODS, FakeBotAPI
+from webhook import HTTPServer, response
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = "/bot"
+RETRY_AFTER = 1
+# getUpdates ждёт апдейты не дольше (timeout из запроса ограничивается этим)
+MAX_POLL_TIMEOUT = 30
+
+
+def parse_params(headers, body):
+    """Параметры метода из JSON, form-urlencoded или multipart (файлы — None)."""
+    content_type = headers.get("content-type", "")
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            params[name] = None if part.get_filename() else part.get_content()
+        return params
+    return dict(parse_qsl(body.decode(), keep_blank_values=True))
+
+
+class UpdateFeed:
+    """Очередь апдейтов для getUpdates: offset подтверждает полученные."""
+
+    def __init__(self):
+        self.pending = deque()
+        self._event = asyncio.Event()
+
+    def push(self, update):
+        self.pending.append(update)
+        self._event.set()
+
+    def _confirm(self, offset):
+        while self.pending and self.pending[0]["update_id"] < offset:
+            self.pending.popleft()
+
+    async def get(self, offset, limit, timeout):
+        self._confirm(offset)
+        if not self.pending and timeout > 0:
+            self._event.clear()
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return [update for _, update in zip(range(limit), self.pending)]
+
+
+class FakeBotServer:
+    def __init__(self, api=None, latency=0.0, jitter=0.0, error_rate=0.0, chat_limit=0, global_limit=0,
+                 retry_after=RETRY_AFTER, seed=1):
+        self.api = api or FakeBotAPI()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.retry_after = retry_after
+        self.feed = UpdateFeed()
+        self.counters = Counter()       # requests / get_updates / flood_429 / random_429
+        self._rnd = random.Random(seed)
+        self._window = None             # текущая секунда лимитов
+        self._sent = Counter()          # chat_id | None (всего) -> сообщений в этой секунде
+        self._replies = {}              # chat_id -> [Future] ждущих ответа бота в чат
+        self._http = None
+
+    @property
+    def port(self):
+        return self._http.port
+
+    async def start(self, host="127.0.0.1", port=8081):
+        self._http = HTTPServer(host, port)
+        self._http.route_prefix("POST", API_PREFIX, self._handle)
+        self._http.route_prefix("GET", API_PREFIX, self._handle)
+        await self._http.start()
+        return self
+
+    async def close(self):
+        await self._http.close()
+
+    # ---------- для генератора нагрузки ----------
+    def push(self, update):
+        self.feed.push(update)
+
+    def expect_reply(self, chat_id):
+        """Future с именем метода, которым бот в следующий раз отправит/поправит сообщение в chat_id."""
+        future = asyncio.get_running_loop().create_future()
+        self._replies.setdefault(chat_id, []).append(future)
+        return future
+
+    def _notify(self, chat_id, method):
+        for future in self._replies.pop(chat_id, ()):
+            if not future.done():
+                future.set_result(method)
+
+    # ---------- HTTP ----------
+    def _flooded(self, chat_id):
+        """True, если сообщение в chat_id превышает лимиты этой секунды."""
+        now = int(time.monotonic())
+        if now != self._window:
+            self._window = now
+            self._sent.clear()
+        if self.global_limit and self._sent[None] >= self.global_limit:
+            return True
+        if self.chat_limit and self._sent[chat_id] >= self.chat_limit:
+            return True
+        self._sent[None] += 1
+        self._sent[chat_id] += 1
+        return False
+
+    def _too_many(self, counter):
+        self.counters[counter] += 1
+        body = {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}}
+        return response(429, json.dumps(body).encode(), "application/json")
+
+    async def _handle(self, headers, body, rest):
+        _, _, method = rest.partition("/")
+        try:
+            params = parse_params(headers, body)
+        except ValueError:
+            return response(400)
+        self.counters["requests"] += 1
+        if method == "getUpdates":
+            self.counters["get_updates"] += 1
+            updates = await self.feed.get(int(params.get("offset") or 0), int(params.get("limit") or 100),
+                                          min(float(params.get("timeout") or 0), MAX_POLL_TIMEOUT))
+            return response(200, json.dumps({"ok": True, "result": updates}).encode(), "application/json")
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self._rnd.uniform(0, self.jitter))
+        chat_id = params.get("chat_id")
+        chat_id = int(chat_id) if chat_id not in (None, "") else None
+        if chat_id is not None and method in SEND_METHODS | EDIT_METHODS:
+            if self.error_rate and self._rnd.random() < self.error_rate:
+                return self._too_many("random_429")
+            if (self.chat_limit or self.global_limit) and self._flooded(chat_id):
+                return self._too_many("flood_429")
+        result = self.api.call(method, params)
+        if chat_id is not None and method in SEND_METHODS | EDIT_METHODS:
+            self._notify(chat_id, method)
+        return response(200, json.dumps({"ok": True, "result": result}).encode(), "application/json")
+
+
+def add_arguments(parser):
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0, help="задержка ответа")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="случайная добавка к задержке")
+    parser.add_argument("--error-rate", type=float, default=0, help="доля случайных 429")
+    parser.add_argument("--chat-limit", type=int, default=0, help="сообщений в секунду на чат, 0 — без лимита")
+    parser.add_argument("--global-limit", type=int, default=0, help="сообщений в секунду всего, 0 — без лимита")
+    parser.add_argument("--retry-after", type=int, default=RETRY_AFTER)
+
+def from_arguments(args, api=None):
+    return FakeBotServer(api, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                         error_rate=args.error_rate, chat_limit=args.chat_limit, global_limit=args.global_limit,
+                         retry_after=args.retry_after)
+
+
+async def _serve(args):
+    server = await from_arguments(args).start(args.host, args.port)
+    print(f"Fake Bot API: BOT_API_BASE_URL=http://{args.host}:{server.port}{API_PREFIX}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+        print(dict(server.counters), dict(server.api.calls))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный Bot API для нагрузочных тестов")
+    add_arguments(parser)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
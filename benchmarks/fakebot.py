@@ -0,0 +1,170 @@
+# benchmarks/fakebot.py
+"""
+Bot API в памяти для бенчмарков: запросы бота не уходят в сеть, а
+записываются и получают правдоподобные ответы Telegram.
+
+FakeBotAPI — состояние «сервера»: счётчики вызовов по методам, сообщения
+чатов в их последней версии (текст, подпись, фото, клавиатура) и апдейты от
+симулированных пользователей. RecordingRequest — BaseRequest для
+Application.builder().request(...), отвечающий из FakeBotAPI.
+"""
+import itertools
+import json
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+import callbacks as cb
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": True}
+BENCH_TOKEN = "1:bench"
+
+# методы, которые отправляют новое сообщение / правят существующее
+SEND_METHODS = {"sendMessage", "sendPhoto", "sendDocument"}
+EDIT_METHODS = {"editMessageText", "editMessageMedia", "editMessageCaption", "editMessageReplyMarkup"}
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self.calls = Counter()          # метод -> число вызовов
+        self.messages = {}              # (chat_id, message_id) -> последняя версия сообщения
+        self.keyboards = {}             # chat_id -> ключ последнего сообщения бота с кнопками
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._query_ids = itertools.count(1)
+
+    # ---------- ответы на запросы бота ----------
+    def call(self, method, params):
+        """Результат метода method (как поле result ответа Telegram)."""
+        self.calls[method] += 1
+        if method == "getMe":
+            return BOT_USER
+        if method in SEND_METHODS:
+            return self._send(method, params)
+        if method in EDIT_METHODS:
+            return self._edit(method, params)
+        # answerCallbackQuery, deleteMessage, setWebhook, ... — просто успех
+        return True
+
+    def _photo(self, file_id=None):
+        n = next(self._file_ids)
+        file_id = file_id or f"bench-photo-{n}"
+        return [{"file_id": f"{file_id}-s", "file_unique_id": f"s{n}", "width": 90, "height": 90},
+                {"file_id": file_id, "file_unique_id": f"m{n}", "width": 1280, "height": 1280}]
+
+    def _store(self, message):
+        chat_id = message["chat"]["id"]
+        key = (chat_id, message["message_id"])
+        self.messages[key] = message
+        if message.get("reply_markup"):
+            self.keyboards[chat_id] = key
+        return message
+
+    def _send(self, method, params):
+        chat_id = int(params["chat_id"])
+        message = {"message_id": next(self._message_ids), "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"}, "from": BOT_USER}
+        if method == "sendMessage":
+            message["text"] = params.get("text", "")
+        elif method == "sendPhoto":
+            photo = params.get("photo")
+            message["photo"] = self._photo(photo if isinstance(photo, str) and "://" not in photo else None)
+        else:
+            message["document"] = {"file_id": f"bench-doc-{next(self._file_ids)}", "file_unique_id": "d",
+                                   "file_name": params.get("filename") or "file"}
+        if params.get("caption"):
+            message["caption"] = params["caption"]
+        if params.get("reply_markup"):
+            message["reply_markup"] = _markup(params["reply_markup"])
+        return self._store(message)
+
+    def _edit(self, method, params):
+        if "inline_message_id" in params:
+            return True
+        chat_id, message_id = int(params["chat_id"]), int(params["message_id"])
+        message = dict(self.messages.get((chat_id, message_id)) or {
+            "message_id": message_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"}, "from": BOT_USER,
+        })
+        if method == "editMessageText":
+            message.pop("photo", None)
+            message.pop("caption", None)
+            message["text"] = params.get("text", "")
+        elif method == "editMessageMedia":
+            media = params["media"]
+            if isinstance(media, str):
+                media = json.loads(media)
+            file_id = media.get("media")
+            message.pop("text", None)
+            message["photo"] = self._photo(file_id if isinstance(file_id, str) and "://" not in file_id else None)
+            message["caption"] = media.get("caption", "")
+        elif method == "editMessageCaption":
+            message["caption"] = params.get("caption", "")
+        # правка без reply_markup убирает клавиатуру
+        if params.get("reply_markup"):
+            message["reply_markup"] = _markup(params["reply_markup"])
+        else:
+            message.pop("reply_markup", None)
+        return self._store(message)
+
+    # ---------- апдейты от пользователей ----------
+    def user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+
+    def text_update(self, user_id, text):
+        """Апдейт с сообщением пользователя в личном чате с ботом."""
+        message = {"message_id": next(self._message_ids), "date": int(time.time()),
+                   "chat": {"id": user_id, "type": "private"}, "from": self.user(user_id), "text": text}
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def buttons(self, chat_id, code=None):
+        """callback_data кнопок последнего сообщения бота с клавиатурой (с кодом code)."""
+        key = self.keyboards.get(chat_id)
+        if key is None:
+            return []
+        rows = self.messages[key]["reply_markup"]["inline_keyboard"]
+        data = [b["callback_data"] for row in rows for b in row if b.get("callback_data")]
+        if code is not None:
+            data = [d for d in data if (cb.decode(d) or cb.STALE)[0] == code]
+        return data
+
+    def callback_update(self, user_id, data):
+        """Нажатие кнопки data под последним сообщением бота с клавиатурой в чате user_id."""
+        message = self.messages[self.keyboards[user_id]]
+        query = {"id": str(next(self._query_ids)), "from": self.user(user_id),
+                 "chat_instance": str(user_id), "message": message, "data": data}
+        return {"update_id": next(self._update_ids), "callback_query": query}
+
+
+def _markup(value):
+    return json.loads(value) if isinstance(value, str) else value
+
+
+class RecordingRequest(BaseRequest):
+    """Запросы бота к FakeBotAPI вместо HTTP."""
+
+    def __init__(self, api):
+        self.api = api
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        result = self.api.call(endpoint, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
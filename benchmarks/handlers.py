@@ -0,0 +1,254 @@
+# benchmarks/handlers.py
+"""
+Бенчмарк обработчиков на синтетическом каталоге: настоящее Application из
+bot.build_application() с фейковым Bot API (benchmarks/fakebot.py), апдейты
+подаются в app.process_update — через shop_conv и admin_conv целиком
+(отсечение дублей, диалоги, роутер, каталог, БД и очередь записи).
+
+Сценарии (каждый — новый пользователь в своём чате):
+    shop          /start → категория → марка → вариант
+    admin_add     /admin → добавить товар → категория → марка → вариант, цена, остаток, фото «-»
+    admin_delete  /admin → удалить → товар → категория → марка → вариант
+
+Кнопки нажимаются под последним сообщением бота — те, что он на самом
+деле показал (выбор случайный, seed фиксирован). Латентность шага — время
+process_update; сценария — сумма его шагов. Ограничитель исходящих запросов
+не подключается: меряем обработчики, а не лимиты Telegram.
+
+    python -m benchmarks.handlers [--sizes 1000,10000,100000] [--iterations 300]
+                                  [--concurrency 8] [--out файл.json] [--compare старый.json]
+
+Результат — JSON (по умолчанию benchmarks/results/handlers-<коммит>.json);
+--compare печатает изменение p50/p95/p99 относительно прошлого прогона.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+# до импорта bot: без HTTP-эндпоинта метрик
+os.environ.setdefault("METRICS_PORT", "0")
+
+import telegram
+from telegram import Update
+from telegram.ext import Application
+
+import bot
+import callbacks as cb
+import database
+import metrics
+import views
+from benchmarks import report
+from benchmarks.fakebot import BENCH_TOKEN, FakeBotAPI, RecordingRequest
+from benchmarks.report import percentiles
+from benchmarks.synthetic import build_catalog
+
+SIZES = (1_000, 10_000, 100_000)
+FLOWS = ("shop", "admin_add", "admin_delete")
+# пользователи каждого каталога — свои чаты: память экранов и диалоги не пересекаются
+USERS_PER_SIZE = 1_000_000
+
+
+class FlowError(Exception):
+    """Нужной кнопки нет на экране (например, у марки удалены все варианты)."""
+
+
+class Session:
+    """Один пользователь: шаги сценария с замером времени каждого."""
+
+    def __init__(self, bench, user_id, rnd):
+        self.bench = bench
+        self.user_id = user_id
+        self.rnd = rnd
+        self.steps = []     # (шаг, секунды)
+
+    async def _process(self, step, data):
+        update = Update.de_json(data, self.bench.app.bot)
+        started = time.perf_counter()
+        await self.bench.app.process_update(update)
+        self.steps.append((step, time.perf_counter() - started))
+
+    async def send(self, step, text):
+        await self._process(step, self.bench.api.text_update(self.user_id, text))
+
+    async def tap(self, step, code):
+        buttons = self.bench.api.buttons(self.user_id, code)
+        if not buttons:
+            raise FlowError(f"{step}: нет кнопки {code!r}")
+        await self._process(step, self.bench.api.callback_update(self.user_id, self.rnd.choice(buttons)))
+
+
+async def shop_flow(s):
+    await s.send("start", "/start")
+    await s.tap("category", cb.CATEGORY)
+    await s.tap("brand", cb.BRAND)
+    await s.tap("variant", cb.VARIANT)
+
+async def admin_add_flow(s):
+    await s.send("admin", "/admin")
+    await s.tap("add_variant", cb.ADD_VARIANT)
+    await s.tap("category", cb.ADD_VAR_CAT)
+    await s.tap("brand", cb.ADD_VAR_BRAND)
+    await s.send("option", f"Bench {s.user_id}")
+    await s.send("price", str(s.rnd.randrange(300, 5000, 50)))
+    await s.send("stock", str(s.rnd.randint(1, 30)))
+    await s.send("photo", "-")
+
+async def admin_delete_flow(s):
+    await s.send("admin", "/admin")
+    await s.tap("delete", cb.DELETE)
+    await s.tap("del_variant", cb.DEL_VARIANT)
+    await s.tap("category", cb.DEL_VAR_CAT)
+    await s.tap("brand", cb.DEL_VAR_BRAND)
+    await s.tap("confirm", cb.DEL_VAR_CONFIRM)
+
+FLOW_FUNCS = {"shop": shop_flow, "admin_add": admin_add_flow, "admin_delete": admin_delete_flow}
+
+
+class Bench:
+    def __init__(self, size, user_base, seed):
+        self.size = size
+        self.user_base = user_base
+        self.seed = seed
+        self.api = FakeBotAPI()
+        self.app = None
+        self.errors = 0
+
+    async def start(self):
+        builder = Application.builder().token(BENCH_TOKEN).request(RecordingRequest(self.api))
+        self.app = bot.build_application(builder, mode="polling")
+
+        async def count_error(update, context):
+            self.errors += 1
+            logging.getLogger(__name__).debug("ошибка обработчика: %r", context.error)
+
+        self.app.add_error_handler(count_error)
+        views.view_cache.clear()
+        await self.app.initialize()
+        await self.app.post_init(self.app)
+
+    async def stop(self):
+        await self.app.post_shutdown(self.app)
+        await self.app.shutdown()
+
+    async def run_flow(self, name, iterations, concurrency):
+        func = FLOW_FUNCS[name]
+        offset = FLOWS.index(name) * iterations
+        rnd = random.Random(f"{self.seed}-{self.size}-{name}")
+        plan = [(self.user_base + offset + i, random.Random(rnd.random())) for i in range(iterations)]
+        if name.startswith("admin"):
+            bot.ADMIN_USER_IDS.update(user_id for user_id, _ in plan)
+        calls_before = self.api.calls.copy()
+        errors_before = self.errors
+        sessions, failed = [], 0
+        pending = iter(plan)
+
+        async def worker():
+            nonlocal failed
+            for user_id, user_rnd in pending:
+                session = Session(self, user_id, user_rnd)
+                try:
+                    await func(session)
+                except FlowError:
+                    failed += 1
+                    continue
+                sessions.append(session)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+        steps = {}
+        for session in sessions:
+            for step, seconds in session.steps:
+                steps.setdefault(step, []).append(seconds)
+        updates = sum(len(s.steps) for s in sessions)
+        return {
+            "catalog": self.size, "flow": name, "flows": len(sessions), "failed": failed,
+            "handler_errors": self.errors - errors_before,
+            "elapsed_s": round(elapsed, 3),
+            "flows_per_s": round(len(sessions) / elapsed, 1) if elapsed else None,
+            "updates_per_s": round(updates / elapsed, 1) if elapsed else None,
+            "latency_ms": percentiles([sum(sec for _, sec in s.steps) for s in sessions]),
+            "steps_ms": {step: percentiles(samples) for step, samples in steps.items()},
+            "api_calls": dict(self.api.calls - calls_before),
+        }
+
+
+async def run_size(size, index, iterations, concurrency, seed, workdir):
+    path = os.path.join(workdir, f"catalog-{size}.db")
+    started = time.perf_counter()
+    build_catalog(path, size, seed)
+    built = time.perf_counter() - started
+    bench = Bench(size, (index + 1) * USERS_PER_SIZE, seed)
+    await bench.start()
+    try:
+        results = []
+        for flow in FLOWS:
+            result = await bench.run_flow(flow, iterations, concurrency)
+            result["catalog_build_s"] = round(built, 2)
+            results.append(result)
+            print(_line(result), flush=True)
+        return results
+    finally:
+        await bench.stop()
+
+
+def _line(result):
+    lat = result["latency_ms"] or {}
+    return (f"{result['catalog']:>7} {result['flow']:<13} {result['flows']:>5} сценариев "
+            f"{result['flows_per_s'] or 0:>8.1f}/с  p50 {lat.get('p50', 0):7.2f}  "
+            f"p95 {lat.get('p95', 0):7.2f}  p99 {lat.get('p99', 0):7.2f} мс"
+            + (f"  не дошли: {result['failed']}" if result["failed"] else "")
+            + (f"  ошибок: {result['handler_errors']}" if result["handler_errors"] else ""))
+
+def compare(old_path, results):
+    """Печатает изменение перцентилей относительно прошлого прогона."""
+    old = {(r["catalog"], r["flow"]): r for r in report.load(old_path)["results"]}
+    print(f"\nСравнение с {old_path}:")
+    for result in results:
+        prev = old.get((result["catalog"], result["flow"]))
+        if not prev or not prev["latency_ms"] or not result["latency_ms"]:
+            continue
+        deltas = []
+        for p in ("p50", "p95", "p99"):
+            before, after = prev["latency_ms"][p], result["latency_ms"][p]
+            deltas.append(f"{p} {before:.2f}→{after:.2f} ({(after / before - 1) * 100 if before else 0:+.0f}%)")
+        print(f"{result['catalog']:>7} {result['flow']:<13} " + "  ".join(deltas))
+
+
+async def run(args):
+    database.set_query_observer(metrics.observe_db)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        for index, size in enumerate(args.sizes):
+            results += await run_size(size, index, args.iterations, args.concurrency, args.seed, workdir)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк обработчиков бота на синтетическом каталоге")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)),
+                        type=lambda v: [int(x) for x in v.split(",") if x.strip()], help="размеры каталогов")
+    parser.add_argument("--iterations", type=int, default=300, help="сценариев каждого вида на каталог")
+    parser.add_argument("--concurrency", type=int, default=8, help="пользователей одновременно")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="JSON с результатами")
+    parser.add_argument("--compare", help="прошлый JSON для сравнения")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    meta = report.run_info(python_telegram_bot=telegram.__version__, sqlite=database.sqlite3.sqlite_version,
+                           sizes=args.sizes, iterations=args.iterations, concurrency=args.concurrency,
+                           seed=args.seed)
+    results = asyncio.run(run(args))
+    print(f"Результаты: {report.write('handlers', meta, results, args.out)}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
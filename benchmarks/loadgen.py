@@ -0,0 +1,334 @@
+# benchmarks/loadgen.py
+"""
+Сквозной нагрузочный тест: настоящий bot.py отдельным процессом (polling)
+против benchmarks/fake_server.py в этом процессе, на синтетическом каталоге.
+Симулированные пользователи ходят /start → категория → марка → вариант с
+паузами «на подумать»; латентность шага — от апдейта в getUpdates до
+ответа бота в этот чат (sendMessage / editMessage*).
+
+Нагрузка растёт ступенями (--users 50,200,1000,...). На каждой ступени,
+кроме латентности, снимаются показатели бота с /metrics:
+    event loop  bot_event_loop_lag_seconds (запаздывание таймера)
+    SQLite      bot_db_seconds, очередь записи bot_db_write_queue_depth
+    Bot API     очередь и throttled ограничителя bot_rate_limiter, 429 сервера
+и печатается, на какой ступени p95 превысил --slo-ms и что тогда было узким местом.
+
+    python -m benchmarks.loadgen --catalog 10000 --users 50,200,1000 --duration 30
+    python -m benchmarks.loadgen --latency-ms 50 --chat-limit 1 --bot-env RATE_GLOBAL=1000
+
+Результат — JSON (по умолчанию benchmarks/results/loadgen-<коммит>.json).
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import callbacks as cb
+from benchmarks import report
+from benchmarks.fake_server import API_PREFIX, add_arguments, from_arguments
+from benchmarks.fakebot import BENCH_TOKEN
+from benchmarks.report import percentiles
+from benchmarks.synthetic import build_catalog
+
+BOT_SCRIPT = os.path.join(report.REPO_DIR, "bot.py")
+STEP_TIMEOUT = 30
+BOT_START_TIMEOUT = 120
+METRICS_POLL = 1.0
+# пороги «узкого места» для сводки
+LOOP_LAG_LIMIT = 0.1        # p99 запаздывания event loop, с
+DB_QUEUE_LIMIT = 10         # команд в очереди записи
+DB_MEAN_LIMIT = 0.02        # среднее время запроса к БД, с
+# пользователи каждой ступени — новые чаты
+USERS_PER_STAGE = 1_000_000
+
+SHOP_STEPS = (("category", cb.CATEGORY), ("brand", cb.BRAND), ("variant", cb.VARIANT))
+
+
+# ---------- /metrics бота ----------
+async def scrape(port):
+    """{'имя{метки}': значение} с /metrics бота или {}, если он не отвечает."""
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        return {}
+    try:
+        writer.write(f"GET /metrics HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        raw = await reader.read()
+    except OSError:
+        return {}
+    finally:
+        writer.close()
+    _, _, body = raw.partition(b"\r\n\r\n")
+    values = {}
+    for line in body.decode("utf-8", "replace").splitlines():
+        if not line or line.startswith("#"):
+            continue
+        key, _, value = line.rpartition(" ")
+        try:
+            values[key] = float(value)
+        except ValueError:
+            pass
+    return values
+
+def total(values, name):
+    """Сумма серии name по всем меткам."""
+    return sum(v for k, v in values.items() if k == name or k.startswith(name + "{"))
+
+def _value(values, key):
+    return values.get(key, 0.0)
+
+def histogram_quantile(before, after, name, q):
+    """Квантиль q гистограммы name (без меток) за интервал между двумя снимками, с."""
+    buckets = []
+    for key, value in after.items():
+        if key.startswith(name + '_bucket{le="'):
+            le = key[len(name) + 12:-2]
+            bound = float("inf") if le == "+Inf" else float(le)
+            buckets.append((bound, value - before.get(key, 0.0)))
+    buckets.sort()
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    target = q * buckets[-1][1]
+    for bound, count in buckets:
+        if count >= target:
+            return bound
+    return None
+
+
+class MetricsWatch:
+    """Снимки /metrics в начале и конце ступени и максимумы очередей между ними."""
+
+    def __init__(self, port):
+        self.port = port
+        self.first = {}
+        self.last = {}
+        self.peaks = {}
+        self._task = None
+
+    async def start(self):
+        self.first = await scrape(self.port)
+        self._task = asyncio.create_task(self._poll())
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(METRICS_POLL)
+            values = await scrape(self.port)
+            for name, key in (("update_queue", "bot_update_queue_depth"),
+                              ("db_write_queue", "bot_db_write_queue_depth"),
+                              ("limiter_queued", 'bot_rate_limiter{stat="queued_interactive"}')):
+                self.peaks[name] = max(self.peaks.get(name, 0), _value(values, key))
+
+    async def stop(self):
+        self._task.cancel()
+        self.last = await scrape(self.port)
+
+    def summary(self):
+        a, b = self.first, self.last
+        if not b:
+            return {}
+        db_count = total(b, "bot_db_seconds_count") - total(a, "bot_db_seconds_count")
+        db_sum = total(b, "bot_db_seconds_sum") - total(a, "bot_db_seconds_sum")
+        handlers = total(b, "bot_handler_seconds_count") - total(a, "bot_handler_seconds_count")
+        return {
+            "loop_lag_p99_s": histogram_quantile(a, b, "bot_event_loop_lag_seconds", 0.99),
+            "db_queries": int(db_count),
+            "db_mean_ms": round(db_sum / db_count * 1000, 3) if db_count else None,
+            "db_busy_s": round(db_sum, 3),
+            "handlers": int(handlers),
+            "limiter_throttled": int(_value(b, 'bot_rate_limiter{stat="throttled"}')
+                                     - _value(a, 'bot_rate_limiter{stat="throttled"}')),
+            "limiter_retry_after": int(_value(b, 'bot_rate_limiter{stat="retry_after"}')
+                                       - _value(a, 'bot_rate_limiter{stat="retry_after"}')),
+            "peak_update_queue": int(self.peaks.get("update_queue", 0)),
+            "peak_db_write_queue": int(self.peaks.get("db_write_queue", 0)),
+            "peak_limiter_queued": int(self.peaks.get("limiter_queued", 0)),
+        }
+
+
+def bottlenecks(bot_stats, server_429):
+    """Что похоже на узкое место по показателям ступени."""
+    causes = []
+    lag = bot_stats.get("loop_lag_p99_s")
+    if lag is not None and lag >= LOOP_LAG_LIMIT:
+        causes.append("event loop")
+    if bot_stats.get("peak_db_write_queue", 0) >= DB_QUEUE_LIMIT or (bot_stats.get("db_mean_ms") or 0) >= DB_MEAN_LIMIT * 1000:
+        causes.append("SQLite")
+    if bot_stats.get("peak_limiter_queued", 0) > 0 or bot_stats.get("limiter_throttled", 0) > 0 or server_429:
+        causes.append("Bot API throttling")
+    return causes
+
+
+# ---------- пользователи ----------
+class Stage:
+    def __init__(self, server, users, duration, think, seed):
+        self.server = server
+        self.users = users
+        self.duration = duration
+        self.think = think
+        self.rnd = random.Random(seed)
+        self.steps = {}         # шаг -> [секунды]
+        self.flows = 0
+        self.timeouts = 0
+        self.failed = 0         # нужной кнопки нет на экране
+
+    async def _step(self, name, chat_id, update):
+        reply = self.server.expect_reply(chat_id)
+        started = time.perf_counter()
+        self.server.push(update)
+        await asyncio.wait_for(reply, STEP_TIMEOUT)
+        self.steps.setdefault(name, []).append(time.perf_counter() - started)
+
+    async def _pause(self, rnd):
+        await asyncio.sleep(rnd.uniform(*self.think))
+
+    async def user(self, user_id, rnd, deadline):
+        api = self.server.api
+        # не все сразу: первое действие — в пределах паузы
+        await self._pause(rnd)
+        while time.monotonic() < deadline:
+            try:
+                await self._step("start", user_id, api.text_update(user_id, "/start"))
+                for name, code in SHOP_STEPS:
+                    await self._pause(rnd)
+                    buttons = api.buttons(user_id, code)
+                    if not buttons:
+                        self.failed += 1
+                        break
+                    await self._step(name, user_id, api.callback_update(user_id, rnd.choice(buttons)))
+                else:
+                    self.flows += 1
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+            await self._pause(rnd)
+
+    async def run(self, user_base):
+        deadline = time.monotonic() + self.duration
+        started = time.perf_counter()
+        await asyncio.gather(*[self.user(user_base + i, random.Random(self.rnd.random()), deadline)
+                               for i in range(self.users)])
+        return time.perf_counter() - started
+
+
+async def run_stage(server, metrics_port, users, index, args):
+    before_429 = server.counters["flood_429"] + server.counters["random_429"]
+    watch = MetricsWatch(metrics_port)
+    await watch.start()
+    stage = Stage(server, users, args.duration, (args.think_min, args.think_max), f"{args.seed}-{users}")
+    elapsed = await stage.run((index + 1) * USERS_PER_STAGE)
+    await watch.stop()
+    server_429 = server.counters["flood_429"] + server.counters["random_429"] - before_429
+    bot_stats = watch.summary()
+    all_steps = [s for samples in stage.steps.values() for s in samples]
+    latency = percentiles(all_steps)
+    return {
+        "users": users, "elapsed_s": round(elapsed, 2), "flows": stage.flows,
+        "steps": len(all_steps), "steps_per_s": round(len(all_steps) / elapsed, 1),
+        "timeouts": stage.timeouts, "failed": stage.failed, "server_429": server_429,
+        "latency_ms": latency,
+        "steps_ms": {name: percentiles(samples) for name, samples in stage.steps.items()},
+        "bot": bot_stats,
+        "bottlenecks": bottlenecks(bot_stats, server_429),
+        "slo_breached": bool(stage.timeouts) or (latency is not None and latency["p95"] > args.slo_ms),
+    }
+
+def _line(result):
+    lat = result["latency_ms"] or {}
+    return (f"{result['users']:>6} польз. {result['steps_per_s']:>8.1f} шагов/с  p50 {lat.get('p50', 0):8.1f}  "
+            f"p95 {lat.get('p95', 0):8.1f}  p99 {lat.get('p99', 0):8.1f} мс  таймаутов {result['timeouts']}"
+            + (f"  429: {result['server_429']}" if result["server_429"] else "")
+            + (f"  [{', '.join(result['bottlenecks'])}]" if result["bottlenecks"] else ""))
+
+
+# ---------- бот ----------
+def spawn_bot(base_url, workdir, metrics_port, extra_env):
+    env = dict(os.environ, BOT_TOKEN=BENCH_TOKEN, BOT_API_BASE_URL=base_url, BOT_MODE="polling",
+               METRICS_LISTEN="127.0.0.1", METRICS_PORT=str(metrics_port), ADMIN_IDS="")
+    env.update(extra_env)
+    log = open(os.path.join(workdir, "bot.log"), "wb")
+    return subprocess.Popen([sys.executable, BOT_SCRIPT], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+def stop_bot(process):
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+async def wait_for_bot(server, process):
+    """Первый getUpdates бот шлёт после post_init — каталог уже загружен."""
+    deadline = time.monotonic() + BOT_START_TIMEOUT
+    while not server.counters["get_updates"]:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"бот завершился с кодом {process.returncode}")
+        if time.monotonic() > deadline:
+            raise RuntimeError("бот не начал опрос getUpdates")
+        await asyncio.sleep(0.2)
+
+
+async def run(args):
+    server = from_arguments(args)
+    await server.start(args.host, args.port)
+    base_url = f"http://{args.host}:{server.port}{API_PREFIX}"
+    workdir = tempfile.mkdtemp(prefix="loadgen-")
+    process = None
+    results = []
+    try:
+        if not args.no_spawn:
+            build_catalog(os.path.join(workdir, "products.db"), args.catalog, args.seed)
+            extra_env = dict(item.split("=", 1) for item in args.bot_env)
+            process = spawn_bot(base_url, workdir, args.metrics_port, extra_env)
+            print(f"Бот: {BOT_SCRIPT} (лог {workdir}/bot.log), Bot API {base_url}", flush=True)
+        else:
+            print(f"Жду бота с BOT_API_BASE_URL={base_url} BOT_TOKEN={BENCH_TOKEN}", flush=True)
+        await wait_for_bot(server, process)
+        for index, users in enumerate(args.users):
+            result = await run_stage(server, args.metrics_port, users, index, args)
+            results.append(result)
+            print(_line(result), flush=True)
+            await asyncio.sleep(args.cooldown)
+    finally:
+        if process is not None:
+            await asyncio.get_running_loop().run_in_executor(None, stop_bot, process)
+        await server.close()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота против локального Bot API")
+    add_arguments(parser)
+    parser.add_argument("--users", default="50,200,1000",
+                        type=lambda v: [int(x) for x in v.split(",") if x.strip()], help="ступени нагрузки")
+    parser.add_argument("--duration", type=float, default=30, help="секунд на ступень")
+    parser.add_argument("--cooldown", type=float, default=5, help="пауза между ступенями")
+    parser.add_argument("--think-min", type=float, default=1.0, help="пауза пользователя между шагами, от")
+    parser.add_argument("--think-max", type=float, default=3.0, help="и до, секунд")
+    parser.add_argument("--slo-ms", type=float, default=1000, help="допустимый p95 шага")
+    parser.add_argument("--catalog", type=int, default=10_000, help="вариантов в синтетическом каталоге")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--metrics-port", type=int, default=9109, help="METRICS_PORT бота")
+    parser.add_argument("--bot-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="переменные окружения бота, например RATE_GLOBAL=1000")
+    parser.add_argument("--no-spawn", action="store_true", help="бот запускается отдельно")
+    parser.add_argument("--out", help="JSON с результатами")
+    args = parser.parse_args(argv)
+
+    meta = report.run_info(**{k: v for k, v in vars(args).items() if k not in ("out", "no_spawn")})
+    results = asyncio.run(run(args))
+    print(f"Результаты: {report.write('loadgen', meta, results, args.out)}")
+    breached = next((r for r in results if r["slo_breached"]), None)
+    if breached:
+        causes = ", ".join(breached["bottlenecks"]) or "не определено (см. steps_ms и bot в JSON)"
+        print(f"p95 > {args.slo_ms:.0f} мс с {breached['users']} пользователей; узкое место: {causes}")
+    else:
+        print(f"p95 в пределах {args.slo_ms:.0f} мс на всех ступенях")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+# benchmarks/replay.py
+"""
+Воспроизведение журнала апдейтов (journal.py, JOURNAL_DIR) через настоящие
+обработчики bot.build_application() на копии снимка products.db; запросы к
+Bot API уходят в фейковый сервер в памяти (benchmarks/fakebot.py).
+
+    python -m benchmarks.replay журнал/ [ещё файлы...] --db снимок.db
+                                [--speed 1] [--limit N] [--admins 1,2] [--out файл.json]
+
+--speed 0 (по умолчанию) — как можно быстрее; 1 — с записанными интервалами,
+2 — вдвое быстрее и т.д. Апдейты проходят через ChatSequencer, как в боте:
+внутри чата по очереди, разные чаты параллельно (до BOT_WORKERS).
+
+Отчёт: по каждому обработчику — вызовы, суммарное и среднее время и
+p50/p95/p99, оценённые по корзинам bot_handler_seconds (как histogram_quantile
+в Prometheus); по апдейту целиком — точные перцентили от подачи до конца
+обработки. Снимок не меняется. Фото по URL не прогреваются, файлы из
+сообщений не скачиваются — импорт и картинки-документы воспроизводятся с ошибкой.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+# до импорта bot: без эндпоинта метрик и, главное, без записи нового журнала
+os.environ.setdefault("METRICS_PORT", "0")
+os.environ["JOURNAL_DIR"] = ""
+
+import telegram
+from telegram import Update
+from telegram.ext import Application
+
+import bot
+import database
+import journal
+import metrics
+from benchmarks import report
+from benchmarks.fakebot import BENCH_TOKEN, FakeBotAPI, RecordingRequest
+from benchmarks.report import percentiles
+
+# сколько апдейтов одновременно в обработке/ожидании очереди чата
+MAX_IN_FLIGHT = 10_000
+TOP_HANDLERS = 25
+
+
+def bucket_quantile(bounds, counts, q):
+    """Квантиль q по счётчикам корзин с линейной интерполяцией внутри корзины, с."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    cumulative, lower = 0, 0.0
+    for bound, count in zip(bounds + (float("inf"),), counts):
+        if count and cumulative + count >= rank:
+            if bound == float("inf"):
+                return lower
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return lower
+
+def handler_stats(before, after):
+    """Время обработчиков между двумя снимками bot_handler_seconds, мс."""
+    bounds = metrics.HANDLER_SECONDS.buckets
+    stats = {}
+    for labels, (counts, total) in after.items():
+        old_counts, old_total = before.get(labels, ([0] * len(counts), 0.0))
+        delta = [a - b for a, b in zip(counts, old_counts)]
+        calls = sum(delta)
+        if not calls:
+            continue
+        seconds = total - old_total
+        stats[labels[0]] = {
+            "calls": calls, "total_ms": round(seconds * 1000, 3), "mean_ms": round(seconds / calls * 1000, 3),
+            **{p: round(bucket_quantile(bounds, delta, q) * 1000, 3)
+               for p, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        }
+    return dict(sorted(stats.items(), key=lambda item: -item[1]["total_ms"]))
+
+
+def copy_snapshot(source, target):
+    """Копия базы через backup API — корректна и для базы в режиме WAL."""
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+async def replay(args, workdir):
+    path = os.path.join(workdir, "products.db")
+    copy_snapshot(args.db, path)
+    database.DB_NAME = path
+    database.init_db()
+    database.set_query_observer(metrics.observe_db)
+
+    api = FakeBotAPI()
+    app = bot.build_application(Application.builder().token(BENCH_TOKEN).request(RecordingRequest(api)),
+                                mode="polling")
+    errors = 0
+
+    async def count_error(update, context):
+        nonlocal errors
+        errors += 1
+        logging.getLogger(__name__).debug("ошибка обработчика: %r", context.error)
+
+    app.add_error_handler(count_error)
+    bot.ADMIN_USER_IDS.update(args.admins)
+    await app.initialize()
+    await app.post_init(app)
+
+    processor = app.update_processor
+    latencies = []
+    in_flight = set()
+
+    async def process(update):
+        started = time.perf_counter()
+        await processor.process_update(update, app.process_update(update))
+        latencies.append(time.perf_counter() - started)
+
+    before = metrics.HANDLER_SECONDS.snapshot()
+    started = time.monotonic()
+    first = last = None
+    fed = 0
+    try:
+        for recorded_at, data in journal.read(args.journal):
+            if args.limit and fed >= args.limit:
+                break
+            if first is None:
+                first = recorded_at
+            if args.speed > 0:
+                delay = started + (recorded_at - first) / args.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            last = recorded_at
+            task = asyncio.create_task(process(Update.de_json(data, app.bot)))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            fed += 1
+            if len(in_flight) >= MAX_IN_FLIGHT:
+                await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        elapsed = time.monotonic() - started
+    finally:
+        await app.post_shutdown(app)
+        await app.shutdown()
+
+    return {
+        "updates": fed, "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(fed / elapsed, 1) if elapsed else None,
+        "recorded_span_s": None if first is None else round(last - first, 3),
+        "handler_errors": errors,
+        "latency_ms": percentiles(latencies),
+        "handlers": handler_stats(before, metrics.HANDLER_SECONDS.snapshot()),
+        "api_calls": dict(api.calls),
+    }
+
+
+def print_report(result):
+    lat = result["latency_ms"] or {}
+    print(f"{result['updates']} апдейтов за {result['elapsed_s']:.2f} с ({result['updates_per_s'] or 0:.1f}/с), "
+          f"ошибок обработчиков: {result['handler_errors']}")
+    if lat:
+        print(f"апдейт целиком: p50 {lat['p50']:.2f}  p95 {lat['p95']:.2f}  p99 {lat['p99']:.2f}  "
+              f"max {lat['max']:.2f} мс")
+    print(f"\n{'обработчик':<40} {'вызовов':>8} {'всего, мс':>11} {'сред.':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, s in list(result["handlers"].items())[:TOP_HANDLERS]:
+        print(f"{name[:40]:<40} {s['calls']:>8} {s['total_ms']:>11.1f} {s['mean_ms']:>8.2f} "
+              f"{s['p50']:>8.2f} {s['p95']:>8.2f} {s['p99']:>8.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Воспроизведение журнала апдейтов через обработчики бота")
+    parser.add_argument("journal", nargs="+", help="каталог JOURNAL_DIR или файлы .jsonl / .jsonl.gz")
+    parser.add_argument("--db", default=database.DB_NAME, help="снимок products.db (не изменяется)")
+    parser.add_argument("--speed", type=float, default=0, help="0 — как можно быстрее, 1 — в записанном темпе")
+    parser.add_argument("--limit", type=int, default=0, help="не больше N апдейтов")
+    parser.add_argument("--admins", default="", type=lambda v: {int(x) for x in v.split(",") if x.strip()},
+                        help="id администраторов в дополнение к ADMIN_IDS")
+    parser.add_argument("--out", help="JSON с результатами")
+    args = parser.parse_args(argv)
+    if not journal.journal_files(args.journal):
+        parser.error("файлы журнала не найдены")
+
+    logging.getLogger().setLevel(logging.WARNING)
+    meta = report.run_info(python_telegram_bot=telegram.__version__, sqlite=sqlite3.sqlite_version,
+                           journal=journal.journal_files(args.journal), db=os.path.abspath(args.db),
+                           speed=args.speed, limit=args.limit)
+    with tempfile.TemporaryDirectory(prefix="replay-") as workdir:
+        result = asyncio.run(replay(args, workdir))
+    print_report(result)
+    print(f"\nРезультаты: {report.write('replay', meta, result, args.out)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+# benchmarks/report.py
+"""Общее для бенчмарков: перцентили, сведения о прогоне и запись JSON с результатами."""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentiles(samples):
+    """p50/p95/p99/среднее/максимум в миллисекундах (samples — секунды) или None."""
+    if not samples:
+        return None
+    ms = sorted(x * 1000 for x in samples)
+    q = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else [ms[0]] * 99
+    return {"p50": round(q[49], 3), "p95": round(q[94], 3), "p99": round(q[98], 3),
+            "mean": round(statistics.fmean(ms), 3), "max": round(ms[-1], 3)}
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True, cwd=REPO_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_info(**extra):
+    """Коммит, незакоммиченные правки, время, версии — чтобы сравнивать прогоны между коммитами."""
+    info = {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    info.update(extra)
+    return info
+
+def write(kind, meta, results, out=None):
+    """Пишет {"meta", "results"}; по умолчанию в benchmarks/results/<kind>-<коммит>.json."""
+    out = out or os.path.join(RESULTS_DIR, f"{kind}-{(meta.get('commit') or 'local')[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+    return out
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
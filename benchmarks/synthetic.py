@@ -0,0 +1,74 @@
+# benchmarks/synthetic.py
+"""
+Синтетический products.db заданного размера: категории из init_db, марки по
+PER_BRAND вариантов поровну между категориями, у части вариантов фото
+(file_id). Один и тот же seed даёт одну и ту же базу.
+
+    python -m benchmarks.synthetic путь.db [вариантов] [seed]
+"""
+import os
+import random
+import sys
+import time
+
+import database
+
+PER_BRAND = 10
+PHOTO_SHARE = 0.5
+
+WORDS = ("Elf", "Bar", "Lost", "Mary", "Vapor", "Geek", "Husky", "Brusko", "Smok", "Voopoo",
+         "Cloud", "Nord", "Frost", "Mango", "Berry", "Chaser", "Boshki", "Pod", "Max", "Ice")
+COLORS = ("Чёрный", "Белый", "Синий", "Красный", "Зелёный", "Серый", "Розовый", "Золотой")
+STRENGTHS = ("0 mg", "3 mg", "6 mg", "12 mg", "20 mg", "35 mg", "50 mg")
+FLAVORS = ("манго", "арбуз", "черника", "мята", "вишня", "кола", "лимон", "виноград")
+
+
+def _remove(path):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def build_catalog(path, variants, seed=1, per_brand=PER_BRAND, photo_share=PHOTO_SHARE):
+    """Создаёт базу path заново; ровно variants вариантов (с демо-данными init_db)."""
+    _remove(path)
+    database.DB_NAME = path
+    database.init_db()
+    rnd = random.Random(seed)
+    conn = database.get_connection()
+    try:
+        cats = conn.execute("SELECT id, option_type FROM categories ORDER BY id").fetchall()
+        missing = variants - conn.execute("SELECT COUNT(*) FROM variants").fetchone()[0]
+        brands = -(-missing // per_brand)
+        with conn:
+            conn.executemany(
+                "INSERT INTO products (brand, category_id) VALUES (?, ?)",
+                [(f"{rnd.choice(WORDS)} {rnd.choice(WORDS)} {i + 1}", cats[i % len(cats)][0]) for i in range(brands)]
+            )
+            products = conn.execute(
+                "SELECT p.id, c.option_type FROM products p JOIN categories c ON c.id = p.category_id "
+                "WHERE p.variant_count = 0 ORDER BY p.id"
+            ).fetchall()
+            rows = []
+            for prod_id, option_type in products:
+                for j in range(min(per_brand, missing - len(rows))):
+                    if option_type == "color":
+                        option = f"{rnd.choice(COLORS)} {j + 1}"
+                    else:
+                        option = f"{rnd.choice(STRENGTHS)} {rnd.choice(FLAVORS)} {j + 1}"
+                    image = f"bench-file-{prod_id}-{j}" if rnd.random() < photo_share else None
+                    rows.append((prod_id, option, rnd.randrange(300, 5000, 50), rnd.randint(0, 30), image))
+            conn.executemany(
+                "INSERT INTO variants (product_id, option, price, stock, image_id) VALUES (?, ?, ?, ?, ?)", rows
+            )
+    finally:
+        conn.close()
+    return path
+
+
+if __name__ == "__main__":
+    target = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    started = time.perf_counter()
+    build_catalog(target, count, seed)
+    print(f"{target}: {count} вариантов за {time.perf_counter() - started:.1f} с")
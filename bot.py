@@ -1,32 +1,82 @@
 # bot.py
 import os
+import asyncio
+import functools
+import time
 import logging
+import tempfile
 from dotenv import load_dotenv
+
+# до импорта модулей, которые читают свои настройки из окружения при импорте
+load_dotenv()
+
 from telegram import (
-    Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto,
+    InlineQueryResultArticle, InputTextMessageContent
 )
+from telegram.error import BadRequest
 from telegram.ext import (
-    Application, CommandHandler, CallbackQueryHandler,
+    Application, CommandHandler, InlineQueryHandler,
     MessageHandler, filters, ContextTypes, ConversationHandler
 )
-from database import get_connection, init_db
+from database import (
+    fetch_one, fetch_all, execute, transaction, run_db, brands_page, variants_page,
+    init_db, close_pool, start_writer, stop_writer, set_query_observer
+)
+from catalog import catalog
+import checkout
+import importer
+import bulkedit
+import search
+import images
+import callbacks as cb
+import views
+import webhook
+from sequencer import ChatSequencer
+from ratelimit import TelegramRateLimiter, BACKGROUND_ARGS
+from debounce import CallbackDebouncer
+import metrics
+import profiler
+import journal
 
-load_dotenv()
 TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_USER_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+# скрывать в магазине категории без товаров в наличии
+HIDE_EMPTY_CATEGORIES = os.getenv("HIDE_EMPTY_CATEGORIES", "0") == "1"
+# polling (по умолчанию) или webhook — настройки webhook см. в webhook.py
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# сколько апдейтов обрабатывается одновременно (внутри одного чата — по очереди)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "32"))
+# сколько апдейтов может быть в обработке и в очередях чатов (sequencer.py)
+BOT_MAX_PENDING = int(os.getenv("BOT_MAX_PENDING", "1024"))
+# другой сервер Bot API (свой telegram-bot-api или benchmarks/fake_server.py),
+# например http://127.0.0.1:8081/bot — к адресу дописывается токен
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "")
+# поиск: кнопок в ответе на /search, результатов на страницу inline-режима и
+# сколько секунд Telegram может кэшировать inline-выдачу
+SEARCH_RESULTS = int(os.getenv("SEARCH_RESULTS", "10"))
+INLINE_RESULTS = int(os.getenv("INLINE_RESULTS", "20"))
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "30"))
+# /start v<id> — deep link на карточку варианта
+START_VARIANT_PREFIX = "v"
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
 # STATES
-SHOP_CATEGORY, SHOP_BRAND, SHOP_VARIANT = range(3)
+SHOP_CATEGORY, SHOP_BRAND, SHOP_VARIANT, SHOP_CART = range(4)
 ADMIN_MENU = 100
 ADD_BRAND_CAT, ADD_BRAND_INPUT, ADD_BRAND_CONFIRM = range(101, 104)
 ADD_VAR_CAT, ADD_VAR_BRAND, ADD_VAR_OPTION, ADD_VAR_PRICE, ADD_VAR_STOCK, ADD_VAR_PHOTO = range(104, 110)
 DEL_ACTION, DEL_CAT_SELECT, DEL_BRAND_SELECT, DEL_VAR_SELECT, DEL_CONFIRM = range(110, 115)
+IMPORT_FILE, BULK_EDIT_INPUT = range(115, 117)
+
+# Bot API отдаёт ботам файлы не больше 20 МБ
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
 
 # ---------------- helpers ----------------
 def admin_only(func):
+    @functools.wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         uid = user.id if user else None
@@ -40,6 +90,43 @@ def admin_only(func):
         return await func(update, context)
     return wrapper
 
+def _append_nav(keyboard, code, entity_id, rows, page):
+    nav = views.page_nav(code, entity_id, rows[0]['id'], rows[-1]['id'], page.has_prev, page.has_next)
+    if nav:
+        keyboard.append(nav)
+
+def _admin_back():
+    return [InlineKeyboardButton("⬅️ Назад", callback_data=cb.encode(cb.ADMIN_MENU))]
+
+async def answer_stale(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer("Меню устарело. Отправьте /start", show_alert=True)
+
+def _message_key(query):
+    if query.message:
+        return query.message.chat_id, query.message.message_id
+    return query.inline_message_id
+
+async def edit_if_changed(query, edit, reply_markup, *content):
+    """
+    edit() — правка сообщения кнопки, если оно уже не показывает content с этой
+    клавиатурой (см. views.RenderMemo). Возвращает результат edit() или None без правки.
+    """
+    key = _message_key(query)
+    fingerprint = views.fingerprint(reply_markup, *content)
+    # клавиатура из апдейта — текущая: если сообщение правили мимо памяти, она другая
+    shown = query.message is None or query.message.reply_markup == reply_markup
+    if shown and views.render_memo.same(key, fingerprint):
+        return None
+    try:
+        result = await edit()
+    except BadRequest as e:
+        # память сброшена (перезапуск, вытеснение) — но на экране уже то же самое
+        if "not modified" not in e.message.lower():
+            raise
+        result = None
+    views.render_memo.remember(key, fingerprint)
+    return result
+
 async def send_or_edit(update: Update, text: str, reply_markup=None, parse_mode=None):
     """
     Безопасно отправляет или редактирует сообщение в зависимости от того,
@@ -49,17 +136,25 @@ async def send_or_edit(update: Update, text: str, reply_markup=None, parse_mode=
         query = update.callback_query
         try:
             await query.answer()
-        except Exception:
-            pass
+        except Exception as e:
+            logger.warning("send_or_edit: answerCallbackQuery не удался: %r", e)
+            metrics.swallowed("send_or_edit.answer")
         # edit message if possible
         try:
-            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+            await edit_if_changed(
+                query,
+                functools.partial(query.edit_message_text, text, reply_markup=reply_markup, parse_mode=parse_mode),
+                reply_markup, text, parse_mode
+            )
             return
-        except Exception:
+        except Exception as e:
             # если редактирование не удалось (например, потому что сообщение уже другое),
             # попробуем отправить новое сообщение в чат
+            logger.warning("send_or_edit: редактирование не удалось, отправляем новое сообщение: %r", e)
+            metrics.swallowed("send_or_edit.edit")
             chat_id = query.message.chat_id
-            await query.message.bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode=parse_mode)
+            sent = await query.message.bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode=parse_mode)
+            views.render_memo.remember((chat_id, sent.message_id), views.fingerprint(reply_markup, text, parse_mode))
             return
     elif update.message:
         await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
@@ -70,134 +165,319 @@ async def send_or_edit(update: Update, text: str, reply_markup=None, parse_mode=
 
 # ---------------- Магазин ----------------
 async def start_shop(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    conn = get_connection()
-    cats = conn.execute("SELECT * FROM categories ORDER BY id").fetchall()
-    conn.close()
-
-    keyboard = [[InlineKeyboardButton(c['name'], callback_data=f"cat_{c['id']}")] for c in cats]
-    reply = InlineKeyboardMarkup(keyboard)
-    await send_or_edit(update, "🛍 Выберите категорию:", reply_markup=reply)
+    # /start v123 — ссылка на вариант из inline-поиска
+    payload = context.args[0] if update.message and context.args else ""
+    if isinstance(payload, str) and payload.startswith(START_VARIANT_PREFIX) and payload[1:].isdigit():
+        return await send_variant(update.message, int(payload[1:]))
+    view = views.category_list(in_stock_only=HIDE_EMPTY_CATEGORIES)
+    await send_or_edit(update, view.text, reply_markup=view.reply_markup)
     return SHOP_CATEGORY
 
 async def shop_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # обработаем разные форматы callback: cat_{id} или back_cat_{id}
-    if update.callback_query:
-        data = update.callback_query.data
-    else:
-        # если вызван как message (маловероятно), прервём
-        await send_or_edit(update, "Ошибка: неверный формат вызова.")
-        return ConversationHandler.END
-
-    if data.startswith("cat_"):
-        cat_id = int(data.split("_", 1)[1])
-    elif data.startswith("back_cat_"):
-        cat_id = int(data.split("_", 2)[2])
-    else:
-        await update.callback_query.answer()
-        return ConversationHandler.END
-
-    conn = get_connection()
-    category = conn.execute("SELECT * FROM categories WHERE id=?", (cat_id,)).fetchone()
-    products = conn.execute("""
-        SELECT p.id, p.brand, COALESCE(SUM(v.stock),0) as total_stock
-        FROM products p
-        LEFT JOIN variants v ON v.product_id = p.id
-        WHERE p.category_id = ?
-        GROUP BY p.id
-        HAVING total_stock > 0
-        ORDER BY p.brand
-    """, (cat_id,)).fetchall()
-    conn.close()
-
-    if not products:
-        kb = [[InlineKeyboardButton("⬅️ Назад", callback_data="back_categories")]]
-        await send_or_edit(update, "❌ Нет товаров в наличии.", reply_markup=InlineKeyboardMarkup(kb))
-        return SHOP_CATEGORY
-
-    keyboard = [[InlineKeyboardButton(f"{p['brand']} ({p['total_stock']} шт)", callback_data=f"brand_{p['id']}")] for p in products]
-    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data="back_categories")])
-    await send_or_edit(update, f"📦 Товары в категории «{category['name']}»:",
-                       reply_markup=InlineKeyboardMarkup(keyboard))
-    return SHOP_BRAND
+    cat_id, after, before = cb.split_cursor(context.args)
+    view = views.category_page(cat_id, after, before)
+    await send_or_edit(update, view.text, reply_markup=view.reply_markup)
+    return SHOP_CATEGORY if view.empty else SHOP_BRAND
 
 async def shop_brand(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    data = update.callback_query.data
-    if data.startswith("brand_"):
-        prod_id = int(data.split("_", 1)[1])
-    elif data.startswith("back_brand_"):
-        prod_id = int(data.split("_", 2)[2])
-    else:
-        await update.callback_query.answer()
-        return ConversationHandler.END
-
-    conn = get_connection()
-    product = conn.execute("SELECT * FROM products WHERE id=?", (prod_id,)).fetchone()
-    if not product:
-        conn.close()
-        await update.callback_query.edit_message_text("❌ Продукт не найден.")
+    prod_id, after, before = cb.split_cursor(context.args)
+    view = views.brand_page(prod_id, after, before)
+    if not view:
+        await send_or_edit(update, "❌ Продукт не найден.")
         return SHOP_CATEGORY
-    category = conn.execute("SELECT * FROM categories WHERE id=?", (product['category_id'],)).fetchone()
-    variants = conn.execute("SELECT * FROM variants WHERE product_id=? AND stock>0 ORDER BY option", (prod_id,)).fetchall()
-    conn.close()
-
-    if not variants:
-        kb = [[InlineKeyboardButton("⬅️ Назад", callback_data=f"back_cat_{product['category_id']}")]]
-        await update.callback_query.edit_message_text("❌ Нет доступных вариантов.", reply_markup=InlineKeyboardMarkup(kb))
-        return SHOP_BRAND
-
-    option_label = "Цвет" if category["option_type"] == "color" else "Крепость"
-    keyboard = [[InlineKeyboardButton(f"{v['option']} — {int(v['price'])}₽ ({v['stock']} шт)", callback_data=f"var_{v['id']}")] for v in variants]
-    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data=f"back_cat_{product['category_id']}")])
-    await update.callback_query.edit_message_text(f"🔹 {product['brand']} — {option_label}:", reply_markup=InlineKeyboardMarkup(keyboard))
-    return SHOP_VARIANT
+    await send_or_edit(update, view.text, reply_markup=view.reply_markup)
+    return SHOP_BRAND if view.empty else SHOP_VARIANT
 
 async def shop_variant(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    var_id = int(query.data.split("_")[1])
+    await update.callback_query.answer()
+    return await show_variant(update.callback_query, context.args[0])
 
-    conn = get_connection()
-    variant = conn.execute("""
-        SELECT v.*, p.brand, p.category_id 
-        FROM variants v 
-        JOIN products p ON v.product_id = p.id 
-        WHERE v.id=?
-    """, (var_id,)).fetchone()
-    conn.close()
+def variant_card(var_id):
+    """(variant, caption, reply_markup) карточки варианта или None."""
+    variant = catalog.variants.get(var_id)
+    if not variant:
+        return None
+    product = catalog.products[variant.product_id]
+    category = catalog.categories[product.category_id]
 
-    option_label = "Цвет" if context.user_data.get("option_type") == "color" else "Крепость"
+    option_label = views.option_label(category)
 
     caption = (
-        f"📦 {variant['brand']}\n"
-        f"🔹 {option_label}: {variant['option']}\n"
-        f"💰 Цена: {variant['price']}₽\n"
-        f"📦 В наличии: {variant['stock']}"
+        f"📦 {product.brand}\n"
+        f"🔹 {option_label}: {variant.option}\n"
+        f"💰 Цена: {variant.price}₽\n"
+        f"📦 В наличии: {variant.stock}"
     )
 
-    keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data=f"back_brand_{variant['product_id']}")]]
+    keyboard = []
+    if variant.stock > 0:
+        keyboard.append([InlineKeyboardButton("🛒 В корзину", callback_data=cb.encode(cb.ADD_TO_CART, var_id))])
+    keyboard.append([InlineKeyboardButton("🧺 Корзина", callback_data=cb.encode(cb.CART))])
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data=cb.encode(cb.BRAND, variant.product_id))])
+    return variant, caption, InlineKeyboardMarkup(keyboard)
 
-    if variant["image_id"]:
+async def show_variant(query, var_id):
+    card = variant_card(var_id)
+    if not card:
+        await query.edit_message_text("❌ Вариант не найден.")
+        return SHOP_VARIANT
+    variant, caption, reply_markup = card
+
+    if variant.image_id:
+        photo = catalog.photo(variant)
         try:
-            await query.edit_message_media(
-                InputMediaPhoto(media=variant["image_id"], caption=caption),
-                reply_markup=InlineKeyboardMarkup(keyboard)
+            sent = await edit_if_changed(
+                query,
+                functools.partial(query.edit_message_media, InputMediaPhoto(media=photo, caption=caption),
+                                  reply_markup=reply_markup),
+                reply_markup, photo, caption
             )
-        except:
-            await query.edit_message_caption(caption, reply_markup=InlineKeyboardMarkup(keyboard))
+        except Exception as e:
+            logger.warning("Не удалось показать фото варианта %s: %r", var_id, e)
+            metrics.swallowed("show_variant.photo")
+            await query.edit_message_caption(caption, reply_markup=reply_markup)
+        else:
+            await _remember_file_id(variant, sent)
+    else:
+        await edit_if_changed(
+            query,
+            functools.partial(query.edit_message_text, caption, reply_markup=reply_markup),
+            reply_markup, caption, None
+        )
+
+    return SHOP_VARIANT
+
+async def send_variant(message, var_id):
+    """Карточка варианта новым сообщением (поиск, ссылка из inline-режима)."""
+    card = variant_card(var_id)
+    if not card:
+        await message.reply_text("❌ Вариант не найден.")
+        return SHOP_CATEGORY
+    variant, caption, reply_markup = card
+    if variant.image_id:
+        sent = await message.reply_photo(catalog.photo(variant), caption=caption, reply_markup=reply_markup)
+        await _remember_file_id(variant, sent)
     else:
-        await query.edit_message_text(caption, reply_markup=InlineKeyboardMarkup(keyboard))
+        await message.reply_text(caption, reply_markup=reply_markup)
+    return SHOP_VARIANT
+
+# ---------------- Фото по URL ----------------
+PREWARM_JOB = "prewarm_images"
+
+async def _store_file_id(url, file_id):
+    catalog.set_file_id(url, file_id)
+    await transaction(images.save_file_id, url, file_id)
+
+async def _remember_file_id(variant, sent):
+    """Первая отправка фото по URL: сохраняем file_id, который вернул Telegram."""
+    if not images.is_url(variant.image_id) or variant.image_id in catalog.file_ids:
+        return
+    file_id = images.sent_file_id(sent)
+    if file_id:
+        await _store_file_id(variant.image_id, file_id)
+
+def _schedule_prewarm(job_queue):
+    if job_queue is None or job_queue.get_jobs_by_name(PREWARM_JOB):
+        return
+    job_queue.run_once(prewarm_images_job, when=1, name=PREWARM_JOB)
+
+async def prewarm_images_job(context: ContextTypes.DEFAULT_TYPE):
+    """Скачивает, пережимает и загружает фото по URL, у которых ещё нет file_id."""
+    chat_id = images.IMAGE_CACHE_CHAT_ID or next(iter(ADMIN_USER_IDS), None)
+    if chat_id is None or not images.PIPELINE_ENABLED:
+        return
+    warmed, failed = 0, set()
+    while True:
+        urls = await run_db(images.pending_urls, images.PREWARM_BATCH, failed)
+        if not urls:
+            break
+        for url in urls:
+            try:
+                data = await images.fetch(url)
+                file_id = await images.prepare(context.bot, chat_id, data, BACKGROUND_ARGS)
+            except images.ImageError as e:
+                logger.warning("Прогрев фото %s не удался: %s", url, e)
+                metrics.swallowed("prewarm_images")
+                failed.add(url)
+                continue
+            await _store_file_id(url, file_id)
+            warmed += 1
+    if warmed or failed:
+        logger.info("Прогрев фото: получено %d file_id, ошибок %d", warmed, len(failed))
+
+# ---------------- Поиск ----------------
+def _variant_title(variant):
+    product = catalog.products[variant.product_id]
+    return f"{product.brand} — {variant.option} · {int(variant.price)}₽"
+
+async def shop_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = " ".join(context.args or ())
+    if not text:
+        await update.message.reply_text("🔎 Напишите, что ищете: /search elf bar 20")
+        return SHOP_CATEGORY
+    result = await search.find(text, limit=SEARCH_RESULTS)
+    if not result.variants:
+        await update.message.reply_text(f"🔎 По запросу «{text}» ничего нет в наличии.")
+        return SHOP_CATEGORY
+    kb = [[InlineKeyboardButton(_variant_title(v), callback_data=cb.encode(cb.VARIANT, v.id))] for v in result.variants]
+    kb.append([InlineKeyboardButton("⬅️ В магазин", callback_data=cb.encode(cb.CATEGORIES))])
+    title = "🔎 Точных совпадений нет. Возможно, вы искали:" if result.fuzzy else f"🔎 Найдено по запросу «{text}»:"
+    await update.message.reply_text(title, reply_markup=InlineKeyboardMarkup(kb))
+    return SHOP_VARIANT
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    result = await search.find(query.query, limit=INLINE_RESULTS, offset=offset)
+    variants = result.variants
+    results = []
+    for v in variants:
+        product = catalog.products[v.product_id]
+        category = catalog.categories[product.category_id]
+        link = f"https://t.me/{context.bot.username}?start={START_VARIANT_PREFIX}{v.id}"
+        results.append(InlineQueryResultArticle(
+            id=str(v.id),
+            title=f"{product.brand} — {v.option}",
+            description=f"{int(v.price)}₽ · {v.stock} шт · {category.name}",
+            input_message_content=InputTextMessageContent(
+                f"📦 {product.brand}\n🔹 {views.option_label(category)}: {v.option}\n💰 Цена: {v.price}₽"
+            ),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🛒 Открыть в магазине", url=link)]]),
+        ))
+    # выдача одинакова для всех, поэтому Telegram может отдавать её из своего кэша
+    await query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=str(offset + len(variants)) if len(variants) == INLINE_RESULTS and not result.fuzzy else "",
+    )
+
+# ---------------- Корзина ----------------
+def _apply_stock(changes):
+    for var_id, stock in changes:
+        catalog.set_variant_stock(var_id, stock)
+
+def _expiry_job_name(order_id):
+    return f"order-expiry-{order_id}"
+
+def _cancel_expiry(job_queue, order_id):
+    if job_queue is None:
+        return
+    for job in job_queue.get_jobs_by_name(_expiry_job_name(order_id)):
+        job.schedule_removal()
+
+def _schedule_expiry(job_queue, order_id, expires_at, chat_id):
+    # без JobQueue резерв снимет sweep_expired_loop (не позже чем через SWEEP_INTERVAL)
+    if job_queue is None:
+        return
+    _cancel_expiry(job_queue, order_id)
+    job_queue.run_once(expire_order_job, when=max(0, expires_at - time.time()),
+                       data=order_id, chat_id=chat_id, name=_expiry_job_name(order_id))
+
+async def expire_order_job(context: ContextTypes.DEFAULT_TYPE):
+    changes = await transaction(checkout.release, context.job.data, checkout.EXPIRED)
+    _apply_stock(changes)
+    if changes:
+        try:
+            await context.bot.send_message(context.job.chat_id, "⌛ Резерв корзины истёк, товары вернулись в продажу.",
+                                           rate_limit_args=BACKGROUND_ARGS)
+        except Exception:
+            logger.exception("Не удалось уведомить об истёкшем резерве")
+            metrics.swallowed("expire_order_job.notify")
+
+async def sweep_expired_job(context: ContextTypes.DEFAULT_TYPE):
+    _apply_stock(await transaction(checkout.expire_due))
+
+async def sweep_expired_loop(interval=checkout.SWEEP_INTERVAL):
+    """Снятие просроченных резервов без JobQueue: фоновая задача из on_startup."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            _apply_stock(await transaction(checkout.expire_due))
+        except Exception:
+            logger.exception("Не удалось снять просроченные резервы")
+            metrics.swallowed("sweep_expired_loop")
+
+async def shop_add_to_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    var_id = context.args[0]
+    try:
+        res = await transaction(checkout.reserve, update.effective_user.id, update.effective_chat.id,
+                                var_id, 1, checkout.RESERVATION_TTL)
+    except checkout.OutOfStock:
+        await query.answer("❌ Этот вариант закончился.", show_alert=True)
+        variant = catalog.variants.get(var_id)
+        if variant:
+            await catalog.refresh_product(variant.product_id)
+        return await show_variant(query, var_id)
+    catalog.set_variant_stock(var_id, res.stock)
+    _schedule_expiry(context.job_queue, res.order_id, res.expires_at, update.effective_chat.id)
+    await query.answer(f"🛒 Добавлено в корзину. Резерв на {checkout.RESERVATION_TTL // 60} мин.")
+    return await show_variant(query, var_id)
 
-    return SHOP_VARIANTS
+async def shop_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    order, items = await run_db(checkout.get_cart, update.effective_user.id)
+    to_shop = [InlineKeyboardButton("⬅️ В магазин", callback_data=cb.encode(cb.CATEGORIES))]
+    if not items:
+        await send_or_edit(update, "🧺 Корзина пуста.", reply_markup=InlineKeyboardMarkup([to_shop]))
+        return SHOP_CART
+    lines = ["🧺 Корзина:"]
+    total = 0
+    for it in items:
+        total += it['qty'] * it['price']
+        lines.append(f"{it['brand']} — {it['option']} × {it['qty']} = {int(it['qty'] * it['price'])}₽")
+    lines.append(f"\n💰 Итого: {int(total)}₽")
+    lines.append(f"⏳ Резерв до {time.strftime('%H:%M', time.localtime(order['expires_at']))}")
+    kb = [
+        [InlineKeyboardButton("✅ Оформить", callback_data=cb.encode(cb.CHECKOUT, order['id']))],
+        [InlineKeyboardButton("🗑 Очистить", callback_data=cb.encode(cb.CART_CLEAR, order['id']))],
+        to_shop
+    ]
+    await send_or_edit(update, "\n".join(lines), reply_markup=InlineKeyboardMarkup(kb))
+    return SHOP_CART
+
+async def shop_checkout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    order_id = context.args[0]
+    user = update.effective_user
+    to_shop = InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ В магазин", callback_data=cb.encode(cb.CATEGORIES))]])
+    if not await transaction(checkout.confirm, order_id, user.id):
+        # резерв истёк, но ещё не снят — снимаем сразу
+        _apply_stock(await transaction(checkout.release, order_id, checkout.EXPIRED, user.id))
+        _cancel_expiry(context.job_queue, order_id)
+        await send_or_edit(update, "❌ Корзина уже оформлена или резерв истёк.", reply_markup=to_shop)
+        return SHOP_CATEGORY
+    _cancel_expiry(context.job_queue, order_id)
+    await send_or_edit(update, f"✅ Заказ №{order_id} оформлен! Мы свяжемся с вами.", reply_markup=to_shop)
+
+    items = await run_db(checkout.get_order_items, order_id)
+    who = f"@{user.username}" if user.username else user.full_name
+    lines = [f"🆕 Заказ №{order_id} от {who} (id {user.id}):"]
+    lines += [f"{it['brand']} — {it['option']} × {it['qty']} по {int(it['price'])}₽" for it in items]
+    for admin_id in ADMIN_USER_IDS:
+        try:
+            await context.bot.send_message(admin_id, "\n".join(lines), rate_limit_args=BACKGROUND_ARGS)
+        except Exception:
+            logger.exception("Не удалось отправить заказ администратору %s", admin_id)
+            metrics.swallowed("shop_checkout.notify_admin")
+    return SHOP_CATEGORY
+
+async def shop_cart_clear(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    order_id = context.args[0]
+    _apply_stock(await transaction(checkout.release, order_id, checkout.CANCELLED, update.effective_user.id))
+    _cancel_expiry(context.job_queue, order_id)
+    return await shop_cart(update, context)
 
 
 # ---------------- Админка ----------------
 @admin_only
 async def admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     kb = [
-        [InlineKeyboardButton("➕ Добавить марку", callback_data="admin_add_brand")],
-        [InlineKeyboardButton("➕ Добавить товар", callback_data="admin_add_variant")],
-        [InlineKeyboardButton("🗑️ Удалить", callback_data="admin_delete")],
-        [InlineKeyboardButton("⬅️ В магазин", callback_data="back_to_shop")]
+        [InlineKeyboardButton("➕ Добавить марку", callback_data=cb.encode(cb.ADD_BRAND))],
+        [InlineKeyboardButton("➕ Добавить товар", callback_data=cb.encode(cb.ADD_VARIANT))],
+        [InlineKeyboardButton("🗑️ Удалить", callback_data=cb.encode(cb.DELETE))],
+        [InlineKeyboardButton("📥 Импорт CSV/JSONL", callback_data=cb.encode(cb.IMPORT))],
+        [InlineKeyboardButton("✏️ Остатки и цены", callback_data=cb.encode(cb.BULK_EDIT))],
+        [InlineKeyboardButton("⬅️ В магазин", callback_data=cb.encode(cb.BACK_TO_SHOP))]
     ]
     await send_or_edit(update, "🛠️ Панель администратора:", reply_markup=InlineKeyboardMarkup(kb))
     return ADMIN_MENU
@@ -206,18 +486,16 @@ async def admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 @admin_only
 async def admin_add_brand_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # показать категории
-    conn = get_connection()
-    cats = conn.execute("SELECT id, name FROM categories ORDER BY id").fetchall()
-    conn.close()
-    keyboard = [[InlineKeyboardButton(c['name'], callback_data=f"admin_addbrand_cat_{c['id']}")] for c in cats]
-    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_back_menu")])
+    cats = await fetch_all("SELECT id, name FROM categories ORDER BY id")
+    keyboard = [[InlineKeyboardButton(c['name'], callback_data=cb.encode(cb.ADD_BRAND_CAT, c['id']))] for c in cats]
+    keyboard.append(_admin_back())
     await update.callback_query.edit_message_text("Выберите категорию для новой марки:", reply_markup=InlineKeyboardMarkup(keyboard))
     return ADD_BRAND_CAT
 
 @admin_only
 async def admin_add_brand_cat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
-    cat_id = int(update.callback_query.data.split("_")[-1])
+    cat_id = context.args[0]
     context.user_data['admin_new_brand_cat_id'] = cat_id
     # попросим ввести название марки
     await update.callback_query.message.reply_text("Введите название марки (текст):")
@@ -231,8 +509,8 @@ async def admin_add_brand_input(update: Update, context: ContextTypes.DEFAULT_TY
     context.user_data['admin_new_brand_name'] = brand
     # подтвердим через кнопки
     keyboard = [
-        [InlineKeyboardButton("✅ Подтвердить", callback_data="admin_addbrand_confirm_yes")],
-        [InlineKeyboardButton("❌ Отмена", callback_data="admin_addbrand_confirm_no")]
+        [InlineKeyboardButton("✅ Подтвердить", callback_data=cb.encode(cb.ADD_BRAND_CONFIRM, 1))],
+        [InlineKeyboardButton("❌ Отмена", callback_data=cb.encode(cb.ADD_BRAND_CONFIRM, 0))]
     ]
     await update.message.reply_text(f"Подтвердите добавление марки:\n\n{brand}", reply_markup=InlineKeyboardMarkup(keyboard))
     return ADD_BRAND_CONFIRM
@@ -240,7 +518,7 @@ async def admin_add_brand_input(update: Update, context: ContextTypes.DEFAULT_TY
 @admin_only
 async def admin_add_brand_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
-    if update.callback_query.data.endswith("_no"):
+    if not context.args[0]:
         await update.callback_query.edit_message_text("Добавление марки отменено.")
         return await admin_start(update, context)
     # yes
@@ -249,49 +527,45 @@ async def admin_add_brand_confirm(update: Update, context: ContextTypes.DEFAULT_
     if not brand or not cat_id:
         await update.callback_query.edit_message_text("Ошибка: отсутствуют данные.")
         return await admin_start(update, context)
-    conn = get_connection()
     try:
-        conn.execute("INSERT INTO products (brand, category_id) VALUES (?, ?)", (brand, cat_id))
-        conn.commit()
+        res = await execute("INSERT INTO products (brand, category_id) VALUES (?, ?)", (brand, cat_id))
+        await catalog.refresh_product(res.lastrowid)
         await update.callback_query.edit_message_text(f"✅ Марка '{brand}' добавлена.")
     except Exception as e:
         logger.exception("Ошибка при добавлении марки")
+        metrics.swallowed("admin_add_brand_confirm")
         await update.callback_query.edit_message_text("❌ Ошибка при добавлении марки (возможно уже существует).")
-    finally:
-        conn.close()
     return await admin_start(update, context)
 
 # --- Добавление варианта ---
 @admin_only
 async def admin_add_variant_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    conn = get_connection()
-    cats = conn.execute("SELECT id, name FROM categories ORDER BY id").fetchall()
-    conn.close()
-    keyboard = [[InlineKeyboardButton(c['name'], callback_data=f"admin_addvar_cat_{c['id']}")] for c in cats]
-    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_back_menu")])
+    cats = await fetch_all("SELECT id, name FROM categories ORDER BY id")
+    keyboard = [[InlineKeyboardButton(c['name'], callback_data=cb.encode(cb.ADD_VAR_CAT, c['id']))] for c in cats]
+    keyboard.append(_admin_back())
     await update.callback_query.edit_message_text("Выберите категорию для товара:", reply_markup=InlineKeyboardMarkup(keyboard))
     return ADD_VAR_CAT
 
 @admin_only
 async def admin_addvar_cat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
-    cat_id = int(update.callback_query.data.split("_")[-1])
+    cat_id, after, before = cb.split_cursor(context.args)
     context.user_data['admin_var_cat_id'] = cat_id
-    conn = get_connection()
-    brands = conn.execute("SELECT id, brand FROM products WHERE category_id=?", (cat_id,)).fetchall()
-    conn.close()
+    page = await brands_page(cat_id, after, before, views.PAGE_SIZE)
+    brands = page.items
     if not brands:
         await update.callback_query.edit_message_text("Нет марок в этой категории. Сначала добавьте марку.")
         return await admin_start(update, context)
-    kb = [[InlineKeyboardButton(b['brand'], callback_data=f"admin_addvar_brand_{b['id']}")] for b in brands]
-    kb.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_back_menu")])
+    kb = [[InlineKeyboardButton(b['brand'], callback_data=cb.encode(cb.ADD_VAR_BRAND, b['id']))] for b in brands]
+    _append_nav(kb, cb.ADD_VAR_CAT, cat_id, brands, page)
+    kb.append(_admin_back())
     await update.callback_query.edit_message_text("Выберите марку:", reply_markup=InlineKeyboardMarkup(kb))
     return ADD_VAR_BRAND
 
 @admin_only
 async def admin_addvar_brand(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
-    prod_id = int(update.callback_query.data.split("_")[-1])
+    prod_id = context.args[0]
     context.user_data['admin_var_prod_id'] = prod_id
     await update.callback_query.message.reply_text("Введите вариант (цвет/крепость):")
     return ADD_VAR_OPTION
@@ -316,13 +590,25 @@ async def admin_addvar_stock(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except ValueError:
         await update.message.reply_text("Неверное количество. Введите целое число:")
         return ADD_VAR_STOCK
-    await update.message.reply_text("Отправьте фото (лучше) или ссылку на изображение, либо '-' для пропуска:")
+    await update.message.reply_text("Отправьте фото (лучше), картинку файлом или ссылку на изображение, либо '-' для пропуска:")
     return ADD_VAR_PHOTO
 
 async def admin_addvar_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     photo_val = None
     if update.message.photo:
         photo_val = update.message.photo[-1].file_id
+    elif update.message.document and (update.message.document.mime_type or "").startswith("image/"):
+        # картинка файлом — без сжатия Telegram; уменьшаем и загружаем сами
+        doc = update.message.document
+        if doc.file_size and doc.file_size > images.IMAGE_MAX_BYTES:
+            await update.message.reply_text("❌ Картинка больше 10 МБ.")
+            return ADD_VAR_PHOTO
+        try:
+            data = await (await doc.get_file()).download_as_bytearray()
+            photo_val = await images.prepare(context.bot, update.effective_chat.id, bytes(data))
+        except images.ImageError as e:
+            await update.message.reply_text(f"❌ Не удалось обработать картинку: {e}")
+            return ADD_VAR_PHOTO
     elif update.message.text and update.message.text.strip() == "-":
         photo_val = None
     elif update.message.text and update.message.text.strip().startswith("http"):
@@ -331,15 +617,14 @@ async def admin_addvar_photo(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("Неверный формат. Отправьте фото, URL или '-'")
         return ADD_VAR_PHOTO
 
-    conn = get_connection()
-    try:
-        # если продукт не существует — создадим (на случай)
-        brand_prod_id = context.user_data.get('admin_var_prod_id')
-        if not brand_prod_id:
-            await update.message.reply_text("Ошибка: не выбран продукт.")
-            return await admin_start(update, context)
+    # если продукт не существует — создадим (на случай)
+    brand_prod_id = context.user_data.get('admin_var_prod_id')
+    if not brand_prod_id:
+        await update.message.reply_text("Ошибка: не выбран продукт.")
+        return await admin_start(update, context)
 
-        conn.execute("""
+    try:
+        await execute("""
             INSERT INTO variants (product_id, option, price, stock, image_id)
             VALUES (?, ?, ?, ?, ?)
         """, (
@@ -349,74 +634,136 @@ async def admin_addvar_photo(update: Update, context: ContextTypes.DEFAULT_TYPE)
             context.user_data.get('admin_var_stock'),
             photo_val
         ))
-        conn.commit()
+        await catalog.refresh_product(brand_prod_id)
+        if images.is_url(photo_val):
+            _schedule_prewarm(context.job_queue)
         await update.message.reply_text("✅ Вариант добавлен.")
     except Exception:
         logger.exception("Ошибка при добавлении варианта")
+        metrics.swallowed("admin_addvar_photo")
         await update.message.reply_text("❌ Ошибка при добавлении варианта.")
-    finally:
-        conn.close()
+    return await admin_start(update, context)
+
+# --- Импорт ---
+@admin_only
+async def admin_import_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(
+        "📥 Отправьте файл .csv или .jsonl (до 20 МБ).\n"
+        "Колонки: category, brand, option, price, stock, image (необязательно).\n"
+        "Существующие варианты (марка + вариант) обновляются, новые добавляются.",
+        reply_markup=InlineKeyboardMarkup([_admin_back()])
+    )
+    return IMPORT_FILE
+
+@admin_only
+async def admin_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    doc = update.message.document
+    if doc.file_size and doc.file_size > MAX_IMPORT_FILE_SIZE:
+        await update.message.reply_text("❌ Файл больше 20 МБ — разбейте его или импортируйте через CLI (python importer.py).")
+        return IMPORT_FILE
+    fmt = importer.detect_format(doc.file_name or "")
+    await update.message.reply_text("⏳ Импортирую…")
+    report = None
+    try:
+        tg_file = await doc.get_file()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f"import.{fmt}")
+            await tg_file.download_to_drive(path)
+            report = await importer.import_file(path, fmt)
+    except Exception:
+        logger.exception("Ошибка импорта")
+        metrics.swallowed("admin_import_file")
+    # часть пачек могла успеть записаться и при ошибке
+    await catalog.load()
+    _schedule_prewarm(context.job_queue)
+    if report is None:
+        await update.message.reply_text("❌ Ошибка при импорте (записанные пачки сохранены).")
+    else:
+        await update.message.reply_text("✅ Импорт завершён.\n\n" + report.summary())
+    return await admin_start(update, context)
+
+# --- Остатки и цены ---
+@admin_only
+async def admin_bulk_edit_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(
+        "✏️ Отправьте строки variant_id;stock;price сообщением или файлом.\n"
+        "5 — новое значение, +5 / -5 — изменение, пустое поле — без изменений.\n"
+        "Например:\n12;5;2500\n13;+3\n14;;1990",
+        reply_markup=InlineKeyboardMarkup([_admin_back()])
+    )
+    return BULK_EDIT_INPUT
+
+@admin_only
+async def admin_bulk_edit_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.message
+    if message.document:
+        if message.document.file_size and message.document.file_size > MAX_IMPORT_FILE_SIZE:
+            await message.reply_text("❌ Файл больше 20 МБ.")
+            return BULK_EDIT_INPUT
+        data = await (await message.document.get_file()).download_as_bytearray()
+        text = bytes(data).decode("utf-8-sig", errors="replace")
+    else:
+        text = message.text
+    try:
+        updated = await transaction(bulkedit.apply, bulkedit.parse(text.splitlines()))
+    except bulkedit.BatchError as e:
+        await message.reply_text("❌ Пакет не применён, ничего не изменено:\n\n" + e.summary())
+        return BULK_EDIT_INPUT
+    # кэш экранов сбрасывается только для затронутых марок
+    for u in updated:
+        catalog.update_variant(u.variant_id, stock=u.stock, price=u.price)
+    products = len({u.product_id for u in updated})
+    await message.reply_text(f"✅ Обновлено вариантов: {len(updated)} (марок: {products}).")
     return await admin_start(update, context)
 
 # --- Удаление ---
 @admin_only
 async def admin_delete_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     kb = [
-        [InlineKeyboardButton("Марку", callback_data="admin_del_brand")],
-        [InlineKeyboardButton("Товар", callback_data="admin_del_variant")],
-        [InlineKeyboardButton("⬅️ Назад", callback_data="admin_back_menu")]
+        [InlineKeyboardButton("Марку", callback_data=cb.encode(cb.DEL_BRAND))],
+        [InlineKeyboardButton("Товар", callback_data=cb.encode(cb.DEL_VARIANT))],
+        _admin_back()
     ]
     await update.callback_query.edit_message_text("Что хотите удалить?", reply_markup=InlineKeyboardMarkup(kb))
     return DEL_ACTION
 
 @admin_only
 async def admin_del_brand_cat(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    conn = get_connection()
-    cats = conn.execute("SELECT id, name FROM categories ORDER BY id").fetchall()
-    conn.close()
-    kb = [[InlineKeyboardButton(c['name'], callback_data=f"admin_delbrand_cat_{c['id']}")] for c in cats]
-    kb.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_back_menu")])
+    cats = await fetch_all("SELECT id, name FROM categories ORDER BY id")
+    kb = [[InlineKeyboardButton(c['name'], callback_data=cb.encode(cb.DEL_BRAND_CAT, c['id']))] for c in cats]
+    kb.append(_admin_back())
     await update.callback_query.edit_message_text("Выберите категорию:", reply_markup=InlineKeyboardMarkup(kb))
     return DEL_CAT_SELECT
 
 @admin_only
 async def admin_delbrand_brand(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
-    cat_id = int(update.callback_query.data.split("_")[-1])
-    conn = get_connection()
-    brands = conn.execute("""
-        SELECT p.id, p.brand, COUNT(v.id) as cnt
-        FROM products p
-        LEFT JOIN variants v ON v.product_id = p.id
-        WHERE p.category_id = ?
-        GROUP BY p.id
-        ORDER BY p.brand
-    """, (cat_id,)).fetchall()
-    conn.close()
+    cat_id, after, before = cb.split_cursor(context.args)
+    page = await brands_page(cat_id, after, before, views.PAGE_SIZE)
+    brands = page.items
     if not brands:
         await update.callback_query.edit_message_text("Нет марок в этой категории.")
         return await admin_start(update, context)
     kb = []
     for b in brands:
-        warn = " ⚠️" if b['cnt'] > 0 else ""
-        kb.append([InlineKeyboardButton(f"{b['brand']}{warn}", callback_data=f"admin_delbrand_confirm_{b['id']}")])
-    kb.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_back_menu")])
+        warn = " ⚠️" if b['variant_count'] > 0 else ""
+        kb.append([InlineKeyboardButton(f"{b['brand']}{warn}", callback_data=cb.encode(cb.DEL_BRAND_CHOICE, b['id']))])
+    _append_nav(kb, cb.DEL_BRAND_CAT, cat_id, brands, page)
+    kb.append(_admin_back())
     await update.callback_query.edit_message_text("Выберите марку для удаления:", reply_markup=InlineKeyboardMarkup(kb))
     return DEL_BRAND_SELECT
 
 @admin_only
 async def admin_delbrand_confirm_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
-    prod_id = int(update.callback_query.data.split("_")[-1])
-    conn = get_connection()
-    cnt = conn.execute("SELECT COUNT(*) as cnt FROM variants WHERE product_id = ?", (prod_id,)).fetchone()['cnt']
-    brand = conn.execute("SELECT brand FROM products WHERE id = ?", (prod_id,)).fetchone()
-    conn.close()
+    prod_id = context.args[0]
+    brand = await fetch_one("SELECT brand, variant_count FROM products WHERE id = ?", (prod_id,))
     brand_name = brand['brand'] if brand else 'Неизвестно'
+    cnt = brand['variant_count'] if brand else 0
     # попросим подтверждение (особенно если есть варианты)
     kb = [
-        [InlineKeyboardButton("✅ Удалить", callback_data=f"admin_delbrand_final_yes_{prod_id}")],
-        [InlineKeyboardButton("❌ Отмена", callback_data="admin_back_menu")]
+        [InlineKeyboardButton("✅ Удалить", callback_data=cb.encode(cb.DEL_BRAND_FINAL, prod_id))],
+        [InlineKeyboardButton("❌ Отмена", callback_data=cb.encode(cb.ADMIN_MENU))]
     ]
     msg = f"Вы уверены, что хотите удалить марку '{brand_name}'?"
     if cnt > 0:
@@ -427,80 +774,70 @@ async def admin_delbrand_confirm_choice(update: Update, context: ContextTypes.DE
 @admin_only
 async def admin_delbrand_final(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
-    data = update.callback_query.data
-    if data.startswith("admin_delbrand_final_yes_"):
-        prod_id = int(data.split("_")[-1])
-        conn = get_connection()
-        try:
-            conn.execute("DELETE FROM products WHERE id = ?", (prod_id,))
-            conn.commit()
-            await update.callback_query.edit_message_text("✅ Марка удалена.")
-        except Exception:
-            logger.exception("Ошибка при удалении марки")
-            await update.callback_query.edit_message_text("❌ Ошибка при удалении марки.")
-        finally:
-            conn.close()
-    else:
-        await update.callback_query.edit_message_text("Отменено.")
+    prod_id = context.args[0]
+    try:
+        await execute("DELETE FROM products WHERE id = ?", (prod_id,))
+        catalog.remove_product(prod_id)
+        await update.callback_query.edit_message_text("✅ Марка удалена.")
+    except Exception:
+        logger.exception("Ошибка при удалении марки")
+        metrics.swallowed("admin_delbrand_final")
+        await update.callback_query.edit_message_text("❌ Ошибка при удалении марки.")
     return await admin_start(update, context)
 
 # --- Удаление варианта ---
 @admin_only
 async def admin_del_variant_cat(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    conn = get_connection()
-    cats = conn.execute("SELECT id, name FROM categories ORDER BY id").fetchall()
-    conn.close()
-    kb = [[InlineKeyboardButton(c['name'], callback_data=f"admin_delvar_cat_{c['id']}")] for c in cats]
-    kb.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_back_menu")])
+    cats = await fetch_all("SELECT id, name FROM categories ORDER BY id")
+    kb = [[InlineKeyboardButton(c['name'], callback_data=cb.encode(cb.DEL_VAR_CAT, c['id']))] for c in cats]
+    kb.append(_admin_back())
     await update.callback_query.edit_message_text("Выберите категорию:", reply_markup=InlineKeyboardMarkup(kb))
     return DEL_CAT_SELECT
 
 @admin_only
 async def admin_delvar_brand(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
-    cat_id = int(update.callback_query.data.split("_")[-1])
-    conn = get_connection()
-    brands = conn.execute("SELECT id, brand FROM products WHERE category_id = ? ORDER BY brand", (cat_id,)).fetchall()
-    conn.close()
+    cat_id, after, before = cb.split_cursor(context.args)
+    page = await brands_page(cat_id, after, before, views.PAGE_SIZE)
+    brands = page.items
     if not brands:
         await update.callback_query.edit_message_text("Нет марок.")
         return await admin_start(update, context)
-    kb = [[InlineKeyboardButton(b['brand'], callback_data=f"admin_delvar_brand_{b['id']}")] for b in brands]
-    kb.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_back_menu")])
+    kb = [[InlineKeyboardButton(b['brand'], callback_data=cb.encode(cb.DEL_VAR_BRAND, b['id']))] for b in brands]
+    _append_nav(kb, cb.DEL_VAR_CAT, cat_id, brands, page)
+    kb.append(_admin_back())
     await update.callback_query.edit_message_text("Выберите марку:", reply_markup=InlineKeyboardMarkup(kb))
     return DEL_BRAND_SELECT
 
 @admin_only
 async def admin_delvar_variants(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
-    prod_id = int(update.callback_query.data.split("_")[-1])
-    conn = get_connection()
-    variants = conn.execute("SELECT id, option, price, stock FROM variants WHERE product_id = ?", (prod_id,)).fetchall()
-    conn.close()
+    prod_id, after, before = cb.split_cursor(context.args)
+    page = await variants_page(prod_id, after, before, views.PAGE_SIZE)
+    variants = page.items
     if not variants:
         await update.callback_query.edit_message_text("Нет вариантов у этой марки.")
         return await admin_start(update, context)
-    kb = [[InlineKeyboardButton(f"{v['option']} — {int(v['price'])}₽ ({v['stock']}шт)", callback_data=f"admin_delvar_confirm_{v['id']}")] for v in variants]
-    kb.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_back_menu")])
+    kb = [[InlineKeyboardButton(f"{v['option']} — {int(v['price'])}₽ ({v['stock']}шт)", callback_data=cb.encode(cb.DEL_VAR_CONFIRM, v['id']))] for v in variants]
+    _append_nav(kb, cb.DEL_VAR_BRAND, prod_id, variants, page)
+    kb.append(_admin_back())
     await update.callback_query.edit_message_text("Выберите вариант для удаления:", reply_markup=InlineKeyboardMarkup(kb))
     return DEL_VAR_SELECT
 
 @admin_only
 async def admin_delvar_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
-    var_id = int(update.callback_query.data.split("_")[-1])
-    conn = get_connection()
+    var_id = context.args[0]
     try:
-        opt = conn.execute("SELECT option FROM variants WHERE id=?", (var_id,)).fetchone()
-        conn.execute("DELETE FROM variants WHERE id = ?", (var_id,))
-        conn.commit()
+        opt = await fetch_one("SELECT option FROM variants WHERE id=?", (var_id,))
+        await execute("DELETE FROM variants WHERE id = ?", (var_id,))
+        catalog.remove_variant(var_id)
         name = opt['option'] if opt else "вариант"
         await update.callback_query.edit_message_text(f"✅ Вариант '{name}' удалён.")
     except Exception:
         logger.exception("Ошибка при удалении варианта")
+        metrics.swallowed("admin_delvar_confirm")
         await update.callback_query.edit_message_text("❌ Ошибка при удалении.")
-    finally:
-        conn.close()
     return await admin_start(update, context)
 
 # --- Возвраты ---
@@ -512,59 +849,179 @@ async def back_to_shop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return await start_shop(update, context)
 
 # ---------------- MAIN ----------------
-def main():
-    init_db()
-    app = Application.builder().token(TOKEN).build()
+# --- Профилирование ---
+@admin_only
+async def admin_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile [секунды] [sample|cprofile] — отчёт профилировщика документом."""
+    args = context.args or []
+    try:
+        seconds = int(args[0]) if args else 10
+    except ValueError:
+        seconds = 0
+    mode = args[1].lower() if len(args) > 1 else profiler.SAMPLE
+    if not 0 < seconds <= profiler.PROFILE_MAX_SECONDS or mode not in profiler.MODES:
+        await update.message.reply_text(
+            f"Использование: /profile [1–{profiler.PROFILE_MAX_SECONDS}] [{'|'.join(profiler.MODES)}]"
+        )
+        return
+    try:
+        measurement = profiler.profile(seconds, mode)
+    except profiler.ProfilerBusy:
+        await update.message.reply_text("⏳ Профилирование уже идёт.")
+        return
+    # не держим обработку апдейтов этого чата на время замера
+    context.application.create_task(_send_profile(update.message, measurement), update=update)
+    await update.message.reply_text(f"⏱ Профилирую {seconds} с ({mode})…")
+
+async def _send_profile(message, measurement):
+    report, filename, summary = await measurement
+    await message.reply_document(report, filename=filename, caption=summary[:1024])
+
+async def on_startup(app: Application):
+    await start_writer()
+    try:
+        app.bot_data["metrics_server"] = await metrics.start_server()
+    except OSError as e:
+        logger.warning("Эндпоинт метрик не запущен (%s:%s): %s", metrics.METRICS_LISTEN, metrics.METRICS_PORT, e)
+    if app.bot_data.get("metrics_server") is not None:
+        app.bot_data["loop_lag"] = asyncio.create_task(metrics.watch_loop_lag())
+    if "journal" in app.bot_data:
+        app.bot_data["journal"].start()
+    if not images.PIPELINE_ENABLED:
+        logger.warning("Pillow не установлен (pip install Pillow): фото не уменьшаются и не прогреваются, "
+                       "фото по URL отправляются ссылкой, картинки файлом не принимаются")
+    # резервы, истёкшие пока бот был выключен
+    await transaction(checkout.expire_due)
+    await catalog.load()
+    if app.job_queue is None:
+        logger.warning("JobQueue недоступна (pip install \"python-telegram-bot[job-queue]\"): "
+                       "просроченные резервы снимаются раз в %s с", checkout.SWEEP_INTERVAL)
+        app.bot_data["expiry_sweep"] = asyncio.create_task(sweep_expired_loop())
+    else:
+        app.job_queue.run_repeating(sweep_expired_job, interval=checkout.SWEEP_INTERVAL, first=checkout.SWEEP_INTERVAL)
+        _schedule_prewarm(app.job_queue)
+
+async def on_shutdown(app: Application):
+    for name in ("loop_lag", "expiry_sweep"):
+        task = app.bot_data.pop(name, None)
+        if task is not None:
+            task.cancel()
+    server = app.bot_data.pop("metrics_server", None)
+    if server is not None:
+        await server.close()
+    metrics.unregister_app(app)
+    await stop_writer()
+    close_pool()
+    images.close_process_pool()
+    update_journal = app.bot_data.pop("journal", None)
+    if update_journal is not None:
+        # дописать очередь и сжать последний файл — вне event loop
+        await asyncio.get_running_loop().run_in_executor(None, update_journal.stop)
+
+def build_application(builder=None, mode=BOT_MODE):
+    """
+    Application со всеми обработчиками. builder — уже настроенный
+    ApplicationBuilder (токен, запросы, ограничитель); по умолчанию — боевой.
+    """
+    if builder is None:
+        builder = Application.builder().token(TOKEN).rate_limiter(TelegramRateLimiter())
+        if BOT_API_BASE_URL:
+            builder = builder.base_url(BOT_API_BASE_URL)
+    builder = (
+        builder.concurrent_updates(ChatSequencer(BOT_WORKERS, BOT_MAX_PENDING))
+        .post_init(on_startup).post_shutdown(on_shutdown)
+    )
+    # журнал апдейтов для benchmarks/replay.py: запись при поступлении, до очереди
+    update_journal = journal.UpdateJournal(journal.JOURNAL_DIR) if journal.JOURNAL_DIR else None
+    if mode == "webhook":
+        # апдейты приходят в HTTP-сервер webhook.py (он же пишет их в журнал);
+        # ограниченная очередь — при перегрузке он отвечает 503, и Telegram
+        # доставит апдейт повторно
+        builder = builder.updater(None).update_queue(asyncio.Queue(maxsize=webhook.WEBHOOK_QUEUE_SIZE))
+    elif update_journal is not None:
+        builder = builder.update_queue(journal.JournalQueue(update_journal))
+    app = builder.build()
+
+    router = cb.CallbackRouter()
+    for code, callback in (
+        (cb.CATEGORIES, start_shop),
+        (cb.CATEGORY, shop_category),
+        (cb.BRAND, shop_brand),
+        (cb.VARIANT, shop_variant),
+        (cb.ADD_TO_CART, shop_add_to_cart),
+        (cb.CART, shop_cart),
+        (cb.CHECKOUT, shop_checkout),
+        (cb.CART_CLEAR, shop_cart_clear),
+        (cb.ADMIN_MENU, admin_back_menu),
+        (cb.BACK_TO_SHOP, back_to_shop),
+        (cb.ADD_BRAND, admin_add_brand_start),
+        (cb.ADD_BRAND_CAT, admin_add_brand_cat),
+        (cb.ADD_BRAND_CONFIRM, admin_add_brand_confirm),
+        (cb.ADD_VARIANT, admin_add_variant_start),
+        (cb.ADD_VAR_CAT, admin_addvar_cat),
+        (cb.ADD_VAR_BRAND, admin_addvar_brand),
+        (cb.IMPORT, admin_import_start),
+        (cb.BULK_EDIT, admin_bulk_edit_start),
+        (cb.DELETE, admin_delete_start),
+        (cb.DEL_BRAND, admin_del_brand_cat),
+        (cb.DEL_VARIANT, admin_del_variant_cat),
+        (cb.DEL_BRAND_CAT, admin_delbrand_brand),
+        (cb.DEL_BRAND_CHOICE, admin_delbrand_confirm_choice),
+        (cb.DEL_BRAND_FINAL, admin_delbrand_final),
+        (cb.DEL_VAR_CAT, admin_delvar_brand),
+        (cb.DEL_VAR_BRAND, admin_delvar_variants),
+        (cb.DEL_VAR_CONFIRM, admin_delvar_confirm),
+    ):
+        router.add(code, callback)
+    stale = cb.StaleHandler(answer_stale)
 
     shop_conv = ConversationHandler(
-        entry_points=[CommandHandler("start", start_shop)],
+        entry_points=[CommandHandler("start", start_shop), CommandHandler("cart", shop_cart),
+                      CommandHandler("search", shop_search)],
         states={
-            SHOP_CATEGORY: [CallbackQueryHandler(shop_category, pattern=r"^cat_|^back_cat_")],
-            SHOP_BRAND: [
-                CallbackQueryHandler(shop_brand, pattern=r"^brand_|^back_brand_"),
-                CallbackQueryHandler(start_shop, pattern=r"^back_categories$")
-            ],
-            SHOP_VARIANT: [
-                CallbackQueryHandler(shop_variant, pattern=r"^var_"),
-                CallbackQueryHandler(shop_category, pattern=r"^back_cat_"),
-                CallbackQueryHandler(shop_brand, pattern=r"^back_brand_")
-            ],
+            SHOP_CATEGORY: [router.handler(cb.CATEGORY, cb.CATEGORIES, cb.CART)],
+            SHOP_BRAND: [router.handler(cb.BRAND, cb.CATEGORY, cb.CATEGORIES)],
+            SHOP_VARIANT: [router.handler(cb.VARIANT, cb.CATEGORY, cb.CATEGORIES, cb.BRAND, cb.ADD_TO_CART, cb.CART)],
+            SHOP_CART: [router.handler(cb.CHECKOUT, cb.CART_CLEAR, cb.CART, cb.CATEGORIES)],
         },
-        fallbacks=[CommandHandler("start", start_shop)],
+        fallbacks=[CommandHandler("start", start_shop), CommandHandler("cart", shop_cart),
+                   CommandHandler("search", shop_search), stale],
         allow_reentry=True,
         per_chat=True
     )
 
+    # «Назад» в меню админки работает из любого шага
+    def admin_routes(*codes):
+        return [router.handler(cb.ADMIN_MENU, *codes)]
+
     admin_conv = ConversationHandler(
         entry_points=[CommandHandler("admin", admin_start)],
         states={
-            ADMIN_MENU: [
-                CallbackQueryHandler(admin_add_brand_start, pattern=r"^admin_add_brand$"),
-                CallbackQueryHandler(admin_add_variant_start, pattern=r"^admin_add_variant$"),
-                CallbackQueryHandler(admin_delete_start, pattern=r"^admin_delete$"),
-                CallbackQueryHandler(back_to_shop, pattern=r"^back_to_shop$")
-            ],
-            ADD_BRAND_CAT: [CallbackQueryHandler(admin_add_brand_cat, pattern=r"^admin_addbrand_cat_")],
+            ADMIN_MENU: admin_routes(cb.ADD_BRAND, cb.ADD_VARIANT, cb.IMPORT, cb.BULK_EDIT, cb.DELETE, cb.BACK_TO_SHOP),
+            ADD_BRAND_CAT: admin_routes(cb.ADD_BRAND_CAT),
             ADD_BRAND_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_add_brand_input)],
-            ADD_BRAND_CONFIRM: [CallbackQueryHandler(admin_add_brand_confirm, pattern=r"^admin_addbrand_confirm_")],
+            ADD_BRAND_CONFIRM: admin_routes(cb.ADD_BRAND_CONFIRM),
 
-            ADD_VAR_CAT: [CallbackQueryHandler(admin_addvar_cat, pattern=r"^admin_addvar_cat_")],
-            ADD_VAR_BRAND: [CallbackQueryHandler(admin_addvar_brand, pattern=r"^admin_addvar_brand_")],
+            ADD_VAR_CAT: admin_routes(cb.ADD_VAR_CAT),
+            ADD_VAR_BRAND: admin_routes(cb.ADD_VAR_BRAND, cb.ADD_VAR_CAT),
             ADD_VAR_OPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_addvar_option)],
             ADD_VAR_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_addvar_price)],
             ADD_VAR_STOCK: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_addvar_stock)],
-            ADD_VAR_PHOTO: [MessageHandler(filters.PHOTO | (filters.TEXT & ~filters.COMMAND), admin_addvar_photo)],
-
-            DEL_ACTION: [CallbackQueryHandler(admin_del_brand_cat, pattern=r"^admin_del_brand$"),
-                         CallbackQueryHandler(admin_del_variant_cat, pattern=r"^admin_del_variant$")],
-            DEL_CAT_SELECT: [CallbackQueryHandler(admin_delbrand_brand, pattern=r"^admin_delbrand_cat_"),
-                             CallbackQueryHandler(admin_delvar_brand, pattern=r"^admin_delvar_cat_")],
-            DEL_BRAND_SELECT: [CallbackQueryHandler(admin_delbrand_confirm_choice, pattern=r"^admin_delbrand_confirm_"),
-                               CallbackQueryHandler(admin_delvar_variants, pattern=r"^admin_delvar_brand_")],
-            DEL_VAR_SELECT: [CallbackQueryHandler(admin_delvar_confirm, pattern=r"^admin_delvar_confirm_")],
-            DEL_CONFIRM: [CallbackQueryHandler(admin_delbrand_final, pattern=r"^admin_delbrand_final_")],
+            ADD_VAR_PHOTO: [MessageHandler(filters.PHOTO | filters.Document.IMAGE | (filters.TEXT & ~filters.COMMAND),
+                                           admin_addvar_photo)],
+
+            IMPORT_FILE: admin_routes() + [MessageHandler(filters.Document.ALL, admin_import_file)],
+            BULK_EDIT_INPUT: admin_routes() + [
+                MessageHandler(filters.Document.ALL | (filters.TEXT & ~filters.COMMAND), admin_bulk_edit_input)
+            ],
+
+            DEL_ACTION: admin_routes(cb.DEL_BRAND, cb.DEL_VARIANT),
+            DEL_CAT_SELECT: admin_routes(cb.DEL_BRAND_CAT, cb.DEL_VAR_CAT),
+            DEL_BRAND_SELECT: admin_routes(cb.DEL_BRAND_CHOICE, cb.DEL_VAR_BRAND, cb.DEL_BRAND_CAT, cb.DEL_VAR_CAT),
+            DEL_VAR_SELECT: admin_routes(cb.DEL_VAR_CONFIRM, cb.DEL_VAR_BRAND),
+            DEL_CONFIRM: admin_routes(cb.DEL_BRAND_FINAL),
         },
-        fallbacks=[CommandHandler("admin", admin_start)],
+        fallbacks=[CommandHandler("admin", admin_start), stale],
         allow_reentry=True,
         per_chat=True
     )
@@ -578,8 +1035,31 @@ def main():
         await send_or_edit(update, f"Ваш ID: `{uid}`", reply_markup=None, parse_mode="Markdown")
 
     app.add_handler(CommandHandler("myid", myid))
+    app.add_handler(CommandHandler("profile", admin_profile))
+    # inline-режим (@bot запрос); включается у @BotFather командой /setinline
+    app.add_handler(InlineQueryHandler(inline_search))
+    # кнопки старых версий вне активного диалога
+    app.add_handler(stale)
+    # повторные нажатия той же кнопки отсекаются до диалогов (группа -1)
+    debouncer = CallbackDebouncer()
+    debouncer.register(app)
+    app.bot_data["debouncer"] = debouncer
+    if update_journal is not None:
+        app.bot_data["journal"] = update_journal
 
-    app.run_polling()
+    # время всех обработчиков и показатели очередей — на /metrics
+    metrics.instrument_handlers(app)
+    metrics.register_app(app)
+    return app
+
+def main():
+    init_db()
+    set_query_observer(metrics.observe_db)
+    app = build_application()
+    if BOT_MODE == "webhook":
+        webhook.run(app)
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,159 @@
+# bulkedit.py
+"""
+Массовое изменение остатков и цен существующих вариантов.
+
+По строке на вариант: variant_id;stock;price
+    12;5;2500     — абсолютные значения
+    12;+3         — остаток +3, цена без изменений
+    12;-2;-100    — остаток −2, цена на 100 меньше
+    12;;1990      — только цена
+Пустое поле — без изменений. Разделитель «;» или табуляция (без них — «,»).
+Строки с # и заголовок variant_id;stock;price пропускаются.
+Остаток — свободный, без зарезервированного в корзинах. Цена — конечное
+число; абсолютная и итоговая цена должны быть больше нуля.
+
+Пакет сначала разбирается и проверяется целиком, затем применяется одной
+транзакцией (executemany): либо все строки, либо ни одной.
+
+    python bulkedit.py changes.txt    (запущенный бот увидит изменения после перезапуска)
+"""
+import math
+import re
+import sys
+from collections import namedtuple
+
+import database
+
+MAX_REPORTED_ERRORS = 20
+# ограничение SQLite на число параметров в запросе — с запасом
+_IN_CHUNK = 500
+
+# stock/price: None — без изменений; *_delta — значение прибавляется к текущему
+Change = namedtuple("Change", "line variant_id stock stock_delta price price_delta")
+# итог по варианту после применения
+Updated = namedtuple("Updated", "variant_id product_id stock price")
+
+
+class BatchError(Exception):
+    """Пакет не применён; errors — [(номер строки, причина)]."""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} ошибок")
+        self.errors = errors
+
+    def summary(self):
+        lines = [f"строка {line}: {reason}" for line, reason in self.errors[:MAX_REPORTED_ERRORS]]
+        if len(self.errors) > MAX_REPORTED_ERRORS:
+            lines.append(f"… и ещё {len(self.errors) - MAX_REPORTED_ERRORS}")
+        return "\n".join(lines)
+
+
+def _value(text, cast):
+    """'' -> (None, False); '+5' / '-5' -> (±5, True); '5' -> (5, False)."""
+    text = text.strip()
+    if not text:
+        return None, False
+    return cast(text), text[0] in "+-"
+
+def _price(text):
+    # float() принимает и "nan"/"inf" — в variants.price им не место
+    price = float(text.replace(",", "."))
+    if not math.isfinite(price):
+        raise ValueError(text)
+    return price
+
+def parse(lines):
+    """Итерируемое строк -> [Change]; BatchError со всеми ошибками разбора."""
+    changes, errors = [], []
+    for line_no, raw in enumerate(lines, 1):
+        line = raw.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = re.split(r"[;\t]", line) if re.search(r"[;\t]", line) else line.split(",")
+        if line_no == 1 and parts[0].strip().lower() == "variant_id":
+            continue
+        if not 2 <= len(parts) <= 3:
+            errors.append((line_no, "ожидается variant_id;stock;price"))
+            continue
+        try:
+            variant_id = int(parts[0])
+        except ValueError:
+            errors.append((line_no, "неверный variant_id"))
+            continue
+        try:
+            stock, stock_delta = _value(parts[1], int)
+        except ValueError:
+            errors.append((line_no, "неверный остаток"))
+            continue
+        try:
+            price, price_delta = _value(parts[2] if len(parts) > 2 else "", _price)
+        except ValueError:
+            errors.append((line_no, "неверная цена"))
+            continue
+        if price is not None and not price_delta and price <= 0:
+            errors.append((line_no, "цена должна быть больше нуля"))
+            continue
+        if stock is None and price is None:
+            errors.append((line_no, "нечего менять"))
+            continue
+        changes.append(Change(line_no, variant_id, stock, stock_delta, price, price_delta))
+    if errors:
+        raise BatchError(errors)
+    return changes
+
+def apply(conn, changes):
+    """
+    Применяет пакет (внутри транзакции вызывающего). Возвращает [Updated];
+    BatchError, если вариант не найден, остаток уходит в минус или изменённая
+    цена становится не больше нуля.
+    """
+    ids = sorted({c.variant_id for c in changes})
+    current = {}    # variant_id -> [stock, price, product_id]
+    for i in range(0, len(ids), _IN_CHUNK):
+        chunk = ids[i:i + _IN_CHUNK]
+        rows = conn.execute(
+            f"SELECT id, product_id, stock, price FROM variants WHERE id IN ({','.join('?' * len(chunk))})", chunk
+        )
+        current.update({r["id"]: [r["stock"] or 0, r["price"], r["product_id"]] for r in rows})
+
+    errors, last_line, repriced = [], {}, set()
+    for c in changes:
+        values = current.get(c.variant_id)
+        if values is None:
+            errors.append((c.line, f"нет варианта {c.variant_id}"))
+            continue
+        if c.stock is not None:
+            values[0] = values[0] + c.stock if c.stock_delta else c.stock
+        if c.price is not None:
+            values[1] = values[1] + c.price if c.price_delta else c.price
+            repriced.add(c.variant_id)
+        last_line[c.variant_id] = c.line
+    for variant_id, line in last_line.items():
+        stock, price, _ = current[variant_id]
+        if stock < 0:
+            errors.append((line, f"остаток варианта {variant_id} станет {stock}"))
+        if variant_id in repriced and price <= 0:
+            errors.append((line, f"цена варианта {variant_id} станет {price:g}"))
+    if errors:
+        raise BatchError(sorted(errors))
+
+    conn.executemany(
+        "UPDATE variants SET stock = ?, price = ? WHERE id = ?",
+        [(current[v][0], current[v][1], v) for v in last_line],
+    )
+    return [Updated(v, current[v][2], current[v][0], current[v][1]) for v in last_line]
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], encoding="utf-8-sig") as f:
+        try:
+            batch = parse(f)
+            conn = database.get_connection()
+            try:
+                updated = database.run_immediate(conn, apply, batch)
+            finally:
+                conn.close()
+        except BatchError as e:
+            print("Пакет не применён:\n" + e.summary())
+            sys.exit(1)
+    print(f"Обновлено вариантов: {len(updated)}")
@@ -0,0 +1,148 @@
+# callbacks.py
+"""
+Компактный формат callback_data и маршрутизатор по нему.
+
+Формат: "<версия><код>[:<id>...]", id — в base36, например "1c:5" или "1b:2s:-k".
+Версия меняется при несовместимом изменении кодов: старые кнопки тогда
+распознаются как устаревшие и не попадают в обработчики.
+Для страниц последний аргумент — курсор: >0 «после id», <0 «до id».
+"""
+from telegram import Update
+from telegram.ext import BaseHandler
+
+CALLBACK_VERSION = "1"
+
+# --- магазин ---
+CATEGORIES = "L"         # список категорий
+CATEGORY = "c"           # (cat_id[, cursor]) — страница категории
+BRAND = "b"              # (prod_id[, cursor]) — страница марки
+VARIANT = "v"            # (var_id,) — карточка варианта
+ADD_TO_CART = "k"        # (var_id,) — зарезервировать 1 шт
+CART = "K"               # корзина
+CHECKOUT = "o"           # (order_id,) — оформить
+CART_CLEAR = "x"         # (order_id,) — снять резерв
+# --- админка ---
+ADMIN_MENU = "am"
+BACK_TO_SHOP = "as"
+ADD_BRAND = "ab"
+ADD_BRAND_CAT = "abc"    # (cat_id,)
+ADD_BRAND_CONFIRM = "abk"  # (1 | 0,)
+ADD_VARIANT = "av"
+ADD_VAR_CAT = "avc"      # (cat_id[, cursor])
+ADD_VAR_BRAND = "avb"    # (prod_id,)
+IMPORT = "ai"
+BULK_EDIT = "ae"
+DELETE = "ad"
+DEL_BRAND = "adb"
+DEL_VARIANT = "adv"
+DEL_BRAND_CAT = "dbc"    # (cat_id[, cursor])
+DEL_BRAND_CHOICE = "dbp"  # (prod_id,)
+DEL_BRAND_FINAL = "dbf"  # (prod_id,)
+DEL_VAR_CAT = "dvc"      # (cat_id[, cursor])
+DEL_VAR_BRAND = "dvb"    # (prod_id[, cursor])
+DEL_VAR_CONFIRM = "dvx"  # (var_id,)
+
+# decode() возвращает (code, ids); STALE — кнопка другой версии/формата
+STALE = (None, ())
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _b36(n):
+    if n < 0:
+        return "-" + _b36(-n)
+    if n < 36:
+        return _DIGITS[n]
+    out = []
+    while n:
+        n, r = divmod(n, 36)
+        out.append(_DIGITS[r])
+    return "".join(reversed(out))
+
+def encode(code, *ids):
+    data = CALLBACK_VERSION + code
+    for i in ids:
+        data += ":" + _b36(i)
+    return data
+
+def page_cursor(after=None, before=None):
+    """Аргумент-курсор для encode: (), (after,) или (-before,)."""
+    if after is not None:
+        return (after,)
+    if before is not None:
+        return (-before,)
+    return ()
+
+def split_cursor(ids):
+    """(entity_id[, cursor]) -> (entity_id, after, before)."""
+    cursor = ids[1] if len(ids) > 1 else 0
+    return ids[0], (cursor if cursor > 0 else None), (-cursor if cursor < 0 else None)
+
+def decode(data):
+    """(code, ids), STALE для кнопок другой версии/формата, None для мусора."""
+    if not data or data[0] != CALLBACK_VERSION:
+        return STALE
+    code, sep, rest = data.partition(":")
+    try:
+        if not sep:
+            return code[1:], ()
+        if ":" not in rest:
+            return code[1:], (int(rest, 36),)
+        return code[1:], tuple([int(p, 36) for p in rest.split(":")])
+    except ValueError:
+        return None
+
+
+class RouteHandler(BaseHandler):
+    """
+    Один обработчик на состояние: код из callback_data ищется в словаре.
+    callback_data разбирается один раз, в check_update: код кладётся в
+    context.route, id — в context.args.
+    """
+
+    def __init__(self, routes):
+        super().__init__(self._dispatch)
+        self.routes = routes
+
+    def check_update(self, update):
+        if not isinstance(update, Update) or not update.callback_query:
+            return None
+        data = update.callback_query.data
+        if not isinstance(data, str):
+            return None
+        decoded = decode(data)
+        if decoded and decoded[0] in self.routes:
+            return decoded
+        return None
+
+    def collect_additional_context(self, context, update, application, check_result):
+        context.route = check_result[0]
+        context.args = list(check_result[1])
+
+    async def _dispatch(self, update, context):
+        """callback обработчика: вызывает обработчик кода из таблицы."""
+        return await self.routes[context.route](update, context)
+
+
+class StaleHandler(BaseHandler):
+    """Ловит кнопки старого формата/версии и отвечает на них без вызова обработчиков."""
+
+    def check_update(self, update):
+        if isinstance(update, Update) and update.callback_query:
+            return decode(update.callback_query.data) is STALE
+        return None
+
+
+class CallbackRouter:
+    def __init__(self):
+        self.routes = {}
+
+    def add(self, code, callback):
+        if code in self.routes and self.routes[code] is not callback:
+            raise ValueError(f"callback code {code!r} already routed")
+        self.routes[code] = callback
+        return callback
+
+    def handler(self, *codes):
+        """RouteHandler для состояния ConversationHandler с подмножеством кодов."""
+        return RouteHandler({code: self.routes[code] for code in codes})
@@ -0,0 +1,277 @@
+# catalog.py
+"""
+Снимок каталога в памяти. Магазин читает категории/марки/варианты отсюда,
+без запросов к БД. Админка после каждой записи обновляет затронутые
+марки/варианты.
+
+Версии: version — сквозной счётчик изменений; у списка категорий, каждой
+категории и каждой марки своя версия (значение version на момент последнего
+изменения), поэтому кэш экранов сбрасывается только для затронутых марок.
+
+Страницы магазина показывают только товар в наличии, поэтому рядом с полными
+отсортированными списками марок категории и вариантов марки лежат такие же
+списки только того, что в наличии. Они обновляются вместе со снимком, когда
+остаток переходит через ноль, и страница — это bisect и срез не длиннее limit
+при любом числе распроданных позиций.
+
+Все изменения снимка выполняются в потоке event loop, из БД читаем через run_db.
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections import namedtuple
+
+from database import Page, run_db
+from fuzzy import BRAND, OPTION, FuzzyIndex
+import images
+
+Category = namedtuple("Category", "id name option_type")
+Product = namedtuple("Product", "id brand category_id")
+Variant = namedtuple("Variant", "id product_id option price stock image_id")
+
+
+def _variant(row):
+    return Variant(row["id"], row["product_id"], row["option"], row["price"], row["stock"] or 0, row["image_id"])
+
+def _load_all(conn):
+    cats = conn.execute("SELECT id, name, option_type FROM categories ORDER BY id").fetchall()
+    prods = conn.execute("SELECT id, brand, category_id, total_stock FROM products").fetchall()
+    vars_ = conn.execute("SELECT id, product_id, option, price, stock, image_id FROM variants").fetchall()
+    return cats, prods, vars_, images.load_file_ids(conn)
+
+def _load_product(conn, prod_id):
+    prod = conn.execute("SELECT id, brand, category_id, total_stock FROM products WHERE id=?", (prod_id,)).fetchone()
+    vars_ = conn.execute(
+        "SELECT id, product_id, option, price, stock, image_id FROM variants WHERE product_id=?", (prod_id,)
+    ).fetchall()
+    return prod, vars_
+
+
+class Catalog:
+    def __init__(self):
+        self.version = 0
+        self.categories = {}    # id -> Category
+        self.products = {}      # id -> Product
+        self.variants = {}      # id -> Variant
+        self._category_ids = []             # id категорий по порядку
+        self._products_by_category = {}     # cat_id -> [(brand, id)] отсортировано
+        self._variants_by_product = {}      # prod_id -> [(option, id)] отсортировано
+        self._stocked_products = {}         # cat_id -> [(brand, id)] марок в наличии, отсортировано
+        self._stocked_variants = {}         # prod_id -> [(option, id)] вариантов в наличии, отсортировано
+        self._product_stock = {}            # prod_id -> products.total_stock
+        self._category_stock = {}           # cat_id -> суммарный остаток категории
+        self._base_version = 0              # версия всего, что не менялось после load()
+        self._versions = {}                 # "categories" | ("category", id) | ("product", id) -> version
+        self.fuzzy = FuzzyIndex()           # триграммы марок и вариантов, обновляется вместе со снимком
+        self.file_ids = {}                  # URL фото -> file_id из variants.image_file_id
+
+    # ---------- загрузка ----------
+    async def load(self):
+        cats, prods, vars_, file_ids = await run_db(_load_all)
+        self.file_ids = file_ids
+        self.categories = {c["id"]: Category(c["id"], c["name"], c["option_type"]) for c in cats}
+        self._category_ids = [c["id"] for c in cats]
+        self.products = {}
+        self.variants = {}
+        self._products_by_category = {cid: [] for cid in self._category_ids}
+        self._variants_by_product = {}
+        self._stocked_products = {cid: [] for cid in self._category_ids}
+        self._stocked_variants = {}
+        self._product_stock = {}
+        self._category_stock = {cid: 0 for cid in self._category_ids}
+        self.fuzzy.clear()
+        for p in prods:
+            self._put_product(Product(p["id"], p["brand"], p["category_id"]), p["total_stock"])
+        for v in vars_:
+            self._put_variant(_variant(v))
+        for lists in (self._products_by_category, self._variants_by_product,
+                      self._stocked_products, self._stocked_variants):
+            for keys in lists.values():
+                keys.sort()
+        self.version += 1
+        self._base_version = self.version
+        self._versions = {}
+
+    async def refresh_product(self, prod_id):
+        """Перечитывает из БД одну марку вместе с вариантами."""
+        prod, vars_ = await run_db(_load_product, prod_id)
+        self.version += 1
+        self._drop_product(prod_id)
+        if prod:
+            self._put_product(Product(prod["id"], prod["brand"], prod["category_id"]), prod["total_stock"], ordered=True)
+            for v in vars_:
+                self._put_variant(_variant(v), ordered=True)
+        self._touch_product(prod_id)
+
+    def remove_product(self, prod_id):
+        self.version += 1
+        self._drop_product(prod_id)
+        self._touch_product(prod_id)
+
+    def remove_variant(self, var_id):
+        self.version += 1
+        variant = self.variants.pop(var_id, None)
+        if variant:
+            self._variants_by_product.get(variant.product_id, []).remove((variant.option, var_id))
+            _set_member(self._stocked_variants.get(variant.product_id, []), (variant.option, var_id), False)
+            self.fuzzy.remove(OPTION, var_id, variant.option)
+            # то же, что делают триггеры в БД
+            if variant.product_id in self.products:
+                self._add_product_stock(variant.product_id, -variant.stock)
+            self._touch_product(variant.product_id)
+
+    def set_variant_stock(self, var_id, stock):
+        """Новый остаток варианта после резерва/возврата (без чтения из БД)."""
+        self.update_variant(var_id, stock=stock)
+
+    def update_variant(self, var_id, stock=None, price=None):
+        """Новые остаток и/или цена варианта, уже записанные в БД."""
+        variant = self.variants.get(var_id)
+        if not variant:
+            return
+        stock = variant.stock if stock is None else stock
+        price = variant.price if price is None else price
+        if (stock, price) == (variant.stock, variant.price):
+            return
+        self.version += 1
+        self.variants[var_id] = variant._replace(stock=stock, price=price)
+        if (stock > 0) != (variant.stock > 0):
+            _set_member(self._stocked_variants.setdefault(variant.product_id, []), (variant.option, var_id), stock > 0)
+        delta = stock - variant.stock
+        if delta and variant.product_id in self.products:
+            self._add_product_stock(variant.product_id, delta)
+        self._touch_product(variant.product_id)
+
+    def set_file_id(self, url, file_id):
+        self.file_ids[url] = file_id
+
+    def photo(self, variant):
+        """Что отправлять как фото варианта: закэшированный file_id или исходный image_id."""
+        return self.file_ids.get(variant.image_id, variant.image_id)
+
+    # ---------- версии для кэша экранов ----------
+    def categories_version(self):
+        return self._versions.get("categories", self._base_version)
+
+    def category_version(self, cat_id):
+        return self._versions.get(("category", cat_id), self._base_version)
+
+    def product_version(self, prod_id):
+        return self._versions.get(("product", prod_id), self._base_version)
+
+    # ---------- чтение ----------
+    def list_categories(self, in_stock_only=False):
+        if in_stock_only:
+            return [self.categories[cid] for cid in self._category_ids if self._category_stock.get(cid, 0) > 0]
+        return [self.categories[cid] for cid in self._category_ids]
+
+    def category_stock(self, cat_id):
+        return self._category_stock.get(cat_id, 0)
+
+    def products_page(self, cat_id, after=None, before=None, limit=20):
+        """Страница марок в наличии: Page([(Product, total_stock)]), по (brand, id)."""
+        def key(prod_id):
+            product = self.products.get(prod_id)
+            return (product.brand, prod_id) if product else None
+        page = _keyset_page(self._stocked_products.get(cat_id, []),
+                            after and key(after), before and key(before), limit)
+        return page._replace(items=[(self.products[i], self._product_stock[i]) for i in page.items])
+
+    def variants_page(self, prod_id, after=None, before=None, limit=20):
+        """Страница вариантов в наличии: Page([Variant]), по (option, id)."""
+        def key(var_id):
+            variant = self.variants.get(var_id)
+            return (variant.option, var_id) if variant else None
+        page = _keyset_page(self._stocked_variants.get(prod_id, []),
+                            after and key(after), before and key(before), limit)
+        return page._replace(items=[self.variants[i] for i in page.items])
+
+    # ---------- внутреннее ----------
+    def _touch_product(self, prod_id):
+        """Помечает изменёнными марку и её категорию (вызывать после self.version += 1)."""
+        self._versions[("product", prod_id)] = self.version
+        product = self.products.get(prod_id)
+        if product:
+            self._versions[("category", product.category_id)] = self.version
+
+    def _add_category_stock(self, cat_id, delta):
+        old = self._category_stock.get(cat_id, 0)
+        self._category_stock[cat_id] = old + delta
+        self._versions[("category", cat_id)] = self.version
+        # список категорий зависит только от того, есть ли в категории товар
+        if (old > 0) != (old + delta > 0):
+            self._versions["categories"] = self.version
+
+    def _add_product_stock(self, prod_id, delta):
+        """Остаток марки, её категории и место марки в списке «в наличии»."""
+        old = self._product_stock[prod_id]
+        self._product_stock[prod_id] = old + delta
+        product = self.products[prod_id]
+        if (old > 0) != (old + delta > 0):
+            _set_member(self._stocked_products.setdefault(product.category_id, []),
+                        (product.brand, prod_id), old + delta > 0)
+        self._add_category_stock(product.category_id, delta)
+
+    def _put_product(self, product, total_stock, ordered=False):
+        self.products[product.id] = product
+        self._product_stock[product.id] = total_stock
+        self.fuzzy.add(BRAND, product.id, product.brand)
+        self._add_category_stock(product.category_id, total_stock)
+        self._variants_by_product[product.id] = []
+        self._stocked_variants[product.id] = []
+        key = (product.brand, product.id)
+        _add_key(self._products_by_category.setdefault(product.category_id, []), key, ordered)
+        if total_stock > 0:
+            _add_key(self._stocked_products.setdefault(product.category_id, []), key, ordered)
+
+    def _put_variant(self, variant, ordered=False):
+        self.variants[variant.id] = variant
+        self.fuzzy.add(OPTION, variant.id, variant.option)
+        key = (variant.option, variant.id)
+        _add_key(self._variants_by_product.setdefault(variant.product_id, []), key, ordered)
+        if variant.stock > 0:
+            _add_key(self._stocked_variants.setdefault(variant.product_id, []), key, ordered)
+
+    def _drop_product(self, prod_id):
+        product = self.products.pop(prod_id, None)
+        if not product:
+            return
+        self._products_by_category.get(product.category_id, []).remove((product.brand, prod_id))
+        _set_member(self._stocked_products.get(product.category_id, []), (product.brand, prod_id), False)
+        self.fuzzy.remove(BRAND, prod_id, product.brand)
+        self._stocked_variants.pop(prod_id, None)
+        for option, var_id in self._variants_by_product.pop(prod_id, ()):
+            self.variants.pop(var_id, None)
+            self.fuzzy.remove(OPTION, var_id, option)
+        self._add_category_stock(product.category_id, -self._product_stock.pop(prod_id, 0))
+
+
+def _add_key(keys, key, ordered):
+    # при load() списки сортируются один раз в конце
+    if ordered:
+        insort(keys, key)
+    else:
+        keys.append(key)
+
+def _set_member(keys, key, present):
+    """Добавляет или убирает key в отсортированном списке keys."""
+    i = bisect_left(keys, key)
+    found = i < len(keys) and keys[i] == key
+    if present and not found:
+        keys.insert(i, key)
+    elif found and not present:
+        del keys[i]
+
+
+def _keyset_page(keys, after, before, limit):
+    """
+    Keyset-страница id по отсортированному списку ключей (sort, id): bisect до
+    курсора и срез из limit элементов. Пропавший курсор — первая страница.
+    """
+    if before is not None:
+        end = bisect_left(keys, before)
+        start = max(end - limit, 0)
+        return Page([k[1] for k in keys[start:end]], start > 0, True)
+    start = bisect_right(keys, after) if after is not None else 0
+    return Page([k[1] for k in keys[start:start + limit]], after is not None, start + limit < len(keys))
+
+
+catalog = Catalog()
@@ -0,0 +1,130 @@
+# checkout.py
+"""
+Корзина и оформление заказа.
+
+Остаток резервируется сразу при добавлении в корзину условным
+UPDATE ... SET stock = stock - ? WHERE stock >= ?, поэтому продать больше,
+чем есть, невозможно при любом числе покупателей. Все функции принимают
+соединение и не коммитят сами: в боте они выполняются через
+database.transaction (короткая транзакция BEGIN IMMEDIATE у писателя),
+вне бота — через database.run_immediate.
+
+Заказ в статусе 'cart' — это резерв; по истечении expires_at он
+освобождается (status='expired') и остаток возвращается.
+"""
+import os
+import time
+from collections import namedtuple
+
+RESERVATION_TTL = int(os.getenv("RESERVATION_TTL_MIN", "15")) * 60
+# как часто снимать просроченные резервы, по которым не сработала отдельная задача (например, после рестарта)
+SWEEP_INTERVAL = int(os.getenv("CART_SWEEP_SEC", "60"))
+
+CART, CONFIRMED, EXPIRED, CANCELLED = "cart", "confirmed", "expired", "cancelled"
+
+# stock — новый остаток варианта, чтобы обновить каталог без повторного чтения
+Reservation = namedtuple("Reservation", "order_id expires_at stock")
+
+
+class OutOfStock(Exception):
+    pass
+
+
+def reserve(conn, user_id, chat_id, variant_id, qty=1, ttl=RESERVATION_TTL):
+    """
+    Резервирует qty штук варианта в корзину пользователя.
+    Возвращает Reservation; OutOfStock, если остатка не хватает.
+    """
+    cur = conn.execute("UPDATE variants SET stock = stock - ? WHERE id = ? AND stock >= ?",
+                       (qty, variant_id, qty))
+    if cur.rowcount == 0:
+        raise OutOfStock(variant_id)
+    now = time.time()
+    row = conn.execute("SELECT id FROM orders WHERE user_id = ? AND status = ?", (user_id, CART)).fetchone()
+    if row:
+        order_id = row[0]
+        # каждое добавление продлевает резерв всей корзины
+        conn.execute("UPDATE orders SET expires_at = ? WHERE id = ?", (now + ttl, order_id))
+    else:
+        order_id = conn.execute(
+            "INSERT INTO orders (user_id, chat_id, status, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (user_id, chat_id, CART, now, now + ttl),
+        ).lastrowid
+    conn.execute("""
+        INSERT INTO order_items (order_id, variant_id, qty, price)
+        VALUES (?, ?, ?, (SELECT price FROM variants WHERE id = ?))
+        ON CONFLICT(order_id, variant_id) DO UPDATE SET qty = qty + excluded.qty
+    """, (order_id, variant_id, qty, variant_id))
+    stock = conn.execute("SELECT stock FROM variants WHERE id = ?", (variant_id,)).fetchone()[0]
+    return Reservation(order_id, now + ttl, stock)
+
+
+def release(conn, order_id, status=EXPIRED, user_id=None):
+    """
+    Снимает резерв корзины и возвращает остаток. Возвращает [(variant_id, stock)]
+    с новыми остатками (пустой список, если заказ уже оформлен/освобождён или чужой).
+    """
+    sql = "UPDATE orders SET status = ? WHERE id = ? AND status = ?"
+    params = (status, order_id, CART)
+    if user_id is not None:
+        sql += " AND user_id = ?"
+        params += (user_id,)
+    if conn.execute(sql, params).rowcount == 0:
+        return []
+    conn.execute("""
+        UPDATE variants
+        SET stock = stock + (SELECT qty FROM order_items WHERE order_id = ? AND variant_id = variants.id)
+        WHERE id IN (SELECT variant_id FROM order_items WHERE order_id = ?)
+    """, (order_id, order_id))
+    rows = conn.execute("""
+        SELECT v.id, v.stock FROM order_items oi JOIN variants v ON v.id = oi.variant_id
+        WHERE oi.order_id = ?
+    """, (order_id,)).fetchall()
+    return [(r[0], r[1]) for r in rows]
+
+
+def confirm(conn, order_id, user_id):
+    """Оформляет корзину, если резерв ещё действует. True при успехе."""
+    cur = conn.execute("""
+        UPDATE orders
+        SET status = ?, total = (SELECT COALESCE(SUM(qty * price), 0) FROM order_items WHERE order_id = orders.id)
+        WHERE id = ? AND user_id = ? AND status = ? AND expires_at > ?
+          AND EXISTS (SELECT 1 FROM order_items WHERE order_id = orders.id)
+    """, (CONFIRMED, order_id, user_id, CART, time.time()))
+    return cur.rowcount == 1
+
+
+def expire_due(conn, now=None):
+    """Освобождает все просроченные корзины. Возвращает [(variant_id, stock)] как release."""
+    now = time.time() if now is None else now
+    due = conn.execute("SELECT id FROM orders WHERE status = ? AND expires_at <= ?", (CART, now)).fetchall()
+    stocks = {}
+    for row in due:
+        stocks.update(release(conn, row[0], EXPIRED))
+    return list(stocks.items())
+
+
+def get_cart(conn, user_id):
+    """(order, items) текущей корзины пользователя или (None, [])."""
+    order = conn.execute("SELECT * FROM orders WHERE user_id = ? AND status = ?", (user_id, CART)).fetchone()
+    if not order:
+        return None, []
+    items = conn.execute("""
+        SELECT oi.variant_id, oi.qty, oi.price, v.option, p.brand
+        FROM order_items oi
+        JOIN variants v ON v.id = oi.variant_id
+        JOIN products p ON p.id = v.product_id
+        WHERE oi.order_id = ?
+        ORDER BY p.brand, v.option
+    """, (order["id"],)).fetchall()
+    return order, items
+
+
+def get_order_items(conn, order_id):
+    return conn.execute("""
+        SELECT oi.qty, oi.price, v.option, p.brand
+        FROM order_items oi
+        JOIN variants v ON v.id = oi.variant_id
+        JOIN products p ON p.id = v.product_id
+        WHERE oi.order_id = ?
+    """, (order_id,)).fetchall()
@@ -1,15 +1,555 @@
 # database.py
+import asyncio
+import os
+import queue
 import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 DB_NAME = "products.db"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+# окно группировки записей в одну транзакцию: время и максимальный размер пачки
+DB_WRITE_WINDOW = float(os.getenv("DB_WRITE_WINDOW_MS", "2")) / 1000
+DB_WRITE_BATCH = int(os.getenv("DB_WRITE_BATCH", "100"))
+
+# PRAGMA, которые выполняются один раз при открытии соединения
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA mmap_size = {int(os.getenv('DB_MMAP_SIZE', str(64 * 1024 * 1024)))}",
+    f"PRAGMA cache_size = {int(os.getenv('DB_CACHE_SIZE', '-16000'))}",  # отрицательное значение — в КиБ
+    "PRAGMA busy_timeout = 5000",
+)
 
 def get_connection():
-    conn = sqlite3.connect(DB_NAME)
+    # check_same_thread=False — соединение может жить в пуле и использоваться из разных потоков
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False)
     conn.row_factory = sqlite3.Row
-    # включаем проверку внешних ключей
-    conn.execute("PRAGMA foreign_keys = ON")
+    # включаем проверку внешних ключей, WAL и остальные настройки
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+
+class ConnectionPool:
+    """
+    Пул долгоживущих соединений. Соединения создаются лениво (не больше size)
+    и возвращаются в пул после использования вместо закрытия.
+    """
+
+    def __init__(self, size=DB_POOL_SIZE):
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return get_connection()
+                except Exception:
+                    self._created -= 1
+                    raise
+        # все соединения заняты — ждём, пока какое-нибудь вернут
+        return self._idle.get()
+
+    def _release(self, conn):
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except Exception:
+            # не оставляем в пуле соединение с незавершённой транзакцией
+            conn.rollback()
+            raise
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._release(conn)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_POOL_SIZE)
+    return _pool
+
+def db_connection():
+    """Контекстный менеджер: берёт соединение из пула и возвращает его обратно."""
+    return get_pool().connection()
+
+def close_pool():
+    global _pool, _executor
+    with _pool_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+# ---------------- async-доступ ----------------
+# Все запросы выполняются в отдельном пуле потоков, чтобы не блокировать event loop.
+# Потоков столько же, сколько соединений в пуле — поток никогда не ждёт соединение.
+ExecuteResult = namedtuple("ExecuteResult", "lastrowid rowcount")
+
+_executor = None
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        size = get_pool().size
+        with _pool_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="db")
+    return _executor
+
+# наблюдатель длительности запросов observer(метка, секунды) — ставит metrics.py
+_query_observer = None
+
+def set_query_observer(observer):
+    global _query_observer
+    _query_observer = observer
+
+def _query_label(fn, args):
+    """Текст SQL для общих помощников (fetch_one/fetch_all/execute), иначе имя функции."""
+    if fn is _in_transaction:
+        fn, args = args
+    if fn in (_fetch_one, _fetch_all, _execute, _write_statement):
+        return " ".join(args[0].split())[:120]
+    return f"{fn.__module__}.{fn.__qualname__}"
+
+def _timed(fn, conn, args):
+    observer = _query_observer
+    if observer is None:
+        return fn(conn, *args)
+    started = time.perf_counter()
+    try:
+        return fn(conn, *args)
+    finally:
+        observer(_query_label(fn, args), time.perf_counter() - started)
+
+def _call_with_connection(fn, args):
+    with db_connection() as conn:
+        return _timed(fn, conn, args)
+
+async def run_db(fn, *args):
+    """Выполняет fn(conn, *args) в потоке БД и возвращает результат."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), _call_with_connection, fn, args)
+
+def _fetch_one(conn, sql, params):
+    return conn.execute(sql, params).fetchone()
+
+def _fetch_all(conn, sql, params):
+    return conn.execute(sql, params).fetchall()
+
+def _execute(conn, sql, params):
+    cur = conn.execute(sql, params)
+    conn.commit()
+    return ExecuteResult(cur.lastrowid, cur.rowcount)
+
+def _in_transaction(conn, fn, args):
+    result = fn(conn, *args)
+    conn.commit()
+    return result
+
+async def fetch_one(sql, params=()):
+    return await run_db(_fetch_one, sql, params)
+
+async def fetch_all(sql, params=()):
+    return await run_db(_fetch_all, sql, params)
+
+def _write_statement(conn, sql, params):
+    cur = conn.execute(sql, params)
+    return ExecuteResult(cur.lastrowid, cur.rowcount)
+
+async def execute(sql, params=()):
+    """Выполняет изменяющий запрос и коммитит его (через очередь записи, если она запущена)."""
+    if _writer is not None:
+        return await _writer.submit(_write_statement, sql, params)
+    return await run_db(_execute, sql, params)
+
+def run_immediate(conn, fn, *args):
+    """Синхронно: fn(conn, *args) в отдельной транзакции BEGIN IMMEDIATE (для CLI и тестов нагрузки)."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = fn(conn, *args)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return result
+
+async def transaction(fn, *args):
+    """
+    Выполняет fn(conn, *args) атомарно (commit при успехе, rollback при ошибке).
+    fn не должна сама вызывать commit/rollback.
+    """
+    if _writer is not None:
+        return await _writer.submit(fn, *args)
+    return await run_db(_in_transaction, fn, args)
+
+
+# ---------------- очередь записи ----------------
+class WriteQueue:
+    """
+    Единственный писатель: asyncio-задача владеет отдельным соединением,
+    забирает команды из очереди и выполняет их пачками в одной транзакции
+    BEGIN IMMEDIATE. Каждая команда — в своём SAVEPOINT, так что ошибка одной
+    не откатывает остальные. Один fsync на пачку и никаких SQLITE_BUSY между писателями.
+    """
+
+    def __init__(self, window=DB_WRITE_WINDOW, max_batch=DB_WRITE_BATCH):
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.batches = 0
+        self.commands = 0
+        self._queue = None
+        self._task = None
+        self._conn = None
+        # все обращения к соединению писателя — из одного потока
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._conn = await loop.run_in_executor(self._executor, get_connection)
+        # транзакциями управляем сами
+        self._conn.isolation_level = None
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run(), name="db-writer")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+        self._executor.shutdown(wait=True)
+
+    def qsize(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def submit(self, fn, *args):
+        """Ставит fn(conn, *args) в очередь и ждёт результат её выполнения."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((fn, args, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            stopping = self._drain(batch)
+            if not stopping and len(batch) < self.max_batch and self.window > 0:
+                # даём соседним записям шанс попасть в ту же транзакцию
+                await asyncio.sleep(self.window)
+                stopping = self._drain(batch)
+            results = await loop.run_in_executor(self._executor, self._apply, batch)
+            self.batches += 1
+            self.commands += len(batch)
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _drain(self, batch):
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return False
+            if item is None:
+                return True
+            batch.append(item)
+        return False
+
+    def _apply(self, batch):
+        conn = self._conn
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, _ in batch:
+                conn.execute("SAVEPOINT cmd")
+                try:
+                    results.append((True, _timed(fn, conn, args)))
+                    conn.execute("RELEASE cmd")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO cmd")
+                    conn.execute("RELEASE cmd")
+                    results.append((False, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            # не удалось начать/закоммитить транзакцию — ошибка у всей пачки
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            return [(False, e)] * len(batch)
+        return results
+
+
+_writer = None
+
+def writer_qsize():
+    return _writer.qsize() if _writer is not None else 0
+
+async def start_writer():
+    global _writer
+    if _writer is None:
+        writer = WriteQueue()
+        await writer.start()
+        _writer = writer
+    return _writer
+
+async def stop_writer():
+    global _writer
+    writer, _writer = _writer, None
+    if writer is not None:
+        await writer.stop()
+
+
+# ---------------- keyset-пагинация ----------------
+# Страница задаётся курсором — id первой (before) или последней (after) строки
+# соседней страницы. Стоимость страницы не зависит от её номера и размера таблицы.
+Page = namedtuple("Page", "items has_prev has_next")
+
+def _keyset_page(conn, table, sort_col, columns, filter_col, filter_val, after, before, limit):
+    base = f"SELECT {columns} FROM {table} WHERE {filter_col} = ?"
+    cursor_key = f"((SELECT {sort_col} FROM {table} WHERE id = ?), ?)"
+    if before is not None:
+        rows = conn.execute(
+            f"{base} AND ({sort_col}, id) < {cursor_key} ORDER BY {sort_col} DESC, id DESC LIMIT ?",
+            (filter_val, before, before, limit + 1),
+        ).fetchall()
+        has_prev = len(rows) > limit
+        return Page(rows[:limit][::-1], has_prev, True)
+    if after is not None:
+        rows = conn.execute(
+            f"{base} AND ({sort_col}, id) > {cursor_key} ORDER BY {sort_col}, id LIMIT ?",
+            (filter_val, after, after, limit + 1),
+        ).fetchall()
+        return Page(rows[:limit], True, len(rows) > limit)
+    rows = conn.execute(f"{base} ORDER BY {sort_col}, id LIMIT ?", (filter_val, limit + 1)).fetchall()
+    return Page(rows[:limit], False, len(rows) > limit)
+
+async def brands_page(cat_id, after=None, before=None, limit=20):
+    """Марки категории по (brand, id)."""
+    return await run_db(_keyset_page, "products", "brand", "id, brand, variant_count",
+                        "category_id", cat_id, after, before, limit)
+
+async def variants_page(prod_id, after=None, before=None, limit=20):
+    """Варианты марки по (option, id)."""
+    return await run_db(_keyset_page, "variants", "option", "id, option, price, stock",
+                        "product_id", prod_id, after, before, limit)
+
+# Триггеры поддерживают агрегаты точными: variants -> products -> categories.
+# При удалении марки каскад удаляет варианты уже после строки products, поэтому
+# остаток категории уменьшается триггером на products по old.total_stock.
+STOCK_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_variants_stock_insert AFTER INSERT ON variants
+    BEGIN
+        UPDATE products
+        SET total_stock = total_stock + COALESCE(new.stock, 0), variant_count = variant_count + 1
+        WHERE id = new.product_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_variants_stock_delete AFTER DELETE ON variants
+    BEGIN
+        UPDATE products
+        SET total_stock = total_stock - COALESCE(old.stock, 0), variant_count = variant_count - 1
+        WHERE id = old.product_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_variants_stock_update AFTER UPDATE OF stock, product_id ON variants
+    WHEN COALESCE(old.stock, 0) != COALESCE(new.stock, 0) OR old.product_id != new.product_id
+    BEGIN
+        UPDATE products
+        SET total_stock = total_stock - COALESCE(old.stock, 0), variant_count = variant_count - 1
+        WHERE id = old.product_id;
+        UPDATE products
+        SET total_stock = total_stock + COALESCE(new.stock, 0), variant_count = variant_count + 1
+        WHERE id = new.product_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_stock_insert AFTER INSERT ON products
+    WHEN new.total_stock != 0
+    BEGIN
+        UPDATE categories SET total_stock = total_stock + new.total_stock WHERE id = new.category_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_stock_update AFTER UPDATE OF total_stock, category_id ON products
+    WHEN old.total_stock != new.total_stock OR old.category_id != new.category_id
+    BEGIN
+        UPDATE categories SET total_stock = total_stock - old.total_stock WHERE id = old.category_id;
+        UPDATE categories SET total_stock = total_stock + new.total_stock WHERE id = new.category_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_stock_delete AFTER DELETE ON products
+    BEGIN
+        UPDATE categories SET total_stock = total_stock - old.total_stock WHERE id = old.category_id;
+    END
+    """,
+)
+
+# Новое фото варианта — закэшированный file_id старого больше не годится.
+IMAGE_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_variants_image_update AFTER UPDATE OF image_id ON variants
+    WHEN old.image_id IS NOT new.image_id AND new.image_file_id IS old.image_file_id
+    BEGIN
+        UPDATE variants SET image_file_id = NULL WHERE id = new.id;
+    END
+    """,
+)
+
+# Полнотекстовый индекс вариантов для поиска: rowid = variants.id.
+# Текст марки и категории денормализован в индекс и обновляется триггерами.
+# В индексе только варианты в наличии: вариант попадает в него и выпадает из
+# него, когда остаток переходит через ноль, поэтому поиску не нужен JOIN variants.
+SEARCH_TABLE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        brand, option, category,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+"""
+
+SEARCH_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_variants_search_insert AFTER INSERT ON variants
+    WHEN new.stock > 0
+    BEGIN
+        INSERT INTO search_index (rowid, brand, option, category)
+        SELECT new.id, p.brand, new.option, c.name
+        FROM products p JOIN categories c ON c.id = p.category_id
+        WHERE p.id = new.product_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_variants_search_delete AFTER DELETE ON variants
+    BEGIN
+        DELETE FROM search_index WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_variants_search_update AFTER UPDATE OF option, product_id ON variants
+    WHEN old.option != new.option OR old.product_id != new.product_id
+    BEGIN
+        DELETE FROM search_index WHERE rowid = old.id;
+        INSERT INTO search_index (rowid, brand, option, category)
+        SELECT new.id, p.brand, new.option, c.name
+        FROM products p JOIN categories c ON c.id = p.category_id
+        WHERE p.id = new.product_id AND new.stock > 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_variants_search_stock AFTER UPDATE OF stock ON variants
+    WHEN (COALESCE(old.stock, 0) > 0) != (COALESCE(new.stock, 0) > 0)
+    BEGIN
+        DELETE FROM search_index WHERE rowid = old.id;
+        INSERT INTO search_index (rowid, brand, option, category)
+        SELECT new.id, p.brand, new.option, c.name
+        FROM products p JOIN categories c ON c.id = p.category_id
+        WHERE p.id = new.product_id AND new.stock > 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_search_update AFTER UPDATE OF brand, category_id ON products
+    WHEN old.brand != new.brand OR old.category_id != new.category_id
+    BEGIN
+        UPDATE search_index
+        SET brand = new.brand, category = (SELECT name FROM categories WHERE id = new.category_id)
+        WHERE rowid IN (SELECT id FROM variants WHERE product_id = new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_categories_search_update AFTER UPDATE OF name ON categories
+    WHEN old.name != new.name
+    BEGIN
+        UPDATE search_index SET category = new.name
+        WHERE rowid IN (
+            SELECT v.id FROM variants v JOIN products p ON p.id = v.product_id WHERE p.category_id = new.id
+        );
+    END
+    """,
+)
+
+def _add_column(cursor, table, column, decl):
+    columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column in columns:
+        return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
+def backfill_stock_totals(conn):
+    """Полный пересчёт агрегатов (разово для старых БД или для проверки)."""
+    conn.execute("""
+        UPDATE products SET
+            total_stock = (SELECT COALESCE(SUM(stock), 0) FROM variants WHERE product_id = products.id),
+            variant_count = (SELECT COUNT(*) FROM variants WHERE product_id = products.id)
+    """)
+    conn.execute("""
+        UPDATE categories SET
+            total_stock = (SELECT COALESCE(SUM(total_stock), 0) FROM products WHERE category_id = categories.id)
+    """)
+
+def rebuild_search_index(conn):
+    """Полная перестройка поискового индекса (при создании или для проверки)."""
+    conn.execute("DELETE FROM search_index")
+    conn.execute("""
+        INSERT INTO search_index (rowid, brand, option, category)
+        SELECT v.id, p.brand, v.option, c.name
+        FROM variants v
+        JOIN products p ON p.id = v.product_id
+        JOIN categories c ON c.id = p.category_id
+        WHERE v.stock > 0
+    """)
+    conn.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+
 def init_db():
     conn = get_connection()
     cursor = conn.cursor()
@@ -18,7 +558,8 @@ def init_db():
         CREATE TABLE IF NOT EXISTS categories (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL UNIQUE,
-            option_type TEXT NOT NULL
+            option_type TEXT NOT NULL,
+            total_stock INTEGER NOT NULL DEFAULT 0
         )
     """)
 
@@ -27,6 +568,8 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             brand TEXT NOT NULL,
             category_id INTEGER NOT NULL,
+            total_stock INTEGER NOT NULL DEFAULT 0,
+            variant_count INTEGER NOT NULL DEFAULT 0,
             FOREIGN KEY(category_id) REFERENCES categories(id) ON DELETE CASCADE
         )
     """)
@@ -39,13 +582,93 @@ def init_db():
             price REAL NOT NULL,
             stock INTEGER DEFAULT 0,
             image_id TEXT,
+            image_file_id TEXT,
             FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
         )
     """)
 
+    # заказы: status 'cart' — резерв до expires_at, дальше 'confirmed' / 'expired' / 'cancelled'
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'cart',
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            total REAL NOT NULL DEFAULT 0
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_items (
+            order_id INTEGER NOT NULL,
+            variant_id INTEGER NOT NULL,
+            qty INTEGER NOT NULL CHECK (qty > 0),
+            price REAL NOT NULL,
+            PRIMARY KEY (order_id, variant_id),
+            FOREIGN KEY(order_id) REFERENCES orders(id) ON DELETE CASCADE,
+            FOREIGN KEY(variant_id) REFERENCES variants(id) ON DELETE CASCADE
+        )
+    """)
+
+    # загруженные в Telegram обработанные картинки: sha256 исходных байт -> file_id (images.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS image_files (
+            hash TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+
+    # старые products.db: добавляем колонки с агрегатами и разово пересчитываем их
+    added = _add_column(cursor, "categories", "total_stock", "INTEGER NOT NULL DEFAULT 0")
+    added |= _add_column(cursor, "products", "total_stock", "INTEGER NOT NULL DEFAULT 0")
+    added |= _add_column(cursor, "products", "variant_count", "INTEGER NOT NULL DEFAULT 0")
+    # file_id, полученный от Telegram для фото по URL (см. images.py)
+    _add_column(cursor, "variants", "image_file_id", "TEXT")
+
     # индексы для ускорения выборок
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products(category_id)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_variants_product ON variants(product_id)")
+    # составные индексы под keyset-пагинацию
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category_brand ON products(category_id, brand, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_variants_product_option ON variants(product_id, option, id)")
+    # частичный индекс: марки в наличии по категории, уже в порядке вывода
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_products_in_stock
+        ON products(category_id, brand) WHERE total_stock > 0
+    """)
+    # одна корзина на пользователя; поиск просроченных резервов
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_user_cart ON orders(user_id) WHERE status = 'cart'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_cart_expiry ON orders(expires_at) WHERE status = 'cart'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_variant ON order_items(variant_id)")
+    # варианты с одним URL фото получают file_id разом
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_variants_image ON variants(image_id)")
+
+    for trigger in STOCK_TRIGGERS + IMAGE_TRIGGERS:
+        cursor.execute(trigger)
+    if added:
+        backfill_stock_totals(conn)
+
+    # поиск: индекс создаётся и заполняется один раз, дальше его ведут триггеры
+    search_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+    ).fetchone()
+    # индекс без trg_variants_search_stock содержит и отсутствующие варианты:
+    # старые триггеры заменяются, индекс перестраивается
+    search_in_stock = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_variants_search_stock'"
+    ).fetchone()
+    if search_exists and not search_in_stock:
+        for name in ("trg_variants_search_insert", "trg_variants_search_update"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+    cursor.execute(SEARCH_TABLE)
+    for trigger in SEARCH_TRIGGERS:
+        cursor.execute(trigger)
+    if not search_exists or not search_in_stock:
+        rebuild_search_index(conn)
 
     # Категории: теперь используем "strength" вместо "flavor"
     categories = [
@@ -92,3 +715,13 @@ def init_db():
 
     conn.commit()
     conn.close()
+
+
+if __name__ == "__main__":
+    # python database.py — разовая миграция/пересчёт агрегатов остатков и поискового индекса
+    init_db()
+    conn = get_connection()
+    backfill_stock_totals(conn)
+    rebuild_search_index(conn)
+    conn.commit()
+    conn.close()
@@ -0,0 +1,90 @@
+# debounce.py
+"""
+Повторные нажатия одной и той же кнопки. Нетерпеливый пользователь жмёт
+кнопку несколько раз, и каждое нажатие прогоняло бы весь обработчик (запросы к
+каталогу/БД и правку сообщения). Обработчик в группе -1 отбрасывает нажатие,
+если тот же пользователь нажал ту же кнопку того же сообщения меньше чем
+DEBOUNCE_MS назад: отвечает на callback (убирает «часики») и останавливает
+обработку.
+
+Апдейты одного чата обрабатываются по очереди (sequencer.py), так что дубль
+попадает сюда, когда первое нажатие уже обработано; поэтому окно отсчитывается
+от конца обработки предыдущего нажатия — его отмечает обработчик в группе 1.
+
+Неидемпотентные кнопки (EXEMPT_CODES: «🛒 В корзину» резервирует ещё 1 шт на
+каждое нажатие) не гасятся: повторное нажатие там — намеренное действие.
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop, CallbackQueryHandler
+
+import callbacks as cb
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEBOUNCE_WINDOW = float(os.getenv("DEBOUNCE_MS", "700")) / 1000
+# сколько последних нажатий помнить
+DEBOUNCE_MAX_KEYS = 10000
+# коды кнопок, каждое нажатие которых что-то меняет
+EXEMPT_CODES = frozenset({cb.ADD_TO_CART})
+
+
+class CallbackDebouncer:
+    def __init__(self, window=DEBOUNCE_WINDOW, maxsize=DEBOUNCE_MAX_KEYS, exempt=EXEMPT_CODES):
+        self.window = window
+        self.maxsize = maxsize
+        self.exempt = exempt
+        self.dropped = 0
+        self.passed = 0
+        self._last = OrderedDict()     # (user, сообщение, data) -> time.monotonic()
+
+    def _exempt(self, query):
+        decoded = cb.decode(query.data)
+        return decoded is not None and decoded[0] in self.exempt
+
+    def register(self, app):
+        app.add_handler(CallbackQueryHandler(self.before), group=-1)
+        app.add_handler(CallbackQueryHandler(self.after), group=1)
+
+    def stats(self):
+        return {"dropped": self.dropped, "passed": self.passed, "tracked": len(self._last)}
+
+    @staticmethod
+    def _key(query):
+        message = query.message
+        target = (message.chat_id, message.message_id) if message else query.inline_message_id
+        return query.from_user.id, target, query.data
+
+    def _remember(self, key, now):
+        self._last[key] = now
+        self._last.move_to_end(key)
+        if len(self._last) > self.maxsize:
+            self._last.popitem(last=False)
+
+    async def before(self, update, context):
+        query = update.callback_query
+        if self._exempt(query):
+            return
+        key = self._key(query)
+        now = time.monotonic()
+        last = self._last.get(key)
+        if last is not None and now - last < self.window:
+            self.dropped += 1
+            try:
+                await query.answer()
+            except TelegramError as e:
+                logger.warning("debounce: answerCallbackQuery не удался: %r", e)
+                metrics.swallowed("debounce.answer")
+            raise ApplicationHandlerStop
+        self.passed += 1
+        self._remember(key, now)
+
+    async def after(self, update, context):
+        query = update.callback_query
+        if not self._exempt(query):
+            self._remember(self._key(query), time.monotonic())
@@ -0,0 +1,123 @@
+# fuzzy.py
+"""
+Нечёткий поиск марок и вариантов по триграммам.
+
+Строка нормализуется: нижний регистр, кириллица -> латиница, несколько
+фонетических склеек (y/i, w/v, ph/f, kh/h), повторы букв схлопываются, всё кроме
+букв и цифр выбрасывается. Так «эльф бар», «ElfBar» и «elf-bar» дают одно и то же
+«elfbar», а «Xiaomy» отличается от «Xiaomi» только последней триграммой.
+
+Индекс хранит уникальные нормализованные строки («термы») и для каждой
+триграммы — множество термов, где она встречается. Похожесть — коэффициент
+Жаккара по множествам триграмм. Кандидаты берутся только из списков самых
+редких триграмм запроса (терм с похожестью >= min_score обязан содержать хотя бы
+одну из n - ceil(min_score * n) + 1 триграмм), а списки длиннее max_posting
+(«bar», «pro» в половине марок) кандидатов не порождают, но учитываются в оценке.
+Так запрос не просматривает все строки и укладывается в доли миллисекунды.
+"""
+import math
+import os
+import re
+from functools import lru_cache
+from heapq import nlargest
+
+BRAND, OPTION = "brand", "option"
+
+FUZZY_MIN_SCORE = float(os.getenv("FUZZY_MIN_SCORE", "0.3"))
+FUZZY_MAX_POSTING = int(os.getenv("FUZZY_MAX_POSTING", "200"))
+
+_TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "h", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "", "ы": "i", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya", "і": "i", "ї": "i", "є": "e",
+})
+_FOLDS = (("ph", "f"), ("kh", "h"), ("ck", "k"), ("w", "v"), ("y", "i"), ("q", "k"))
+_NON_ALNUM = re.compile(r"[\W_]+")
+_REPEATS = re.compile(r"(.)\1+")
+
+
+# варианты вроде «12 mg» повторяются тысячи раз — нормализуем каждую строку один раз
+@lru_cache(maxsize=65536)
+def normalize(text):
+    text = _NON_ALNUM.sub("", text.lower().translate(_TRANSLIT))
+    for src, dst in _FOLDS:
+        text = text.replace(src, dst)
+    return _REPEATS.sub(r"\1", text)
+
+def trigrams(norm):
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyIndex:
+    def __init__(self, min_score=FUZZY_MIN_SCORE, max_posting=FUZZY_MAX_POSTING):
+        self.min_score = min_score
+        self.max_posting = max_posting
+        self._terms = {}        # (kind, norm) -> [множество триграмм, множество id]
+        self._postings = {}     # триграмма -> {(kind, norm)}
+
+    def __len__(self):
+        return len(self._terms)
+
+    def clear(self):
+        self._terms.clear()
+        self._postings.clear()
+
+    def add(self, kind, entity_id, text):
+        norm = normalize(text)
+        if not norm:
+            return
+        key = (kind, norm)
+        term = self._terms.get(key)
+        if term is None:
+            grams = trigrams(norm)
+            term = self._terms[key] = [grams, set()]
+            for g in grams:
+                self._postings.setdefault(g, set()).add(key)
+        term[1].add(entity_id)
+
+    def remove(self, kind, entity_id, text):
+        key = (kind, normalize(text))
+        term = self._terms.get(key)
+        if term is None:
+            return
+        term[1].discard(entity_id)
+        if term[1]:
+            return
+        del self._terms[key]
+        for g in term[0]:
+            posting = self._postings[g]
+            posting.discard(key)
+            if not posting:
+                del self._postings[g]
+
+    def top(self, text, k=10, kind=None):
+        """[(score, kind, {id})] — не больше k лучших термов с похожестью >= min_score."""
+        norm = normalize(text)
+        if not norm:
+            return []
+        grams = trigrams(norm)
+        n = len(grams)
+        postings = sorted((self._postings.get(g, ()) for g in grams), key=len)
+        candidates = set()
+        for posting in postings[:n - math.ceil(self.min_score * n) + 1]:
+            if len(posting) > self.max_posting and candidates:
+                break
+            candidates.update(posting)
+        # при похожести >= t длина терма m ограничена: t * n <= m <= n / t
+        lo, hi = self.min_score * n, n / self.min_score
+        scored = []
+        for key in candidates:
+            if kind is not None and key[0] != kind:
+                continue
+            term_grams = self._terms[key][0]
+            m = len(term_grams)
+            if m < lo or m > hi:
+                continue
+            shared = len(grams & term_grams)
+            score = shared / (n + m - shared)
+            if score >= self.min_score:
+                scored.append((score, key))
+        return [(score, key[0], set(self._terms[key][1])) for score, key in nlargest(k, scored)]
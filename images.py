@@ -0,0 +1,207 @@
+# images.py
+"""
+Фото вариантов. variants.image_id — file_id Telegram или URL картинки.
+URL Telegram при каждом показе скачивает заново (медленно, иногда с ошибкой),
+поэтому file_id, который Telegram вернул при первой отправке, сохраняется в
+variants.image_file_id (URL остаётся в image_id) — сразу для всех вариантов с
+этим URL. Дальше фото отправляется по file_id.
+
+После импорта фоновая задача прогревает file_id для всех URL без него через
+конвейер prepare(): картинка скачивается, уменьшается до IMAGE_MAX_SIDE и
+пережимается в JPEG в пуле процессов (event loop не блокируется), кладётся в
+дисковый кэш IMAGE_CACHE_DIR под sha256 исходных байт и один раз загружается
+в IMAGE_CACHE_CHAT_ID (по умолчанию — первому администратору), после чего
+сообщение удаляется. file_id по хэшу хранится в таблице image_files, так что
+одинаковые картинки под разными URL загружаются один раз.
+
+Без Pillow конвейер выключен (PIPELINE_ENABLED, предупреждение при запуске):
+фото по URL отправляются ссылкой, как до прогрева, а prepare() отказывает с
+ImageError — необработанные байты не кэшируются и не загружаются.
+"""
+import asyncio
+import hashlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from database import run_db, transaction
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+PIPELINE_ENABLED = Image is not None
+
+IMAGE_CACHE_CHAT_ID = int(os.getenv("IMAGE_CACHE_CHAT_ID", "0")) or None
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "image_cache")
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1280"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# больше не скачиваем; Bot API принимает фото до 10 МБ
+IMAGE_MAX_BYTES = 10 * 1024 * 1024
+FETCH_TIMEOUT = 20
+# URL за одну выборку прогрева
+PREWARM_BATCH = 100
+
+
+class ImageError(Exception):
+    """Картинку не удалось скачать или обработать."""
+
+
+def is_url(image_id):
+    return bool(image_id) and image_id.startswith(("http://", "https://"))
+
+def sent_file_id(message):
+    """file_id самого крупного размера фото из ответа send/edit (или None)."""
+    photo = getattr(message, "photo", None)
+    return photo[-1].file_id if photo else None
+
+# ---------- БД ----------
+def load_file_ids(conn):
+    """{url: file_id} для снимка каталога."""
+    rows = conn.execute(
+        "SELECT image_id, image_file_id FROM variants WHERE image_file_id IS NOT NULL GROUP BY image_id"
+    ).fetchall()
+    return {r[0]: r[1] for r in rows}
+
+def save_file_id(conn, url, file_id):
+    conn.execute("UPDATE variants SET image_file_id = ? WHERE image_id = ?", (file_id, url))
+
+def pending_urls(conn, limit=PREWARM_BATCH, skip=()):
+    """URL фото без file_id, кроме skip (не удалось загрузить в этом проходе)."""
+    rows = conn.execute(
+        "SELECT DISTINCT image_id FROM variants "
+        "WHERE image_file_id IS NULL AND (image_id LIKE 'http://%' OR image_id LIKE 'https://%')"
+    )
+    urls = []
+    for (url,) in rows:
+        if url not in skip:
+            urls.append(url)
+            if len(urls) >= limit:
+                break
+    return urls
+
+def _uploaded_file_id(conn, digest):
+    row = conn.execute("SELECT file_id FROM image_files WHERE hash = ?", (digest,)).fetchone()
+    return row[0] if row else None
+
+def _save_upload(conn, digest, file_id, size):
+    conn.execute(
+        "INSERT OR REPLACE INTO image_files (hash, file_id, size, created_at) VALUES (?, ?, ?, ?)",
+        (digest, file_id, size, time.time())
+    )
+
+# ---------- обработка (в процессе пула) ----------
+def cache_path(digest):
+    return os.path.join(IMAGE_CACHE_DIR, digest[:2], digest + ".jpg")
+
+def process_image(data, path, max_side=IMAGE_MAX_SIDE, quality=IMAGE_QUALITY):
+    """Уменьшает и пережимает картинку в JPEG по пути path; возвращает размер файла."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with Image.open(io.BytesIO(data)) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.mode in ("RGBA", "LA", "P"):
+            # прозрачность — на белый фон
+            im = im.convert("RGBA")
+            background = Image.new("RGB", im.size, "white")
+            background.paste(im, mask=im.getchannel("A"))
+            im = background
+        elif im.mode != "RGB":
+            im = im.convert("RGB")
+        im.thumbnail((max_side, max_side), Image.LANCZOS)
+        im.save(tmp, "JPEG", quality=quality, optimize=True, progressive=True)
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+_process_pool = None
+
+def get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _process_pool
+
+def close_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+
+# ---------- конвейер ----------
+async def fetch(url):
+    """Байты картинки по URL (httpx ставится вместе с python-telegram-bot)."""
+    import httpx
+
+    async with httpx.AsyncClient(timeout=FETCH_TIMEOUT, follow_redirects=True) as client:
+        try:
+            async with client.stream("GET", url) as resp:
+                resp.raise_for_status()
+                data = bytearray()
+                async for chunk in resp.aiter_bytes():
+                    data += chunk
+                    if len(data) > IMAGE_MAX_BYTES:
+                        raise ImageError(f"картинка больше {IMAGE_MAX_BYTES // (1024 * 1024)} МБ")
+        except httpx.HTTPError as e:
+            raise ImageError(f"не удалось скачать: {e}") from e
+    return bytes(data)
+
+_in_flight = {}     # hash -> Future с file_id, пока картинка обрабатывается/загружается
+
+async def prepare(bot, chat_id, data, rate_limit_args=None):
+    """
+    file_id для картинки data: из image_files, иначе обработка, загрузка в чат
+    chat_id (сообщение удаляется) и запись в image_files. ImageError при ошибке.
+    """
+    if not PIPELINE_ENABLED:
+        raise ImageError("обработка картинок выключена: не установлен Pillow")
+    digest = hashlib.sha256(data).hexdigest()
+    file_id = await run_db(_uploaded_file_id, digest)
+    if file_id:
+        return file_id
+    pending = _in_flight.get(digest)
+    if pending is not None:
+        return await asyncio.shield(pending)
+    pending = _in_flight[digest] = asyncio.get_running_loop().create_future()
+    try:
+        file_id = await _upload(bot, chat_id, digest, data, rate_limit_args)
+        pending.set_result(file_id)
+        return file_id
+    except Exception as e:
+        pending.set_exception(e)
+        # ошибку получит и вызывающий, и ждущие — не ругаться «never retrieved»
+        pending.exception()
+        raise
+    finally:
+        if not pending.done():
+            pending.cancel()
+        del _in_flight[digest]
+
+async def _upload(bot, chat_id, digest, data, rate_limit_args):
+    from telegram.error import TelegramError
+
+    path = cache_path(digest)
+    if not os.path.exists(path):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(get_process_pool(), process_image, data, path)
+        except Exception as e:
+            raise ImageError(f"не удалось обработать: {e!r}") from e
+    with open(path, "rb") as f:
+        processed = f.read()
+    try:
+        sent = await bot.send_photo(chat_id, processed, disable_notification=True,
+                                    rate_limit_args=rate_limit_args)
+    except TelegramError as e:
+        raise ImageError(f"Telegram не принял фото: {e}") from e
+    file_id = sent_file_id(sent)
+    if not file_id:
+        raise ImageError("Telegram не вернул file_id")
+    await transaction(_save_upload, digest, file_id, len(processed))
+    try:
+        await bot.delete_message(chat_id, sent.message_id, rate_limit_args=rate_limit_args)
+    except TelegramError:
+        pass
+    return file_id
@@ -0,0 +1,253 @@
+# importer.py
+"""
+Массовый импорт вариантов из CSV или JSONL.
+
+Колонки/ключи: category, brand, option, price, stock, image (image — необязательно).
+CSV — с заголовком, разделитель «,» или «;». Файл читается потоково и
+обрабатывается пачками по IMPORT_CHUNK строк: каждая пачка — отдельная короткая
+транзакция (staging-таблица + executemany + несколько set-based запросов),
+поэтому память не растёт с размером файла, а запись не держит БД надолго.
+
+Марка ищется по (категория, название) и создаётся при отсутствии, вариант —
+по (марка, option): существующий обновляется (price, stock и image, если указан),
+новый добавляется. Строки с ошибками пропускаются и попадают в отчёт.
+
+    python importer.py products.csv [--format csv|jsonl]
+
+Запущенный бот не видит импорт из CLI до перезапуска (снимок каталога в памяти);
+загрузка файла через /admin обновляет каталог сразу.
+"""
+import asyncio
+import csv
+import json
+import math
+import os
+import sys
+from itertools import chain, islice
+
+import database
+
+IMPORT_CHUNK = int(os.getenv("IMPORT_CHUNK", "5000"))
+# сколько ошибок показывать в отчёте
+MAX_REPORTED_ERRORS = 20
+
+FIELDS = ("category", "brand", "option", "price", "stock", "image")
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+        self.brands_created = 0
+        self.errors = []    # [(номер строки, причина)], не больше MAX_REPORTED_ERRORS
+
+    def reject(self, line, reason):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, reason))
+
+    def add(self, counts):
+        inserted, updated, brands = counts
+        self.inserted += inserted
+        self.updated += updated
+        self.brands_created += brands
+
+    def summary(self):
+        lines = [
+            f"Добавлено: {self.inserted}",
+            f"Обновлено: {self.updated}",
+            f"Отклонено: {self.rejected}",
+            f"Новых марок: {self.brands_created}",
+        ]
+        if self.errors:
+            lines.append("")
+            lines += [f"строка {line}: {reason}" for line, reason in self.errors]
+            if self.rejected > len(self.errors):
+                lines.append(f"… и ещё {self.rejected - len(self.errors)}")
+        return "\n".join(lines)
+
+
+def detect_format(filename):
+    return "jsonl" if filename.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+# ---------- разбор ----------
+def _csv_records(stream):
+    first = stream.readline()
+    delimiter = ";" if first.count(";") > first.count(",") else ","
+    reader = csv.DictReader(chain([first], stream), delimiter=delimiter)
+    if reader.fieldnames:
+        reader.fieldnames = [f.strip().lower() for f in reader.fieldnames]
+    for rec in reader:
+        yield reader.line_num, rec, None
+
+def _jsonl_records(stream):
+    for line_no, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f"неверный JSON: {e}"
+            continue
+        if not isinstance(rec, dict):
+            yield line_no, None, "ожидается объект"
+            continue
+        yield line_no, rec, None
+
+def _text(rec, field):
+    value = rec.get(field)
+    return str(value).strip() if value is not None else ""
+
+def parse_row(rec, categories):
+    """dict -> (category_id, brand, option, price, stock, image); ValueError с причиной."""
+    category_id = categories.get(_text(rec, "category").lower())
+    if category_id is None:
+        raise ValueError(f"неизвестная категория «{_text(rec, 'category')}»")
+    brand, option = _text(rec, "brand"), _text(rec, "option")
+    if not brand or not option:
+        raise ValueError("пустые brand/option")
+    try:
+        price = float(_text(rec, "price").replace(",", "."))
+    except ValueError:
+        raise ValueError("неверная цена")
+    # float() принимает и "nan"/"inf"
+    if not math.isfinite(price) or price <= 0:
+        raise ValueError("цена должна быть конечным числом больше нуля")
+    try:
+        stock = int(_text(rec, "stock") or 0)
+    except ValueError:
+        raise ValueError("неверное количество")
+    if stock < 0:
+        raise ValueError("отрицательное количество")
+    return category_id, brand, option, price, stock, _text(rec, "image") or None
+
+def iter_chunks(stream, fmt, categories, report, chunk_size=IMPORT_CHUNK):
+    """
+    Пачки разобранных строк. Повторы (категория, марка, option) внутри пачки
+    схлопываются — побеждает последняя строка, как если бы они шли по очереди.
+    """
+    records = _jsonl_records(stream) if fmt == "jsonl" else _csv_records(stream)
+    while True:
+        block = list(islice(records, chunk_size))
+        if not block:
+            return
+        rows = {}
+        for line, rec, error in block:
+            if error is None:
+                try:
+                    row = parse_row(rec, categories)
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                report.reject(line, error)
+                continue
+            key = row[:3]
+            if key in rows:
+                report.updated += 1
+            rows[key] = row
+        if rows:
+            yield list(rows.values())
+
+# ---------- запись ----------
+def load_categories(conn):
+    return {r["name"].lower(): r["id"] for r in conn.execute("SELECT id, name FROM categories")}
+
+def import_chunk(conn, rows):
+    """
+    Записывает пачку (внутри транзакции вызывающего). Возвращает
+    (добавлено вариантов, обновлено вариантов, создано марок).
+    """
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS import_rows (
+            category_id INTEGER NOT NULL,
+            brand TEXT NOT NULL,
+            option TEXT NOT NULL,
+            price REAL NOT NULL,
+            stock INTEGER NOT NULL,
+            image TEXT,
+            product_id INTEGER,
+            variant_id INTEGER
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS temp.idx_import_rows_variant ON import_rows(variant_id)")
+    conn.execute("DELETE FROM import_rows")
+    conn.executemany(
+        "INSERT INTO import_rows (category_id, brand, option, price, stock, image) VALUES (?, ?, ?, ?, ?, ?)", rows
+    )
+    brands = conn.execute("""
+        INSERT INTO products (brand, category_id)
+        SELECT DISTINCT s.brand, s.category_id FROM import_rows s
+        WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.category_id = s.category_id AND p.brand = s.brand)
+    """).rowcount
+    # id марок и существующих вариантов — по составным индексам (category_id, brand) и (product_id, option)
+    conn.execute("""
+        UPDATE import_rows SET product_id = (
+            SELECT MIN(p.id) FROM products p
+            WHERE p.category_id = import_rows.category_id AND p.brand = import_rows.brand
+        )
+    """)
+    conn.execute("""
+        UPDATE import_rows SET variant_id = (
+            SELECT MIN(v.id) FROM variants v
+            WHERE v.product_id = import_rows.product_id AND v.option = import_rows.option
+        )
+    """)
+    updated = conn.execute("""
+        UPDATE variants SET (price, stock, image_id) = (
+            SELECT s.price, s.stock, COALESCE(s.image, variants.image_id)
+            FROM import_rows s WHERE s.variant_id = variants.id
+        )
+        WHERE id IN (SELECT variant_id FROM import_rows WHERE variant_id IS NOT NULL)
+    """).rowcount
+    inserted = conn.execute("""
+        INSERT INTO variants (product_id, option, price, stock, image_id)
+        SELECT product_id, option, price, stock, image FROM import_rows WHERE variant_id IS NULL
+    """).rowcount
+    conn.execute("DELETE FROM import_rows")
+    return inserted, updated, brands
+
+async def import_file(path, fmt=None):
+    """
+    Импорт из бота: разбор идёт в потоке, каждая пачка — отдельная команда
+    очереди записи, так что обычные записи магазина проходят между пачками.
+    """
+    fmt = fmt or detect_format(path)
+    report = ImportReport()
+    categories = await database.run_db(load_categories)
+    loop = asyncio.get_running_loop()
+    with open(path, encoding="utf-8-sig", newline="") as stream:
+        chunks = iter_chunks(stream, fmt, categories, report)
+        while True:
+            rows = await loop.run_in_executor(None, next, chunks, None)
+            if rows is None:
+                break
+            report.add(await database.transaction(import_chunk, rows))
+    return report
+
+def import_path(path, fmt=None):
+    """Синхронный импорт для CLI."""
+    fmt = fmt or detect_format(path)
+    report = ImportReport()
+    conn = database.get_connection()
+    try:
+        categories = load_categories(conn)
+        with open(path, encoding="utf-8-sig", newline="") as stream:
+            for rows in iter_chunks(stream, fmt, categories, report):
+                report.add(database.run_immediate(conn, import_chunk, rows))
+    finally:
+        conn.close()
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Импорт вариантов из CSV/JSONL")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("csv", "jsonl"))
+    args = parser.parse_args()
+    database.init_db()
+    result = import_path(args.path, args.format)
+    print(result.summary())
+    sys.exit(1 if result.rejected and not (result.inserted or result.updated) else 0)
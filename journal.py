@@ -0,0 +1,219 @@
+# journal.py
+"""
+Журнал входящих апдейтов для воспроизведения нагрузки (benchmarks/replay.py).
+
+Включается JOURNAL_DIR. Апдейт записывается в момент поступления в бота —
+до очереди апдейтов, ChatSequencer и обработчиков, поэтому время в журнале —
+это форма входящего потока, а не скорость обработки:
+  webhook — тело POST от Telegram как есть (webhook.serve), после того как
+            апдейт принят в очередь;
+  polling — update_queue заменяется на JournalQueue: Update пишется, когда
+            Updater кладёт его в очередь. Исходного JSON getUpdates здесь уже
+            нет, в журнал идёт Update.to_dict() — разбор и обратная
+            сериализация python-telegram-bot (поля, которых библиотека не
+            знает, теряются).
+
+В потоке бота апдейт и время только кладутся в ограниченную очередь.
+Отдельный поток пачками дописывает строки {"t": время, "update": {...}}
+в JOURNAL_DIR/updates-<время>.jsonl. Файл больше JOURNAL_MAX_MB сжимается в
+.jsonl.gz, и начинается новый; хранятся последние JOURNAL_KEEP сжатых файлов.
+Если очередь переполнена (диск не успевает), апдейт не записывается и
+считается в dropped — бот из-за журнала не тормозит.
+
+В журнале — сообщения пользователей как есть: храните его как персональные данные.
+"""
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "")
+JOURNAL_MAX_BYTES = int(float(os.getenv("JOURNAL_MAX_MB", "64")) * 1024 * 1024)
+JOURNAL_KEEP = int(os.getenv("JOURNAL_KEEP", "50"))
+JOURNAL_QUEUE_SIZE = int(os.getenv("JOURNAL_QUEUE_SIZE", "10000"))
+# апдейтов за одну запись в файл
+JOURNAL_BATCH = 500
+
+FILE_PREFIX = "updates-"
+
+
+class UpdateJournal:
+    def __init__(self, directory, max_bytes=JOURNAL_MAX_BYTES, keep=JOURNAL_KEEP, queue_size=JOURNAL_QUEUE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.rotations = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._file = None
+        self._path = None
+        self._size = 0
+        self._files = 0
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="journal", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Дописывает очередь, сжимает текущий файл и останавливает поток."""
+        if self._thread is None:
+            return
+        # стоп-метка ставится и в полную очередь: поток её дождётся
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped, "errors": self.errors,
+                "rotations": self.rotations, "queued": self._queue.qsize()}
+
+    def record(self, update, received_at=None):
+        """Апдейт в очередь записи: исходный JSON (bytes/str), dict или Update."""
+        try:
+            self._queue.put_nowait((received_at or time.time(), update))
+        except queue.Full:
+            self.dropped += 1
+
+    # ---------- поток записи ----------
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            stopping = self._drain(batch)
+            lines = []
+            for received_at, update in batch:
+                try:
+                    lines.append(_line(received_at, update))
+                except Exception:
+                    self.errors += 1
+                    logger.exception("Журнал: не удалось сериализовать апдейт")
+            if lines:
+                self._write(("\n".join(lines) + "\n").encode())
+                self.written += len(lines)
+        self._close()
+
+    def _drain(self, batch):
+        while len(batch) < JOURNAL_BATCH:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return False
+            if item is None:
+                return True
+            batch.append(item)
+        return False
+
+    def _write(self, data):
+        try:
+            if self._file is None:
+                # номер файла — на случай нескольких ротаций за секунду
+                self._files += 1
+                stamp = time.strftime("%Y%m%d-%H%M%S")
+                name = f"{FILE_PREFIX}{stamp}-{os.getpid()}-{self._files:04d}.jsonl"
+                self._path = os.path.join(self.directory, name)
+                self._file = open(self._path, "ab")
+                self._size = self._file.tell()
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+            if self._size >= self.max_bytes:
+                self._close()
+                self.rotations += 1
+        except OSError:
+            self.errors += 1
+            logger.exception("Журнал: ошибка записи в %s", self._path)
+
+    def _close(self):
+        """Закрывает текущий файл и сжимает его в .gz."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            with open(self._path, "rb") as src, gzip.open(self._path + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self._path)
+        except OSError:
+            self.errors += 1
+            logger.exception("Журнал: не удалось сжать %s", self._path)
+        self._prune()
+
+    def _prune(self):
+        archives = sorted(glob.glob(os.path.join(self.directory, FILE_PREFIX + "*.jsonl.gz")))
+        for path in archives[:max(0, len(archives) - self.keep)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _line(received_at, update):
+    t = round(received_at, 6)
+    if isinstance(update, (bytes, str)):
+        raw = update.decode() if isinstance(update, bytes) else update
+        raw = raw.strip()
+        if "\n" not in raw and "\r" not in raw:
+            # исходный JSON вставляется в строку журнала без разбора
+            return f'{{"t":{t},"update":{raw}}}'
+        update = json.loads(raw)
+    elif isinstance(update, Update):
+        update = update.to_dict()
+    return json.dumps({"t": t, "update": update}, ensure_ascii=False, separators=(",", ":"))
+
+
+class JournalQueue(asyncio.Queue):
+    """update_queue для polling: Update пишется в журнал, когда Updater кладёт его в очередь."""
+
+    def __init__(self, update_journal, maxsize=0):
+        super().__init__(maxsize)
+        self.journal = update_journal
+
+    def put_nowait(self, item):
+        super().put_nowait(item)
+        # кроме служебных меток Application (остановка)
+        if isinstance(item, Update):
+            self.journal.record(item)
+
+
+# ---------- чтение ----------
+def journal_files(paths):
+    """Файлы журнала по путям (файлы или каталоги) в порядке записи."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, FILE_PREFIX + "*.jsonl*")))
+        else:
+            files.append(path)
+    return files
+
+def read(paths):
+    """(время, dict апдейта) по всем файлам журнала, .jsonl и .jsonl.gz."""
+    for path in journal_files(paths):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # последняя строка файла, оборванная при аварийной остановке
+                    continue
+                yield entry["t"], entry["update"]
@@ -0,0 +1,282 @@
+# metrics.py
+"""
+Метрики в формате Prometheus на локальном HTTP-эндпоинте
+http://METRICS_LISTEN:METRICS_PORT/metrics (METRICS_PORT=0 — выключено).
+
+Собирается всегда, но дёшево: наблюдение — bisect по границам корзин и два
+сложения под блокировкой; текст формируется только при запросе /metrics,
+там же опрашиваются «живые» значения — очереди апдейтов, записи в БД и
+исходящих запросов, кэши экранов.
+
+    bot_handler_seconds{handler}           время обработчиков (instrument_handlers)
+    bot_db_seconds{query}                  запросы к БД: текст SQL или имя функции
+    bot_telegram_api_seconds{method}       вызовы Bot API (ratelimit.py)
+    bot_telegram_api_errors_total{method,error}
+    bot_swallowed_errors_total{where}      ошибки, после которых обработчик продолжает работу
+    bot_event_loop_lag_seconds             насколько позже срока просыпается таймер (watch_loop_lag)
+"""
+import asyncio
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# как часто замерять запаздывание event loop
+LOOP_LAG_INTERVAL = 0.1
+
+_registry = []
+_gauges = {}        # имя -> Gauge: повторная регистрация заменяет функцию
+_app_gauges = {}    # показатели из register_app: имя -> id приложения
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}       # labels -> [счётчики по корзинам (+Inf последняя), сумма]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, labels, seconds):
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += seconds
+
+    def snapshot(self):
+        """{метки: (счётчики по корзинам, сумма)} — копия на текущий момент."""
+        with self._lock:
+            return {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in items]
+        return lines
+
+
+class Gauge:
+    """Значение считается при запросе: fn() -> число или {labels: число}."""
+
+    def __init__(self, name, help, labelnames, fn):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.fn = fn
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines += [f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in sorted(values.items())]
+        return lines
+
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время обработчика апдейта", ("handler",))
+DB_SECONDS = Histogram("bot_db_seconds", "Время запроса к БД в потоке БД", ("query",))
+API_SECONDS = Histogram("bot_telegram_api_seconds", "Время вызова Bot API без ожидания лимитов", ("method",))
+API_ERRORS = Counter("bot_telegram_api_errors_total", "Ошибки вызовов Bot API", ("method", "error"))
+SWALLOWED_ERRORS = Counter("bot_swallowed_errors_total", "Перехваченные ошибки, после которых работа продолжается", ("where",))
+LOOP_LAG = Histogram("bot_event_loop_lag_seconds", "Запаздывание таймера event loop", ())
+
+
+def observe_db(label, seconds):
+    DB_SECONDS.observe((label,), seconds)
+
+def swallowed(where):
+    SWALLOWED_ERRORS.inc((where,))
+
+def gauge(name, help, fn, labelnames=()):
+    metric = _gauges.get(name)
+    if metric is None:
+        metric = _gauges[name] = Gauge(name, help, labelnames, fn)
+    else:
+        metric.help, metric.labelnames, metric.fn = help, labelnames, fn
+    return metric
+
+def unregister(name):
+    metric = _gauges.pop(name, None)
+    if metric is not None:
+        _registry.remove(metric)
+
+async def watch_loop_lag(interval=LOOP_LAG_INTERVAL):
+    """
+    Фоновая задача: sleep(interval) просыпается позже срока ровно настолько,
+    насколько event loop был занят обработчиками или синхронным кодом.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe((), max(0.0, loop.time() - started - interval))
+
+def render():
+    lines = []
+    for metric in _registry:
+        try:
+            lines += metric.render()
+        except Exception as e:
+            lines.append(f"# {metric.name}: {e!r}")
+    return ("\n".join(lines) + "\n").encode()
+
+# ---------- обработчики ----------
+def instrument(callback, name=None):
+    """Обёртка async-обработчика, пишущая его время в bot_handler_seconds."""
+    if getattr(callback, "_instrumented", False):
+        return callback
+    if name is None:
+        name = callback.__name__
+        owner = getattr(callback, "__self__", None)
+        if owner is not None:
+            name = f"{type(owner).__name__}.{name}"
+    labels = (name,)
+
+    @wraps(callback)
+    async def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            HANDLER_SECONDS.observe(labels, time.perf_counter() - started)
+
+    timed._instrumented = True
+    return timed
+
+def _instrument_handler(handler, seen):
+    if id(handler) in seen:
+        return
+    seen.add(id(handler))
+    # ConversationHandler: обработчики внутри состояний
+    for attr in ("entry_points", "fallbacks"):
+        for inner in getattr(handler, attr, None) or ():
+            _instrument_handler(inner, seen)
+    states = getattr(handler, "states", None)
+    if isinstance(states, dict):
+        for inner_handlers in states.values():
+            for inner in inner_handlers:
+                _instrument_handler(inner, seen)
+        return
+    # callbacks.RouteHandler: таблица код -> обработчик
+    routes = getattr(handler, "routes", None)
+    if isinstance(routes, dict):
+        for code, callback in routes.items():
+            routes[code] = instrument(callback)
+        return
+    callback = getattr(handler, "callback", None)
+    if callback is not None:
+        handler.callback = instrument(callback)
+
+def instrument_handlers(app):
+    """Оборачивает все зарегистрированные обработчики (вызывать в конце main())."""
+    seen = set()
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler, seen)
+
+def register_app(app):
+    """
+    Показатели, которые считываются при запросе: очереди и кэши. Заменяет
+    показатели предыдущего приложения (бенчмарки создают несколько за процесс).
+    """
+    import database
+    import views
+
+    for name in list(_app_gauges):
+        unregister(name)
+    _app_gauges.clear()
+
+    def app_gauge(name, help, fn, labelnames=()):
+        _app_gauges[name] = id(app)
+        return gauge(name, help, fn, labelnames)
+
+    app_gauge("bot_update_queue_depth", "Апдейты, ждущие обработки", app.update_queue.qsize)
+    app_gauge("bot_db_write_queue_depth", "Команды в очереди записи в БД", database.writer_qsize)
+    processor = app.update_processor
+    if hasattr(processor, "active_chats"):
+        app_gauge("bot_sequenced_chats", "Чаты с апдейтами в обработке или в очереди", lambda: processor.active_chats)
+    limiter = app.bot.rate_limiter
+    if hasattr(limiter, "stats"):
+        app_gauge("bot_rate_limiter", "Очереди и счётчики ограничителя исходящих запросов",
+                  lambda: {(k,): v for k, v in limiter.stats().items()}, ("stat",))
+    debouncer = app.bot_data.get("debouncer")
+    if debouncer is not None:
+        app_gauge("bot_debounce", "Отброшенные и пропущенные нажатия кнопок",
+                  lambda: {(k,): v for k, v in debouncer.stats().items()}, ("stat",))
+    update_journal = app.bot_data.get("journal")
+    if update_journal is not None:
+        app_gauge("bot_journal", "Журнал апдейтов: записано, потеряно, в очереди",
+                  lambda: {(k,): v for k, v in update_journal.stats().items()}, ("stat",))
+    app_gauge("bot_view_cache", "Кэш экранов магазина",
+              lambda: {(k,): v for k, v in views.view_cache.stats().items()}, ("stat",))
+    app_gauge("bot_render_memo", "Память последних показанных сообщений",
+              lambda: {(k,): v for k, v in views.render_memo.stats().items()}, ("stat",))
+
+def unregister_app(app):
+    """Убирает показатели приложения (post_shutdown): замыкания больше не держат его."""
+    for name, owner in list(_app_gauges.items()):
+        if owner == id(app):
+            unregister(name)
+            del _app_gauges[name]
+
+# ---------- HTTP ----------
+async def start_server(host=METRICS_LISTEN, port=METRICS_PORT):
+    """HTTP-сервер с /metrics на помощниках webhook.py или None, если METRICS_PORT=0."""
+    if not port:
+        return None
+    from webhook import HTTPServer, response
+
+    async def metrics_page(headers, body):
+        return response(200, render(), "text/plain; version=0.0.4; charset=utf-8")
+
+    server = HTTPServer(host, port)
+    server.route("GET", "/metrics", metrics_page)
+    return await server.start()
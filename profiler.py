@@ -0,0 +1,126 @@
+# profiler.py
+"""
+Профилирование работающего бота по команде администратора (/profile).
+
+sample   — отдельный поток каждые PROFILE_SAMPLE_MS снимает стеки всех потоков
+           (event loop, потоки БД, писатель) через sys._current_frames();
+           отчёт — collapsed stacks («поток;f1;f2;f3 N»), их понимают
+           flamegraph.pl и speedscope. Накладные расходы — доли процента.
+cprofile — cProfile в потоке event loop (все обработчики и корутины);
+           отчёт — таблица pstats по cumulative. Заметно замедляет бота, пока включён.
+
+Вне профилирования ничего не работает и ничего не стоит: поток сэмплера и
+cProfile создаются только на время замера.
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_MS", "5")) / 1000
+# строк в отчёте pstats
+PSTATS_LINES = 80
+
+SAMPLE, CPROFILE = "sample", "cprofile"
+MODES = (SAMPLE, CPROFILE)
+
+_running = False
+
+
+class ProfilerBusy(Exception):
+    """Профилирование уже идёт."""
+
+
+class StackSampler:
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()     # «поток;кадр;…» -> сколько раз встретился
+        self.leaves = Counter()     # верхний кадр -> сколько раз
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if not stack:
+                    continue
+                stack.reverse()
+                self.stacks[";".join([names.get(ident, str(ident))] + stack)] += 1
+                self.leaves[stack[-1]] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top=5):
+        total = sum(self.leaves.values()) or 1
+        lines = [f"Снимков: {self.samples}"]
+        lines += [f"{count * 100 / total:.1f}% {leaf}" for leaf, count in self.leaves.most_common(top)]
+        return "\n".join(lines)
+
+
+def profile(seconds, mode=SAMPLE):
+    """
+    Занимает профилировщик сразу, при вызове (ProfilerBusy, если замер уже
+    идёт), и запускает замер на seconds секунд задачей; её результат —
+    (отчёт в байтах, имя файла, краткая сводка). Профилировщик освобождается,
+    когда задача завершилась любым образом, в том числе отменена до старта.
+    """
+    global _running
+    if _running:
+        raise ProfilerBusy
+    task = asyncio.create_task(_measure(max(1, min(seconds, PROFILE_MAX_SECONDS)), mode))
+    _running = True
+    task.add_done_callback(_release)
+    return task
+
+def _release(task):
+    global _running
+    _running = False
+
+async def _measure(seconds, mode):
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    if mode == CPROFILE:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        out = io.StringIO()
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats("cumulative").print_stats(PSTATS_LINES)
+        summary = f"Вызовов: {stats.total_calls}, {stats.total_tt:.2f} с в профилируемом коде"
+        return out.getvalue().encode(), f"profile-{stamp}.txt", summary
+    sampler = StackSampler()
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        # join потока сэмплера — вне event loop
+        await asyncio.get_running_loop().run_in_executor(None, sampler.stop)
+    return sampler.collapsed().encode(), f"stacks-{stamp}.txt", sampler.summary()
@@ -0,0 +1,211 @@
+# ratelimit.py
+"""
+Ограничитель исходящих запросов к Bot API (подключается через
+Application.builder().rate_limiter(...)).
+
+Лимиты Telegram — token bucket'ы:
+    общий       RATE_GLOBAL сообщений в секунду на бота
+    личный чат  RATE_CHAT в секунду, с запасом RATE_CHAT_BURST
+    группа      RATE_GROUP в минуту
+Ограничиваются только запросы, адресованные чату (send*/edit*/copy* и т.п.
+с chat_id или inline_message_id); answerCallbackQuery, getUpdates и прочие
+служебные вызовы идут без очереди.
+
+Приоритет передаётся через rate_limit_args={"priority": BACKGROUND}:
+ожидающие токен запросы обслуживаются по приоритету, затем по порядку
+поступления, так что ответы пользователям обгоняют уведомления из фоновых
+задач. На RetryAfter (429) бакет чата — или общий, если чата нет —
+блокируется на retry_after, и запрос повторяется до MAX_RETRIES раз.
+
+stats() — глубина очередей по приоритетам и счётчики для мониторинга.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import Counter
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RATE_GLOBAL = float(os.getenv("RATE_GLOBAL", "30"))
+RATE_CHAT = float(os.getenv("RATE_CHAT", "1"))
+RATE_CHAT_BURST = int(os.getenv("RATE_CHAT_BURST", "3"))
+RATE_GROUP = float(os.getenv("RATE_GROUP", "20"))
+MAX_RETRIES = int(os.getenv("RATE_MAX_RETRIES", "3"))
+# сколько бакетов чатов держать, прежде чем выбрасывать полные и простаивающие
+MAX_CHAT_BUCKETS = 10000
+
+INTERACTIVE, BACKGROUND = 0, 10
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+BACKGROUND_ARGS = {"priority": BACKGROUND}
+
+
+async def _timed_call(endpoint, callback, args, kwargs):
+    started = time.perf_counter()
+    try:
+        return await callback(*args, **kwargs)
+    except Exception as e:
+        metrics.API_ERRORS.inc((endpoint, type(e).__name__))
+        raise
+    finally:
+        metrics.API_SECONDS.observe((endpoint,), time.perf_counter() - started)
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity; ожидающие — в куче (priority, seq)."""
+
+    _seq = itertools.count()
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._waiters = []
+        self._timer = None
+
+    @property
+    def idle(self):
+        self._refill(time.monotonic())
+        return not self._waiters and self.tokens >= self.capacity and self.blocked_until <= time.monotonic()
+
+    def block(self, seconds):
+        """Flood control: не выдавать токены seconds секунд."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        # после блокировки — один запрос сразу, дальше токены копятся заново
+        self.tokens = 1
+        self.updated = self.blocked_until
+        self._reschedule()
+
+    async def acquire(self, priority=INTERACTIVE):
+        if not self._waiters and self._take(time.monotonic()):
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._reschedule()
+        await future
+
+    def _refill(self, now):
+        if now <= self.updated:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self, now):
+        if now < self.blocked_until:
+            return False
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def _reschedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._waiters:
+            return
+        now = time.monotonic()
+        self._refill(now)
+        delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+
+    def _wake(self):
+        self._timer = None
+        now = time.monotonic()
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():           # ожидающий отменён
+                heapq.heappop(self._waiters)
+                continue
+            if not self._take(now):
+                break
+            heapq.heappop(self._waiters)
+            future.set_result(None)
+        self._reschedule()
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    def __init__(self, rate_global=RATE_GLOBAL, rate_chat=RATE_CHAT, chat_burst=RATE_CHAT_BURST,
+                 rate_group=RATE_GROUP, max_retries=MAX_RETRIES):
+        self.rate_chat = rate_chat
+        self.chat_burst = chat_burst
+        self.rate_group = rate_group
+        self.max_retries = max_retries
+        self._global = TokenBucket(rate_global, max(1, int(rate_global)))
+        self._chats = {}
+        self.queued = Counter()     # priority -> запросов ждут токен
+        self.counters = Counter()   # sent / throttled / retry_after / passthrough
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        stats = {f"queued_{PRIORITY_NAMES.get(p, p)}": n for p, n in self.queued.items()}
+        stats.update(self.counters)
+        stats["chat_buckets"] = len(self._chats)
+        return stats
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle}
+            # группы/каналы: id < 0 или @username
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(self.rate_group / 60, max(1, int(self.rate_group)))
+            else:
+                bucket = TokenBucket(self.rate_chat, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_bucket, priority):
+        started = time.monotonic()
+        self.queued[priority] += 1
+        try:
+            # сначала чат: ожидание своего чата не должно держать общий токен
+            if chat_bucket is not None:
+                await chat_bucket.acquire(priority)
+            await self._global.acquire(priority)
+        finally:
+            self.queued[priority] -= 1
+        if time.monotonic() - started > 0.001:
+            self.counters["throttled"] += 1
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None and "inline_message_id" not in data:
+            self.counters["passthrough"] += 1
+            return await _timed_call(endpoint, callback, args, kwargs)
+
+        rate_limit_args = rate_limit_args or {}
+        priority = rate_limit_args.get("priority", INTERACTIVE)
+        max_retries = rate_limit_args.get("max_retries", self.max_retries)
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+        for attempt in range(max_retries + 1):
+            await self._acquire(chat_bucket, priority)
+            try:
+                result = await _timed_call(endpoint, callback, args, kwargs)
+            except RetryAfter as e:
+                self.counters["retry_after"] += 1
+                if attempt == max_retries:
+                    raise
+                delay = e.retry_after
+                delay = delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay)
+                logger.warning("%s в чат %s: flood control, повтор через %.1f с", endpoint, chat_id, delay)
+                (chat_bucket or self._global).block(delay)
+                continue
+            self.counters["sent"] += 1
+            return result
@@ -0,0 +1,89 @@
+# search.py
+"""
+Поиск вариантов по марке, варианту и категории (FTS5-таблица search_index,
+см. database.py). Каждое слово запроса — префикс, все слова обязательны:
+«elf 20» найдёт «Elf Bar — 20 mg». Выдача — только в наличии, по bm25,
+совпадение в марке весит больше, чем в варианте и категории.
+
+В search_index только варианты в наличии (их ведут триггеры, см. database.py),
+так что JOIN variants не нужен и отсутствующие не занимают места среди
+кандидатов. bm25 считается для каждой ранжируемой строки, поэтому набор
+кандидатов ограничен до ранжирования: SEARCH_CANDIDATES самых новых
+совпадений, их FTS отдаёт по rowid без подсчёта bm25. Для узких запросов
+(«elf 20») это все совпадения; для слишком общих («ma») ранжируются только
+новые — время поиска остаётся в единицах мс при любом размере каталога.
+Набор кандидатов детерминирован, так что страницы inline-выдачи не
+пересекаются и не теряют строк; выдача кончается на SEARCH_CANDIDATES.
+
+Если FTS ничего не нашёл («elfbar», «эльф бар», «Xiaomy»), find() берёт
+похожие марки и варианты из триграммного индекса каталога (fuzzy.py).
+"""
+import os
+import re
+from collections import namedtuple
+
+from database import run_db
+from catalog import catalog
+from fuzzy import BRAND
+
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", "20"))
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "1000"))
+# слова короче — не ищем (у индекса префиксы от 2 символов)
+MIN_TOKEN_LEN = 2
+MAX_TOKENS = 8
+
+_TOKEN = re.compile(r"\w+")
+
+# fuzzy=True — точных совпадений нет, это похожие марки/варианты
+SearchResult = namedtuple("SearchResult", "variants fuzzy")
+
+
+def fts_query(text):
+    """Текст пользователя -> запрос MATCH ('"elf"* "20"*') или '' если искать нечего."""
+    tokens = [t for t in _TOKEN.findall(text.lower()) if len(t) >= MIN_TOKEN_LEN]
+    return " ".join(f'"{t}"*' for t in tokens[:MAX_TOKENS])
+
+def _search(conn, query, limit, offset):
+    rows = conn.execute("""
+        SELECT rowid FROM (
+            SELECT rowid, bm25(search_index, 10.0, 5.0, 2.0) AS score FROM search_index
+            WHERE search_index MATCH ? ORDER BY rowid DESC LIMIT ?
+        )
+        ORDER BY score, rowid
+        LIMIT ? OFFSET ?
+    """, (query, SEARCH_CANDIDATES, limit, offset)).fetchall()
+    return [r[0] for r in rows]
+
+async def search_variants(text, limit=SEARCH_LIMIT, offset=0):
+    """[Variant] из снимка каталога в порядке релевантности."""
+    query = fts_query(text)
+    if not query:
+        return []
+    ids = await run_db(_search, query, limit, offset)
+    return [catalog.variants[i] for i in ids if i in catalog.variants]
+
+def fuzzy_variants(text, limit=SEARCH_LIMIT):
+    """Варианты в наличии у похожих марок и похожие варианты, по убыванию похожести."""
+    found, seen = [], set()
+    for _, kind, ids in catalog.fuzzy.top(text, k=limit):
+        for entity_id in ids:
+            if kind == BRAND:
+                variants = catalog.variants_page(entity_id, limit=limit).items
+            else:
+                variant = catalog.variants.get(entity_id)
+                variants = [variant] if variant and variant.stock > 0 else []
+            for variant in variants:
+                if variant.id in seen:
+                    continue
+                seen.add(variant.id)
+                found.append(variant)
+                if len(found) >= limit:
+                    return found
+    return found
+
+async def find(text, limit=SEARCH_LIMIT, offset=0):
+    """SearchResult: сначала FTS, при пустой первой странице — нечёткий поиск."""
+    variants = await search_variants(text, limit, offset)
+    if variants or offset:
+        return SearchResult(variants, False)
+    return SearchResult(fuzzy_variants(text, limit), True)
@@ -0,0 +1,57 @@
+# sequencer.py
+"""
+Параллельная обработка апдейтов с сохранением порядка внутри чата.
+
+До workers апдейтов обрабатываются одновременно, но апдейты одного чата
+идут строго по очереди: у каждого чата свой asyncio.Lock (FIFO), и только
+апдейт, дождавшийся своей очереди в чате, берёт слот воркера. Апдейты,
+ждущие предыдущий апдейт своего чата, слотов не занимают: чат, приславший
+сразу 50 апдейтов (альбом, флуд нажатиями), не останавливает остальные чаты.
+Так переходы ConversationHandler (per_chat) остаются последовательными.
+
+Семафор библиотеки (process_update, он final) здесь ограничивает не
+воркеров, а число апдейтов в системе — обрабатываемых и ждущих в очередях
+чатов (max_pending); сверх этого апдейты ждут в очереди Application.
+
+Апдейты без чата (inline-запросы) не упорядочиваются.
+"""
+import asyncio
+
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatSequencer(BaseUpdateProcessor):
+    def __init__(self, workers, max_pending=1024):
+        super().__init__(max(workers, max_pending))
+        self.workers = workers
+        self._workers = asyncio.Semaphore(workers)
+        self._chats = {}    # chat_id -> [Lock, сколько апдейтов держат/ждут]
+
+    @property
+    def active_chats(self):
+        return len(self._chats)
+
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, "effective_chat", None)
+        if chat is None:
+            async with self._workers:
+                await coroutine
+            return
+        entry = self._chats.get(chat.id)
+        if entry is None:
+            entry = self._chats[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._workers:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,83 @@
+# tests/test_checkout_expiry.py
+"""Снятие просроченных резервов корзины: checkout.expire_due и фоновая задача без JobQueue."""
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+os.environ.setdefault("METRICS_PORT", "0")
+
+import bot
+import checkout
+import database
+
+
+class ExpiryTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._db_name = database.DB_NAME
+        database.DB_NAME = os.path.join(self._dir.name, "products.db")
+        database.init_db()
+        conn = database.get_connection()
+        cat_id = conn.execute("SELECT id FROM categories ORDER BY id LIMIT 1").fetchone()[0]
+        prod_id = conn.execute("INSERT INTO products (brand, category_id) VALUES (?, ?)",
+                               ("Expiry", cat_id)).lastrowid
+        self.var_id = conn.execute("INSERT INTO variants (product_id, option, price, stock) VALUES (?, ?, ?, ?)",
+                                   (prod_id, "a", 100, 5)).lastrowid
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        database.close_pool()
+        database.DB_NAME = self._db_name
+        self._dir.cleanup()
+
+    def _query(self, sql, params=()):
+        conn = database.get_connection()
+        try:
+            return conn.execute(sql, params).fetchone()
+        finally:
+            conn.close()
+
+    def _reserve(self, user_id, qty, ttl):
+        conn = database.get_connection()
+        try:
+            return database.run_immediate(conn, checkout.reserve, user_id, user_id, self.var_id, qty, ttl)
+        finally:
+            conn.close()
+
+    def test_expire_due_releases_only_due_carts(self):
+        due = self._reserve(1, 2, ttl=60)
+        live = self._reserve(2, 1, ttl=600)
+        self.assertEqual(live.stock, 2)
+
+        conn = database.get_connection()
+        try:
+            changes = database.run_immediate(conn, checkout.expire_due, time.time() + 120)
+        finally:
+            conn.close()
+
+        self.assertEqual(changes, [(self.var_id, 4)])
+        self.assertEqual(self._query("SELECT status FROM orders WHERE id = ?", (due.order_id,))[0], checkout.EXPIRED)
+        self.assertEqual(self._query("SELECT status FROM orders WHERE id = ?", (live.order_id,))[0], checkout.CART)
+        self.assertEqual(self._query("SELECT stock FROM variants WHERE id = ?", (self.var_id,))[0], 4)
+
+    async def test_sweep_loop_expires_without_job_queue(self):
+        order = self._reserve(1, 3, ttl=0)
+        await database.start_writer()
+        sweep = asyncio.create_task(bot.sweep_expired_loop(interval=0.05))
+        try:
+            for _ in range(40):
+                await asyncio.sleep(0.05)
+                if self._query("SELECT status FROM orders WHERE id = ?", (order.order_id,))[0] == checkout.EXPIRED:
+                    break
+        finally:
+            sweep.cancel()
+            await database.stop_writer()
+        self.assertEqual(self._query("SELECT status FROM orders WHERE id = ?", (order.order_id,))[0], checkout.EXPIRED)
+        self.assertEqual(self._query("SELECT stock FROM variants WHERE id = ?", (self.var_id,))[0], 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
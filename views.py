@@ -0,0 +1,154 @@
+# views.py
+"""
+Готовые экраны магазина (текст + InlineKeyboardMarkup).
+Все пользователи видят одинаковые меню, поэтому экран строится один раз на
+версию своей категории/марки и дальше берётся из LRU-кэша.
+"""
+import os
+from collections import OrderedDict, namedtuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import callbacks as cb
+from catalog import catalog
+
+VIEW_CACHE_SIZE = int(os.getenv("VIEW_CACHE_SIZE", "1024"))
+RENDER_MEMO_SIZE = int(os.getenv("RENDER_MEMO_SIZE", "10000"))
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "20"))
+
+# empty=True — экран-заглушка «нет в наличии»
+View = namedtuple("View", "text reply_markup empty")
+
+
+class ViewCache:
+    def __init__(self, maxsize=VIEW_CACHE_SIZE):
+        self.maxsize = max(1, maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, render):
+        view = self._data.get(key)
+        if view is not None:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return view
+        self.misses += 1
+        view = render()
+        self._data[key] = view
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        return view
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class RenderMemo:
+    """
+    Что последним показано в каждом сообщении: (chat_id, message_id) -> отпечаток
+    текста и клавиатуры. Повторное нажатие той же кнопки не редактирует
+    сообщение заново (Telegram ответил бы «message is not modified»).
+    """
+
+    def __init__(self, maxsize=RENDER_MEMO_SIZE):
+        self.maxsize = max(1, maxsize)
+        self.skipped = 0
+        self._data = OrderedDict()
+
+    def same(self, key, fingerprint):
+        if self._data.get(key) != fingerprint:
+            return False
+        self._data.move_to_end(key)
+        self.skipped += 1
+        return True
+
+    def remember(self, key, fingerprint):
+        self._data[key] = fingerprint
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize, "skipped": self.skipped}
+
+
+def fingerprint(*parts):
+    """Отпечаток содержимого сообщения; клавиатуры PTB сравниваются и хэшируются по значению."""
+    return hash(parts)
+
+
+view_cache = ViewCache()
+render_memo = RenderMemo()
+
+
+def option_label(category):
+    return "Цвет" if category.option_type == "color" else "Крепость"
+
+def _back(callback_data):
+    return [InlineKeyboardButton("⬅️ Назад", callback_data=callback_data)]
+
+def page_nav(code, entity_id, first_id, last_id, has_prev, has_next):
+    """Ряд кнопок ◀️/▶️; курсор — id крайней строки текущей страницы."""
+    row = []
+    if has_prev:
+        row.append(InlineKeyboardButton("◀️", callback_data=cb.encode(code, entity_id, *cb.page_cursor(before=first_id))))
+    if has_next:
+        row.append(InlineKeyboardButton("▶️", callback_data=cb.encode(code, entity_id, *cb.page_cursor(after=last_id))))
+    return row
+
+# ---------- рендеринг ----------
+def _render_category_list(in_stock_only):
+    cats = catalog.list_categories(in_stock_only=in_stock_only)
+    keyboard = [[InlineKeyboardButton(c.name, callback_data=cb.encode(cb.CATEGORY, c.id))] for c in cats]
+    keyboard.append([InlineKeyboardButton("🧺 Корзина", callback_data=cb.encode(cb.CART))])
+    return View("🛍 Выберите категорию:", InlineKeyboardMarkup(keyboard), not cats)
+
+def _render_category_page(cat_id, after, before):
+    category = catalog.categories.get(cat_id)
+    page = catalog.products_page(cat_id, after, before, PAGE_SIZE)
+    products = page.items
+    if not category or not products:
+        return View("❌ Нет товаров в наличии.", InlineKeyboardMarkup([_back(cb.encode(cb.CATEGORIES))]), True)
+    keyboard = [[InlineKeyboardButton(f"{p.brand} ({stock} шт)", callback_data=cb.encode(cb.BRAND, p.id))]
+                for p, stock in products]
+    nav = page_nav(cb.CATEGORY, cat_id, products[0][0].id, products[-1][0].id, page.has_prev, page.has_next)
+    if nav:
+        keyboard.append(nav)
+    keyboard.append(_back(cb.encode(cb.CATEGORIES)))
+    return View(f"📦 Товары в категории «{category.name}»:", InlineKeyboardMarkup(keyboard), False)
+
+def _render_brand_page(prod_id, after, before):
+    product = catalog.products.get(prod_id)
+    if not product:
+        return None
+    back = _back(cb.encode(cb.CATEGORY, product.category_id))
+    page = catalog.variants_page(prod_id, after, before, PAGE_SIZE)
+    variants = page.items
+    if not variants:
+        return View("❌ Нет доступных вариантов.", InlineKeyboardMarkup([back]), True)
+    label = option_label(catalog.categories[product.category_id])
+    keyboard = [[InlineKeyboardButton(f"{v.option} — {int(v.price)}₽ ({v.stock} шт)", callback_data=cb.encode(cb.VARIANT, v.id))]
+                for v in variants]
+    nav = page_nav(cb.BRAND, prod_id, variants[0].id, variants[-1].id, page.has_prev, page.has_next)
+    if nav:
+        keyboard.append(nav)
+    keyboard.append(back)
+    return View(f"🔹 {product.brand} — {label}:", InlineKeyboardMarkup(keyboard), False)
+
+# ---------- публичные функции ----------
+def category_list(in_stock_only=False):
+    key = ("categories", in_stock_only, catalog.categories_version())
+    return view_cache.get(key, lambda: _render_category_list(in_stock_only))
+
+def category_page(cat_id, after=None, before=None):
+    key = ("category", cat_id, after, before, catalog.category_version(cat_id))
+    return view_cache.get(key, lambda: _render_category_page(cat_id, after, before))
+
+def brand_page(prod_id, after=None, before=None):
+    """View страницы марки или None, если марки нет в каталоге."""
+    key = ("brand", prod_id, after, before, catalog.product_version(prod_id))
+    return view_cache.get(key, lambda: _render_brand_page(prod_id, after, before))
@@ -0,0 +1,341 @@
+# webhook.py
+"""
+Режим webhook без дополнительных зависимостей: маленький HTTP/1.1-сервер на
+asyncio.start_server принимает апдейты от Telegram, проверяет секрет
+(X-Telegram-Bot-Api-Secret-Token), кладёт апдейт в ограниченную очередь
+Application и сразу отвечает 200 — обработка идёт уже после ответа.
+Если очередь полна, отвечаем 503, и Telegram повторит доставку позже.
+
+Включается BOT_MODE=webhook (по умолчанию бот работает через polling):
+    WEBHOOK_URL        публичный https-адрес; если задан — вызывается setWebhook
+    WEBHOOK_LISTEN     адрес, по умолчанию 0.0.0.0
+    WEBHOOK_PORT       порт, по умолчанию 8080
+    WEBHOOK_PATH       путь, по умолчанию /telegram
+    WEBHOOK_SECRET     секрет; без WEBHOOK_URL обязателен (иначе генерируется)
+    WEBHOOK_QUEUE_SIZE размер очереди апдейтов, по умолчанию 1000
+
+Проверка локально — отправить записанные апдейты (по JSON на строку):
+    python webhook.py post updates.jsonl --url http://127.0.0.1:8080/telegram --secret XXX
+"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import signal
+import time
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+# апдейт Telegram — килобайты; больше не читаем
+MAX_BODY = 1024 * 1024
+# сколько держим простаивающее keep-alive соединение
+IDLE_TIMEOUT = 75
+
+_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+            405: "Method Not Allowed", 413: "Payload Too Large", 429: "Too Many Requests",
+            503: "Service Unavailable"}
+
+
+def response(status, body=b"", content_type="text/plain; charset=utf-8"):
+    return status, content_type, body
+
+
+class HTTPServer:
+    """
+    Минимальный HTTP/1.1: keep-alive, Content-Length, без chunked.
+    routes: {(метод, путь): async handler(headers, body) -> response(...)};
+    prefixes: [(метод, префикс, async handler(headers, body, остаток пути))].
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.routes = {}
+        self.prefixes = []
+        self._server = None
+        self._connections = set()
+
+    def route(self, method, path, handler):
+        self.routes[(method, path)] = handler
+
+    def route_prefix(self, method, prefix, handler):
+        self.prefixes.append((method, prefix, handler))
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        # порт 0 — взять выданный системой (для тестов)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # keep-alive соединения и незавершённые ответы закрываются вместе с сервером
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader, writer):
+        # соединение обслуживает своя задача, её и отменяет close(): задача
+        # asyncio.start_server на 3.11 пишет отмену в лог как ошибку
+        task = asyncio.create_task(self._connection(reader, writer))
+        self._connections.add(task)
+        task.add_done_callback(self._connections.discard)
+        try:
+            await asyncio.wait([task])
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+    async def _connection(self, reader, writer):
+        try:
+            while await self._one_request(reader, writer):
+                pass
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _one_request(self, reader, writer):
+        """Обрабатывает один запрос; False — соединение нужно закрыть."""
+        line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+        if not line:
+            return False
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            await self._write(writer, response(400), keep_alive=False)
+            return False
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_BODY:
+            await self._write(writer, response(413 if length > MAX_BODY else 400), keep_alive=False)
+            return False
+        body = await reader.readexactly(length) if length else b""
+
+        path = target.split("?", 1)[0]
+        handler = self.routes.get((method, path))
+        if handler is None:
+            handler = self._prefix_handler(method, path)
+        if handler is None:
+            known_path = any(p == path for _, p in self.routes) or any(
+                path.startswith(prefix) for _, prefix, _ in self.prefixes)
+            result = response(405 if known_path else 404)
+        else:
+            try:
+                result = await handler(headers, body)
+            except Exception:
+                logger.exception("HTTP handler %s %s failed", method, path)
+                result = response(503)
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        await self._write(writer, result, keep_alive)
+        return keep_alive
+
+    def _prefix_handler(self, method, path):
+        for route_method, prefix, handler in self.prefixes:
+            if route_method == method and path.startswith(prefix):
+                rest = path[len(prefix):]
+                return lambda headers, body: handler(headers, body, rest)
+        return None
+
+    @staticmethod
+    async def _write(writer, result, keep_alive):
+        status, content_type, body = result
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+class WebhookReceiver:
+    """Обработчик POST от Telegram: секрет -> JSON -> очередь, без ожидания обработки."""
+
+    def __init__(self, secret, enqueue):
+        self.secret = secret.encode()
+        self.enqueue = enqueue     # enqueue(dict, тело) -> False, если очередь полна
+        self.received = 0
+        self.forbidden = 0
+        self.invalid = 0
+        self.rejected = 0          # очередь полна, Telegram повторит
+
+    async def __call__(self, headers, body):
+        token = headers.get(SECRET_HEADER, "").encode()
+        if not hmac.compare_digest(token, self.secret):
+            self.forbidden += 1
+            return response(403)
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return response(400)
+        if not isinstance(data, dict):
+            return response(400)
+        try:
+            queued = self.enqueue(data, body)
+        except (KeyError, TypeError, ValueError) as e:
+            # JSON-объект, но не Update: 503 Telegram повторял бы бесконечно
+            self.invalid += 1
+            logger.warning("Webhook: не удалось разобрать апдейт: %r", e)
+            return response(400)
+        if not queued:
+            self.rejected += 1
+            return response(503)
+        self.received += 1
+        return response(200)
+
+
+# ---------- запуск Application ----------
+async def serve(app, url=WEBHOOK_URL, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                secret=WEBHOOK_SECRET, stop_event=None):
+    """
+    Жизненный цикл Application вместо run_polling: initialize, post_init,
+    setWebhook, HTTP-сервер, start ... stop, post_shutdown, shutdown.
+    Очередь app.update_queue должна быть ограниченной (см. bot.main).
+    """
+    from telegram import Update
+
+    if not secret:
+        if not url:
+            raise RuntimeError("WEBHOOK_SECRET обязателен, если WEBHOOK_URL не задан")
+        secret = secrets.token_urlsafe(32)
+
+    update_journal = app.bot_data.get("journal")
+
+    def enqueue(data, body):
+        received_at = time.time()
+        try:
+            app.update_queue.put_nowait(Update.de_json(data, app.bot))
+        except asyncio.QueueFull:
+            return False
+        if update_journal is not None:
+            # тело запроса как есть; отклонённые (503) Telegram пришлёт ещё раз
+            update_journal.record(body, received_at)
+        return True
+
+    receiver = WebhookReceiver(secret, enqueue)
+    server = HTTPServer(host, port)
+    server.route("POST", path, receiver)
+    server.route("GET", "/healthz", _healthz)
+    app.bot_data["webhook"] = receiver
+    app.bot_data["http_server"] = server
+
+    stop_event = stop_event or _stop_on_signals()
+    await app.initialize()
+    # дальше любой сбой (занятый порт, неверный URL в setWebhook) всё равно
+    # доходит до post_shutdown/shutdown: writer БД, сервер метрик и поток
+    # журнала запущены уже в post_init
+    try:
+        if app.post_init:
+            await app.post_init(app)
+        if url:
+            await app.bot.set_webhook(url.rstrip("/") + path, secret_token=secret,
+                                      allowed_updates=Update.ALL_TYPES, max_connections=100)
+        await server.start()
+        await app.start()
+        logger.info("Webhook слушает %s:%s%s", host, server.port, path)
+        await stop_event.wait()
+    finally:
+        await server.close()
+        if app.running:
+            await app.stop()
+            if app.post_stop:
+                await app.post_stop(app)
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+        await app.shutdown()
+
+def _stop_on_signals():
+    event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    return event
+
+async def _healthz(headers, body):
+    return response(200, b"ok")
+
+def run(app, **kwargs):
+    asyncio.run(serve(app, **kwargs))
+
+
+# ---------- клиент для локальной проверки ----------
+async def post_updates(url, secret, payloads):
+    """POST каждого payload (bytes/str с JSON) по одному keep-alive соединению; список статусов."""
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    statuses = []
+    try:
+        for payload in payloads:
+            body = payload.encode() if isinstance(payload, str) else payload
+            writer.write((
+                f"POST {parts.path or '/'} HTTP/1.1\r\n"
+                f"Host: {parts.netloc}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"{SECRET_HEADER}: {secret}\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n"
+            ).encode("latin-1") + body)
+            await writer.drain()
+            status_line = await reader.readline()
+            statuses.append(int(status_line.split()[1]))
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            if length:
+                await reader.readexactly(length)
+    finally:
+        writer.close()
+    return statuses
+
+
+if __name__ == "__main__":
+    import argparse
+    from collections import Counter
+
+    parser = argparse.ArgumentParser(description="Отправить записанные апдейты на webhook")
+    sub = parser.add_subparsers(dest="command", required=True)
+    post = sub.add_parser("post")
+    post.add_argument("file", help="JSON-файл с апдейтом или JSONL, по апдейту на строку")
+    post.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    post.add_argument("--secret", default=WEBHOOK_SECRET)
+    args = parser.parse_args()
+
+    with open(args.file, encoding="utf-8") as f:
+        text = f.read()
+    try:
+        updates = [json.dumps(json.loads(text))]
+    except ValueError:
+        updates = [line for line in text.splitlines() if line.strip()]
+    print(dict(Counter(asyncio.run(post_updates(args.url, args.secret, updates)))))